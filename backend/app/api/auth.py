@@ -34,7 +34,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    user = auth_service.get_user_by_username(username)
+    user = await auth_service.get_user_by_username(username)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -59,7 +59,7 @@ async def login(login_data: LoginRequest):
     Raises:
         HTTPException: Если логин или пароль неверны
     """
-    user = auth_service.authenticate_user(login_data.username, login_data.password)
+    user = await auth_service.authenticate_user(login_data.username, login_data.password)
 
     if not user:
         raise HTTPException(
@@ -1,13 +1,18 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import StreamingResponse
-from typing import Optional
-from datetime import date
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import StreamingResponse, FileResponse, Response
+from typing import BinaryIO, Dict, Iterator, List, Optional
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import Float, cast, func, literal, literal_column, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+import asyncio
 import os
 import shutil
-from app.models.database import SessionLocal
-from app.models.outbox_journal import OutboxJournal
+import tempfile
+import zipfile
+from app.core.config import settings
+from app.models.database import SessionLocal, get_async_db
+from app.models.outbox_journal import OutboxJournal, SEARCH_CONFIG
 from app.schemas.journal_schemas import (
     JournalEntryCreate,
     JournalEntryUpdate,
@@ -16,63 +21,200 @@ from app.schemas.journal_schemas import (
 )
 from app.services.excel_service import excel_service
 from app.services.config_service import config_service
+from app.services.numbering_service import numbering_service
+from app.services.stamp_service import stamp_service
+from app.services.signature_verification_service import signature_verification_service
+from app.services.blob_service import blob_service
+from app.services.blob_tiering_service import blob_tiering_service
+from app.services.journal_count_service import journal_count_service
+from app.services.journal_export_service import journal_export_service, EXPORT_NAME_PATTERN
+from app.services.journal_feed_service import journal_feed_service
 from app.api.auth import get_current_user
 
 router = APIRouter(prefix="/api/journal", tags=["journal"])
 
+# Столбцы списка журнала - без BLOB (PDF, подпись, приложения): список из 100 записей
+# читает килобайты; наличие файлов проверяется по хэшу в хранилище или по NULL
+# в BLOB столбце (записи до хранилища) без чтения содержимого
+JOURNAL_LIST_COLUMNS = (
+    OutboxJournal.id,
+    OutboxJournal.outgoing_no,
+    OutboxJournal.formatted_number,
+    OutboxJournal.outgoing_date,
+    OutboxJournal.to_whom,
+    OutboxJournal.executor,
+    OutboxJournal.content,
+    OutboxJournal.folder_path,
+    OutboxJournal.sig_status,
+    OutboxJournal.created_at,
+    or_(OutboxJournal.file_sha256.isnot(None), OutboxJournal.file_blob.isnot(None)).label("has_file"),
+    or_(OutboxJournal.sig_sha256.isnot(None), OutboxJournal.sig_blob.isnot(None)).label("has_sig"),
+    or_(OutboxJournal.attachments.isnot(None), OutboxJournal.attachments_blob.isnot(None)).label("has_attachments"),
+)
 
-def get_db():
-    """Dependency для получения сессии БД"""
-    db = SessionLocal()
+# Столбцы экспорта в XLSX
+JOURNAL_EXPORT_COLUMNS = (
+    OutboxJournal.outgoing_no,
+    OutboxJournal.formatted_number,
+    OutboxJournal.outgoing_date,
+    OutboxJournal.to_whom,
+    OutboxJournal.content,
+    OutboxJournal.executor,
+    OutboxJournal.folder_path,
+)
+
+# Подсветка совпадений поиска в highlight: клиент сам заменяет маркеры разметкой,
+# текст записи не вставляется в страницу как HTML
+SEARCH_HIGHLIGHT_START = "[["
+SEARCH_HIGHLIGHT_STOP = "]]"
+SEARCH_HEADLINE_OPTIONS = f"StartSel={SEARCH_HIGHLIGHT_START}, StopSel={SEARCH_HIGHLIGHT_STOP}, HighlightAll=true"
+# Конфигурация поиска - литералом SQL, как в выражении поискового вектора
+SEARCH_REGCONFIG = literal_column(f"'{SEARCH_CONFIG}'")
+
+# Файлы записи: ссылка на хранилище, BLOB столбец (записи до хранилища), MIME тип, окончание имени файла
+JOURNAL_FILES = {
+    "pdf": (OutboxJournal.file_sha256, OutboxJournal.file_blob, "application/pdf", ".pdf"),
+    "sig": (OutboxJournal.sig_sha256, OutboxJournal.sig_blob, "application/octet-stream", ".pdf.sig"),
+    "attachments": (OutboxJournal.attachments, OutboxJournal.attachments_blob, "application/zip", "_attachments.zip"),
+}
+
+# Файл записи читается из БД (или из хранилища) частями такого размера
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+# Строки экспорта читаются из БД пачками такого размера
+EXPORT_BATCH_SIZE = 1000
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Столбцы выгрузки CSV/NDJSON для внешних систем (см. journal_feed_service)
+JOURNAL_FEED_COLUMNS = (
+    OutboxJournal.id,
+    OutboxJournal.outgoing_no,
+    OutboxJournal.formatted_number,
+    OutboxJournal.outgoing_date,
+    OutboxJournal.to_whom,
+    OutboxJournal.content,
+    OutboxJournal.executor,
+    OutboxJournal.folder_path,
+    OutboxJournal.sig_status,
+    OutboxJournal.created_at,
+)
+
+# Форматы выгрузки: MIME тип и функция сериализации
+JOURNAL_FEED_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", journal_feed_service.iter_csv),
+    "ndjson": ("application/x-ndjson", journal_feed_service.iter_ndjson),
+}
+
+
+def journal_date_filters(year: Optional[int], month: Optional[int]) -> list:
+    """
+    Условия фильтра журнала по году и месяцу - полуоткрытым интервалом дат
+    [начало, начало следующего периода): по нему работает индекс outgoing_date,
+    в отличие от extract(year/month), который вычисляется для каждой строки
+
+    Raises:
+        HTTPException: 400 - неверный год или месяц
+    """
     try:
-        yield db
-    finally:
-        db.close()
+        if year and month:
+            start = date(year, month, 1)
+            end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        elif year:
+            start, end = date(year, 1, 1), date(year + 1, 1, 1)
+        elif month:
+            # Месяц без года - по всем годам, интервалом не выразить
+            if not 1 <= month <= 12:
+                raise ValueError(f"month {month}")
+            return [func.extract('month', OutboxJournal.outgoing_date) == month]
+        else:
+            return []
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный год или месяц")
+    return [OutboxJournal.outgoing_date >= start, OutboxJournal.outgoing_date < end]
 
 
 @router.get("/entries", response_model=JournalListResponse)
 async def get_journal_entries(
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    q: Optional[str] = None,
     year: Optional[int] = None,
     month: Optional[int] = None,
-    db: Session = Depends(get_db),
+    sig_status: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
-    Получить записи журнала
+    Получить записи журнала (от большего номера к меньшему, при поиске - по релевантности).
+
+    Страницы листаются курсором: next_cursor из ответа передаётся в cursor
+    следующего запроса, и БД начинает сразу с нужного места индекса по
+    (outgoing_no, id) - глубокая страница стоит столько же, сколько первая.
+    skip оставлен для совместимости (OFFSET читает и отбрасывает skip записей)
+
+    Поиск q идёт по номеру, адресату, содержанию и исполнителю (см. JournalSearch);
+    совпадения в адресате и содержании возвращаются в highlight
 
     Args:
-        skip: Количество записей для пропуска (пагинация)
+        skip: Количество записей для пропуска (если cursor не передан)
         limit: Максимальное количество записей
+        cursor: Курсор следующей страницы (next_cursor предыдущего ответа)
+        include_total: Вернуть общее число записей (кэшируется, см. journal_count_service)
+        q: Строка поиска
         year: Фильтр по году
         month: Фильтр по месяцу
+        sig_status: Фильтр по результату проверки подписи (valid, invalid, unverified, error)
         db: Сессия БД
         current_user: Текущий пользователь
 
     Returns:
-        Список записей журнала
+        Список записей журнала и курсор следующей страницы
     """
     try:
-        query = db.query(OutboxJournal)
+        q = q.strip() if q else None
+        search = JournalSearch(q) if q else None
+        if search:
+            await db.execute(search.threshold)
+        columns = JOURNAL_LIST_COLUMNS + (search.rank,) if search else JOURNAL_LIST_COLUMNS
+        query = select(*columns)
 
         # Фильтры
-        if year:
-            query = query.filter(
-                func.extract('year', OutboxJournal.outgoing_date) == year
-            )
-        if month:
-            query = query.filter(
-                func.extract('month', OutboxJournal.outgoing_date) == month
+        query = query.where(*journal_date_filters(year, month))
+        if sig_status:
+            query = query.where(OutboxJournal.sig_status == sig_status)
+        if search:
+            query = query.where(search.condition)
+
+        # Общее количество (по тем же фильтрам, без курсора)
+        total = None
+        if include_total:
+            count_query = select(func.count()).select_from(query.subquery())
+            total = await journal_count_service.get(
+                (year, month, sig_status, q), lambda: db.scalar(count_query)
             )
 
-        # Общее количество
-        total = query.count()
-
-        # Получаем записи (сортировка от большего номера к меньшему)
-        entries = query.order_by(
-            OutboxJournal.outgoing_no.desc()
-        ).offset(skip).limit(limit).all()
+        # Сортировка от большего номера к меньшему (при поиске - сначала по релевантности);
+        # id различает одинаковые номера разных лет
+        order = (OutboxJournal.outgoing_no, OutboxJournal.id)
+        if search:
+            order = (search.rank,) + order
+        query = query.order_by(*(column.desc() for column in order))
+        if cursor:
+            query = query.where(tuple_(*order) < _decode_cursor(cursor, with_rank=bool(search)))
+        else:
+            query = query.offset(skip)
+
+        # Одна лишняя запись показывает, есть ли следующая страница
+        entries = (await db.execute(query.limit(limit + 1))).all()
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = _encode_cursor(entries[-1], with_rank=bool(search))
+
+        highlights = await search.highlight(db, [entry.id for entry in entries]) if search else {}
 
         # Форматируем ответ
         entries_data = [
@@ -85,21 +227,117 @@ async def get_journal_entries(
                 executor=entry.executor,
                 content=entry.content,
                 folder_path=entry.folder_path,
+                sig_status=entry.sig_status,
+                has_file=entry.has_file,
+                has_sig=entry.has_sig,
+                has_attachments=entry.has_attachments,
+                highlight=highlights.get(entry.id),
                 created_at=entry.created_at.isoformat() if entry.created_at else ""
             )
             for entry in entries
         ]
 
-        return JournalListResponse(entries=entries_data, total=total)
+        return JournalListResponse(entries=entries_data, total=total, next_cursor=next_cursor)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching journal entries: {str(e)}")
 
 
+class JournalSearch:
+    """
+    Поиск по журналу: условие, релевантность и подсветка совпадений.
+
+    Запись найдена, если совпали слова поискового вектора (с учётом русской
+    морфологии: "письмам" находит "письмо", индекс ix_outbox_journal_search_vector),
+    строка входит в текст записи (часть номера или слова) или похожа на одно
+    из его слов (опечатки, word_similarity) - два последних условия работают
+    по триграммному индексу ix_outbox_journal_search_trgm.
+    Релевантность - сумма ts_rank_cd и word_similarity
+    """
+
+    def __init__(self, q: str):
+        self.q = q
+        self.tsquery = func.websearch_to_tsquery(SEARCH_REGCONFIG, q)
+        pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        self.condition = or_(
+            OutboxJournal.search_vector.op("@@")(self.tsquery),
+            OutboxJournal.search_text.ilike(f"%{pattern}%", escape="\\"),
+            literal(q).op("<%")(OutboxJournal.search_text)
+        )
+        self.rank = cast(
+            func.ts_rank_cd(OutboxJournal.search_vector, self.tsquery)
+            + func.word_similarity(q, OutboxJournal.search_text),
+            Float
+        ).label("rank")
+
+        # Порог похожести слова (JOURNAL_SEARCH_SIMILARITY) - выполняется до поиска,
+        # действует до конца транзакции запроса
+        self.threshold = select(func.set_config(
+            'pg_trgm.word_similarity_threshold', str(settings.JOURNAL_SEARCH_SIMILARITY), True
+        ))
+
+    async def highlight(self, db: AsyncSession, entry_ids: List[int]) -> Dict[int, Dict[str, str]]:
+        """
+        Адресат и содержание записей страницы с отмеченными совпадениями
+        (отдельный запрос: ts_headline считается только для выданных записей)
+
+        Returns:
+            {id записи: {'to_whom': ..., 'content': ...}}
+        """
+        if not entry_ids:
+            return {}
+        rows = (await db.execute(select(
+            OutboxJournal.id,
+            self._headline(OutboxJournal.to_whom).label("to_whom"),
+            self._headline(OutboxJournal.content).label("content")
+        ).where(OutboxJournal.id.in_(entry_ids)))).all()
+        return {
+            row.id: {
+                'to_whom': _mark_substring(row.to_whom, self.q),
+                'content': _mark_substring(row.content, self.q)
+            }
+            for row in rows
+        }
+
+    def _headline(self, column):
+        return func.ts_headline(SEARCH_REGCONFIG, func.coalesce(column, ""), self.tsquery, SEARCH_HEADLINE_OPTIONS)
+
+
+def _mark_substring(value: str, q: str) -> str:
+    """Отметить вхождение строки поиска, если ts_headline ничего не отметил (часть слова или номера)"""
+    if not value or SEARCH_HIGHLIGHT_START in value:
+        return value
+    start = value.lower().find(q.lower())
+    if start < 0:
+        return value
+    end = start + len(q)
+    return f"{value[:start]}{SEARCH_HIGHLIGHT_START}{value[start:end]}{SEARCH_HIGHLIGHT_STOP}{value[end:]}"
+
+
+def _encode_cursor(entry, with_rank: bool = False) -> str:
+    """Курсор страницы - последняя выданная запись в виде [<rank>_]<outgoing_no>_<id>"""
+    key = f"{entry.outgoing_no}_{entry.id}"
+    return f"{entry.rank!r}_{key}" if with_rank else key
+
+
+def _decode_cursor(cursor: str, with_rank: bool = False) -> tuple:
+    """Разобрать курсор страницы (HTTPException 400, если он испорчен)"""
+    try:
+        if with_rank:
+            rank, outgoing_no, entry_id = cursor.split("_")
+            return float(rank), int(outgoing_no), int(entry_id)
+        outgoing_no, entry_id = cursor.split("_")
+        return int(outgoing_no), int(entry_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный курсор страницы")
+
+
 @router.post("/entries", response_model=JournalEntryResponse, status_code=201)
 async def create_journal_entry(
     entry: JournalEntryCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -115,9 +353,9 @@ async def create_journal_entry(
     """
     try:
         # Проверяем, что числовая часть номера не занята
-        existing_no = db.query(OutboxJournal).filter(
+        existing_no = await db.scalar(select(OutboxJournal.id).where(
             OutboxJournal.outgoing_no == entry.outgoing_no
-        ).first()
+        ).limit(1))
 
         if existing_no:
             raise HTTPException(
@@ -126,9 +364,9 @@ async def create_journal_entry(
             )
 
         # Проверяем, что форматированный номер не занят
-        existing_formatted = db.query(OutboxJournal).filter(
+        existing_formatted = await db.scalar(select(OutboxJournal.id).where(
             OutboxJournal.formatted_number == entry.formatted_number
-        ).first()
+        ).limit(1))
 
         if existing_formatted:
             raise HTTPException(
@@ -148,8 +386,11 @@ async def create_journal_entry(
         )
 
         db.add(new_entry)
-        db.commit()
-        db.refresh(new_entry)
+        await db.run_sync(numbering_service.sync_counters, new_entry.outgoing_no, new_entry.outgoing_date)
+        await db.run_sync(journal_export_service.bump_version)
+        await db.commit()
+        journal_count_service.invalidate()
+        await db.refresh(new_entry)
 
         return JournalEntryResponse(
             id=new_entry.id,
@@ -166,7 +407,7 @@ async def create_journal_entry(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error creating journal entry: {str(e)}")
 
 
@@ -174,7 +415,7 @@ async def create_journal_entry(
 async def update_journal_entry(
     entry_id: int,
     entry_update: JournalEntryUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -191,17 +432,17 @@ async def update_journal_entry(
     """
     try:
         # Ищем запись
-        entry = db.query(OutboxJournal).filter(OutboxJournal.id == entry_id).first()
+        entry = await db.get(OutboxJournal, entry_id)
 
         if not entry:
             raise HTTPException(status_code=404, detail=f"Journal entry {entry_id} not found")
 
         # Проверяем уникальность formatted_number, если он изменяется
         if entry_update.formatted_number is not None and entry_update.formatted_number != entry.formatted_number:
-            existing = db.query(OutboxJournal).filter(
+            existing = await db.scalar(select(OutboxJournal.id).where(
                 OutboxJournal.formatted_number == entry_update.formatted_number,
                 OutboxJournal.id != entry_id
-            ).first()
+            ).limit(1))
 
             if existing:
                 raise HTTPException(
@@ -233,8 +474,11 @@ async def update_journal_entry(
         if entry_update.folder_path is not None:
             entry.folder_path = entry_update.folder_path
 
-        db.commit()
-        db.refresh(entry)
+        await db.run_sync(numbering_service.sync_counters, entry.outgoing_no, entry.outgoing_date)
+        await db.run_sync(journal_export_service.bump_version)
+        await db.commit()
+        journal_count_service.invalidate()
+        await db.refresh(entry)
 
         return JournalEntryResponse(
             id=entry.id,
@@ -251,14 +495,14 @@ async def update_journal_entry(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error updating journal entry: {str(e)}")
 
 
 @router.delete("/entries/{entry_id}")
 async def delete_journal_entry(
     entry_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -274,7 +518,7 @@ async def delete_journal_entry(
     """
     try:
         # Ищем запись
-        entry = db.query(OutboxJournal).filter(OutboxJournal.id == entry_id).first()
+        entry = await db.get(OutboxJournal, entry_id)
 
         if not entry:
             raise HTTPException(status_code=404, detail=f"Journal entry {entry_id} not found")
@@ -287,23 +531,31 @@ async def delete_journal_entry(
                 # Логируем ошибку, но продолжаем удаление записи из БД
                 print(f"Warning: Failed to delete folder {entry.folder_path}: {str(e)}")
 
+        # Убираем ссылки на файлы хранилища (сами файлы удалит сборка мусора)
+        await db.run_sync(blob_service.release, entry.file_sha256)
+        await db.run_sync(blob_service.release, entry.sig_sha256)
+        for item in entry.attachments or []:
+            await db.run_sync(blob_service.release, item['sha256'])
+
         # Удаляем запись из БД
-        db.delete(entry)
-        db.commit()
+        await db.delete(entry)
+        await db.run_sync(journal_export_service.bump_version)
+        await db.commit()
+        journal_count_service.invalidate()
 
         return {"message": f"Journal entry {entry_id} deleted successfully"}
 
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error deleting journal entry: {str(e)}")
 
 
 @router.get("/next-number")
 async def get_next_outgoing_number(
     executor_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -321,33 +573,11 @@ async def get_next_outgoing_number(
         # Получаем правила нумерации для исполнителя
         numbering_rule = config_service.get_numbering_rule_for_executor(executor_id) if executor_id else config_service.get_numbering_rules().get('default', {})
 
-        # Извлекаем параметры из правила
         executor_code = numbering_rule.get('executor_code', '00')
-        number_format = numbering_rule.get('format', '{number}-{executor_code}')
-        start_number = numbering_rule.get('start_number', 1)
-        reset_yearly = numbering_rule.get('reset_yearly', False)
-
-        # Определяем фильтр для поиска максимального номера
-        query = db.query(func.max(OutboxJournal.outgoing_no))
-
-        # Если нумерация сбрасывается ежегодно, фильтруем по текущему году
-        if reset_yearly:
-            current_year = date.today().year
-            query = query.filter(
-                func.extract('year', OutboxJournal.outgoing_date) == current_year
-            )
-
-        # Сквозная нумерация независимо от исполнителя - НЕ фильтруем по executor
-
-        # Получаем максимальный номер
-        max_no = query.scalar()
-        next_number = (max_no or (start_number - 1)) + 1
 
-        # Форматируем номер согласно правилу (например, 42-10)
-        formatted_number = number_format.format(
-            number=next_number,
-            executor_code=executor_code
-        )
+        # Номер, который будет выдан следующим (без резервирования)
+        next_number = await db.run_sync(numbering_service.peek_next_number, numbering_rule)
+        formatted_number = numbering_service.format_number(numbering_rule, next_number)
 
         return {
             "next_number": next_number,
@@ -365,8 +595,8 @@ async def reload_configuration(
     current_user: dict = Depends(get_current_user)
 ):
     """
-    Перезагрузить конфигурационные файлы (executors.json, numbering_rules.json)
-    без перезапуска сервера
+    Перезагрузить конфигурационные файлы (executors.json, numbering_rules.json,
+    certificates.json) и изображения штампов без перезапуска сервера
 
     Args:
         current_user: Текущий пользователь
@@ -376,6 +606,7 @@ async def reload_configuration(
     """
     try:
         config_service.reload_configs()
+        stamp_service.invalidate()
         return {
             "message": "Configuration reloaded successfully",
             "executors_count": len(config_service.get_executors()),
@@ -385,19 +616,248 @@ async def reload_configuration(
         raise HTTPException(status_code=500, detail=f"Error reloading configuration: {str(e)}")
 
 
+@router.get("/entries/{entry_id}/files/{kind}")
+async def download_journal_file(
+    entry_id: int,
+    kind: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Скачать файл записи журнала (PDF, подпись или архив приложений).
+    Файл отдаётся из хранилища по содержимому (или распаковывается из архива
+    холодного хранения), архив приложений собирается из хранилища на лету. Файлы записей до хранилища читаются из БД частями
+    по BLOB_CHUNK_SIZE - в памяти сервера не бывает больше одной части
+
+    Args:
+        entry_id: ID записи
+        kind: Какой файл: pdf, sig или attachments
+        db: Сессия БД
+        current_user: Текущий пользователь
+
+    Returns:
+        Файл потоком
+    """
+    if kind not in JOURNAL_FILES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный файл '{kind}': допустимы {', '.join(JOURNAL_FILES)}")
+    ref_column, blob_column, media_type, suffix = JOURNAL_FILES[kind]
+
+    row = (await db.execute(select(
+        OutboxJournal.formatted_number,
+        ref_column.label("ref"),
+        func.length(blob_column).label("size")
+    ).where(OutboxJournal.id == entry_id))).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Запись не найдена")
+
+    filename = f"{row.formatted_number}{suffix}"
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+
+    if row.ref:
+        try:
+            if kind == "attachments":
+                archive = await asyncio.to_thread(_build_attachments_archive, row.ref)
+                size = archive.seek(0, os.SEEK_END)
+                archive.seek(0)
+                return StreamingResponse(
+                    _iter_file(archive),
+                    media_type=media_type,
+                    headers={**headers, "Content-Length": str(size)}
+                )
+            path = blob_service.local_path(row.ref)
+            if path is not None and path.exists():
+                return FileResponse(path, media_type=media_type, headers=headers)
+            # Хранилище не локальное или файл в холодном хранении (распаковывается из архива)
+            return StreamingResponse(
+                _iter_file(await asyncio.to_thread(blob_service.open, row.ref)),
+                media_type=media_type,
+                headers=headers
+            )
+        except FileNotFoundError:
+            raise HTTPException(status_code=500, detail="Файл записи отсутствует в хранилище")
+
+    if row.size is None:
+        raise HTTPException(status_code=404, detail="У записи нет этого файла")
+    return StreamingResponse(
+        _iter_blob(entry_id, blob_column, row.size),
+        media_type=media_type,
+        headers={**headers, "Content-Length": str(row.size)}
+    )
+
+
+def _iter_blob(entry_id: int, column, size: int) -> Iterator[bytes]:
+    """
+    Читать BLOB записи частями (substr на стороне БД). Генератор открывает свою
+    сессию: сессия запроса закрывается раньше, чем ответ отдан до конца
+    """
+    db = SessionLocal()
+    try:
+        for offset in range(0, size, BLOB_CHUNK_SIZE):
+            chunk = db.query(func.substr(column, offset + 1, BLOB_CHUNK_SIZE)).filter(
+                OutboxJournal.id == entry_id
+            ).scalar()
+            if not chunk:
+                break
+            yield bytes(chunk)
+    finally:
+        db.close()
+
+
+def _iter_file(file: BinaryIO) -> Iterator[bytes]:
+    """Читать открытый файл частями и закрыть его в конце"""
+    try:
+        while True:
+            chunk = file.read(BLOB_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
+
+
+def _build_attachments_archive(manifest: List[Dict]) -> BinaryIO:
+    """
+    Собрать ZIP приложений из хранилища во временный файл (небольшой архив
+    остаётся в памяти, большой уходит на диск)
+    """
+    archive = tempfile.SpooledTemporaryFile(max_size=8 * BLOB_CHUNK_SIZE)
+    try:
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            for item in manifest:
+                with blob_service.open(item['sha256']) as src, zf.open(item['name'], "w") as dst:
+                    shutil.copyfileobj(src, dst, BLOB_CHUNK_SIZE)
+    except Exception:
+        archive.close()
+        raise
+    return archive
+
+
+@router.get("/blobs/metrics")
+async def get_blob_store_metrics(
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Получить метрики хранилища файлов журнала (сохранено, совпадения, ссылки,
+    сборка мусора, холодное хранение)
+
+    Args:
+        current_user: Текущий пользователь
+
+    Returns:
+        Метрики хранилища
+    """
+    return {**blob_service.get_metrics(), 'tiering': blob_tiering_service.get_metrics()}
+
+
+@router.post("/entries/{entry_id}/verify-signature")
+async def verify_entry_signature(
+    entry_id: int,
+    force: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Проверить подпись записи журнала (результат берётся из кэша, если файлы не менялись)
+
+    Args:
+        entry_id: ID записи
+        force: Проверить заново, игнорируя кэш
+        db: Сессия БД
+        current_user: Текущий пользователь
+
+    Returns:
+        Результат проверки подписи
+    """
+    try:
+        entry = await db.scalar(select(OutboxJournal).options(
+            undefer(OutboxJournal.file_blob),
+            undefer(OutboxJournal.sig_blob)
+        ).where(OutboxJournal.id == entry_id))
+        if not entry:
+            raise HTTPException(status_code=404, detail="Запись не найдена")
+        if not entry.sig_sha256 and not entry.sig_blob:
+            raise HTTPException(status_code=400, detail="У записи нет файла подписи")
+
+        file_bytes = await asyncio.to_thread(blob_service.resolve, entry.file_sha256, entry.file_blob)
+        sig_bytes = await asyncio.to_thread(blob_service.resolve, entry.sig_sha256, entry.sig_blob)
+        result = await signature_verification_service.verify(db, file_bytes or b"", sig_bytes, force)
+        entry.sig_status = result['status']
+        entry.sig_checked_at = datetime.now()
+        await db.commit()
+
+        return {"entry_id": entry_id, **result}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error verifying signature: {str(e)}")
+
+
+@router.post("/verify-signatures")
+async def start_signatures_verification(
+    year: int,
+    force: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Запустить фоновую проверку подписей всех записей журнала за год.
+    Результаты сохраняются в sig_status записей; уже проверенные записи
+    пропускаются, если не указан force
+
+    Args:
+        year: Год
+        force: Перепроверить все записи
+        current_user: Текущий пользователь
+
+    Returns:
+        Состояние задачи (job_id для получения прогресса)
+    """
+    return signature_verification_service.start_year_job(year, force)
+
+
+@router.get("/verify-signatures/{job_id}")
+async def get_signatures_verification(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Получить прогресс и итоги массовой проверки подписей
+
+    Args:
+        job_id: ID задачи
+        current_user: Текущий пользователь
+
+    Returns:
+        Состояние задачи
+    """
+    job = signature_verification_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+
 @router.get("/export/xlsx")
 async def export_journal_to_xlsx(
     year: Optional[int] = None,
     month: Optional[int] = None,
-    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
     Экспортировать журнал в формат XLSX
 
+    Файл собирается в кэш экспортов (см. journal_export_service) в отдельном
+    потоке и отдаётся с диска: строки читаются из БД курсором на стороне сервера
+    (по EXPORT_BATCH_SIZE), книга пишется в режиме write_only - память не растёт
+    с размером журнала. Пока журнал не менялся, повторный экспорт отдаётся из
+    кэша без сборки, с ETag (If-None-Match - 304 без тела)
+
     Args:
         year: Фильтр по году
         month: Фильтр по месяцу
+        if_none_match: ETag ранее полученного файла
         db: Сессия БД
         current_user: Текущий пользователь
 
@@ -405,38 +865,290 @@ async def export_journal_to_xlsx(
         XLSX файл
     """
     try:
-        query = db.query(OutboxJournal)
-
-        # Фильтры
-        if year:
-            query = query.filter(
-                func.extract('year', OutboxJournal.outgoing_date) == year
-            )
-        if month:
-            query = query.filter(
-                func.extract('month', OutboxJournal.outgoing_date) == month
+        # Фильтры (неверный год или месяц - 400 до начала ответа)
+        filters = journal_date_filters(year, month)
+
+        version = await db.run_sync(journal_export_service.get_version)
+        await db.rollback()  # Версия прочитана - соединение запроса больше не нужно
+        name = journal_export_service.cache_name("xlsx", year, month, version)
+        etag = journal_export_service.etag(name)
+        headers = {
+            "Content-Disposition": f"attachment; filename={_export_filename(year, month, 'xlsx')}",
+            "ETag": etag
+        }
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+
+        path = journal_export_service.get_cached(name)
+        if not path:
+            path = await asyncio.to_thread(
+                journal_export_service.build,
+                name, lambda output: excel_service.write_journal_xlsx(_iter_export_rows(filters), output)
             )
+        return FileResponse(path, media_type=XLSX_MEDIA_TYPE, headers=headers)
 
-        # Получаем записи (сортировка от большего номера к меньшему)
-        entries = query.order_by(OutboxJournal.outgoing_no.desc()).all()
-
-        # Генерируем Excel файл
-        excel_buffer = excel_service.generate_journal_xlsx(entries)
-
-        # Формируем имя файла
-        filename = "journal"
-        if year:
-            filename += f"_{year}"
-        if month:
-            filename += f"_{month:02d}"
-        filename += ".xlsx"
-
-        # Возвращаем файл
-        return StreamingResponse(
-            excel_buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error exporting journal: {str(e)}")
+
+
+@router.post("/export/jobs")
+async def start_journal_export(
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Запустить фоновую сборку XLSX экспорта журнала (для больших экспортов:
+    запрос не ждёт сборки). Если журнал не менялся с прошлого экспорта,
+    задача сразу завершена; download_url - ссылка на готовый файл
+
+    Args:
+        year: Фильтр по году
+        month: Фильтр по месяцу
+        db: Сессия БД
+        current_user: Текущий пользователь
+
+    Returns:
+        Состояние задачи (job_id для получения прогресса)
+    """
+    filters = journal_date_filters(year, month)
+    version = await db.run_sync(journal_export_service.get_version)
+    name = journal_export_service.cache_name("xlsx", year, month, version)
+    job = journal_export_service.start_job(
+        name, lambda output: excel_service.write_journal_xlsx(_iter_export_rows(filters), output)
+    )
+    return _export_job_response(job)
+
+
+@router.get("/export/jobs/{job_id}")
+async def get_journal_export(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Получить состояние фоновой сборки экспорта журнала
+
+    Args:
+        job_id: ID задачи
+        current_user: Текущий пользователь
+
+    Returns:
+        Состояние задачи (download_url, когда файл готов)
+    """
+    job = journal_export_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return _export_job_response(job)
+
+
+@router.get("/export/files/{name}")
+async def download_journal_export(
+    name: str,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Скачать готовый файл экспорта журнала из кэша
+
+    Args:
+        name: Имя файла (из download_url задачи экспорта)
+        if_none_match: ETag ранее полученного файла
+        current_user: Текущий пользователь
+
+    Returns:
+        Файл экспорта
+    """
+    etag = journal_export_service.etag(name)
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    cached = journal_export_service.get_cached(name)
+    if not cached:
+        raise HTTPException(status_code=404, detail="Файл экспорта не найден (журнал изменился - запустите экспорт заново)")
+
+    year, month, _, _ = EXPORT_NAME_PATTERN.match(name).groups()
+    filename = _export_filename(
+        int(year) if year != "all" else None, int(month) if month != "all" else None, "xlsx"
+    )
+    return FileResponse(
+        cached,
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f"attachment; filename={filename}", "ETag": etag}
+    )
+
+
+@router.get("/export/csv")
+async def export_journal_to_csv(
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    since: Optional[str] = None,
+    accept_encoding: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Выгрузить журнал в CSV для внешних систем (см. _journal_feed)
+
+    Args:
+        year: Фильтр по году
+        month: Фильтр по месяцу
+        since: Отметка X-Next-Since предыдущей выгрузки (только новые записи)
+        accept_encoding: Заголовок Accept-Encoding (gzip - ответ сжимается)
+        db: Сессия БД
+        current_user: Текущий пользователь
 
+    Returns:
+        CSV файл
+    """
+    return await _journal_feed("csv", year, month, since, accept_encoding, db)
+
+
+@router.get("/export/ndjson")
+async def export_journal_to_ndjson(
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    since: Optional[str] = None,
+    accept_encoding: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Выгрузить журнал в NDJSON (объект JSON на строку) для внешних систем (см. _journal_feed)
+
+    Args:
+        year: Фильтр по году
+        month: Фильтр по месяцу
+        since: Отметка X-Next-Since предыдущей выгрузки (только новые записи)
+        accept_encoding: Заголовок Accept-Encoding (gzip - ответ сжимается)
+        db: Сессия БД
+        current_user: Текущий пользователь
+
+    Returns:
+        NDJSON файл
+    """
+    return await _journal_feed("ndjson", year, month, since, accept_encoding, db)
+
+
+async def _journal_feed(
+    fmt: str,
+    year: Optional[int],
+    month: Optional[int],
+    since: Optional[str],
+    accept_encoding: Optional[str],
+    db: AsyncSession
+) -> StreamingResponse:
+    """
+    Выгрузка журнала в порядке создания записей (created_at, id), курсором на
+    стороне сервера - память не растёт с размером журнала.
+
+    Верхняя граница выгрузки - последняя запись старше JOURNAL_FEED_SETTLE_SECONDS
+    (запись, чья транзакция ещё не зафиксирована, не должна оказаться позади
+    отметки). Она возвращается в заголовке X-Next-Since: следующая выгрузка с
+    since=X-Next-Since получит только записи, созданные после неё
+
+    Raises:
+        HTTPException: 400 - неверный год, месяц или отметка since
+    """
+    try:
+        filters = journal_date_filters(year, month)
+        created_key = tuple_(OutboxJournal.created_at, OutboxJournal.id)
+        if since:
+            try:
+                filters.append(created_key > journal_feed_service.decode_watermark(since))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Неверная отметка since")
+
+        settled = datetime.now(timezone.utc) - timedelta(seconds=settings.JOURNAL_FEED_SETTLE_SECONDS)
+        last = (await db.execute(select(OutboxJournal.created_at, OutboxJournal.id).where(
+            *filters, OutboxJournal.created_at <= settled
+        ).order_by(OutboxJournal.created_at.desc(), OutboxJournal.id.desc()).limit(1))).first()
+        await db.rollback()  # Граница прочитана - соединение запроса больше не нужно
+
+        media_type, serialize = JOURNAL_FEED_FORMATS[fmt]
+        headers = {
+            "Content-Disposition": f"attachment; filename={_export_filename(year, month, fmt)}",
+            "Vary": "Accept-Encoding"
+        }
+        if last:
+            filters.append(created_key <= (last.created_at, last.id))
+            headers["X-Next-Since"] = journal_feed_service.encode_watermark(last.created_at, last.id)
+            chunks = serialize(_iter_feed_rows(filters))
+        else:
+            # Новых записей нет - отметка остаётся прежней
+            if since:
+                headers["X-Next-Since"] = since
+            chunks = serialize(iter(()))
+
+        if accept_encoding and "gzip" in accept_encoding.lower():
+            headers["Content-Encoding"] = "gzip"
+            chunks = journal_feed_service.gzip(chunks)
+
+        return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error exporting journal: {str(e)}")
+
+
+def _iter_feed_rows(filters: list) -> Iterator:
+    """
+    Строки выгрузки журнала в порядке создания курсором на стороне сервера
+    (своя сессия, как у _iter_export_rows)
+    """
+    db = SessionLocal()
+    try:
+        yield from db.query(*JOURNAL_FEED_COLUMNS).filter(*filters).order_by(
+            OutboxJournal.created_at, OutboxJournal.id
+        ).yield_per(EXPORT_BATCH_SIZE)
+    finally:
+        db.close()
+
+
+@router.get("/export/metrics")
+async def get_journal_export_metrics(
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Получить метрики кэша экспортов журнала (попадания, промахи, файлы на диске)
+
+    Args:
+        current_user: Текущий пользователь
+
+    Returns:
+        Метрики кэша
+    """
+    return journal_export_service.get_metrics()
+
+
+def _export_job_response(job: Dict) -> Dict:
+    """Состояние задачи экспорта со ссылкой на файл, когда он готов"""
+    download_url = f"/api/journal/export/files/{job['name']}" if job['status'] == 'done' else None
+    return {**job, 'download_url': download_url}
+
+
+def _export_filename(year: Optional[int], month: Optional[int], fmt: str) -> str:
+    """Имя скачиваемого файла экспорта"""
+    filename = "journal"
+    if year:
+        filename += f"_{year}"
+    if month:
+        filename += f"_{month:02d}"
+    return f"{filename}.{fmt}"
+
+
+def _iter_export_rows(filters: list) -> Iterator:
+    """
+    Строки экспорта журнала (от большего номера к меньшему) курсором на стороне
+    сервера. Генератор открывает свою сессию: сессия запроса закрывается раньше,
+    чем ответ отдан до конца
+    """
+    db = SessionLocal()
+    try:
+        yield from db.query(*JOURNAL_EXPORT_COLUMNS).filter(*filters).order_by(
+            OutboxJournal.outgoing_no.desc()
+        ).yield_per(EXPORT_BATCH_SIZE)
+    finally:
+        db.close()
@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException
 from typing import List, Dict, Optional
 from pydantic import BaseModel
 from app.services.kaiten_service import kaiten_service
+from app.services.template_check_service import template_check_service
 
 router = APIRouter(prefix="/api/kaiten", tags=["kaiten"])
 
@@ -36,6 +37,12 @@ async def get_cards(role: str = "director") -> List[Dict]:
         # Получаем карточки из Kaiten
         cards = await kaiten_service.get_cards_from_column(column_name)
 
+        # Добавляем результат предварительной проверки шаблона
+        # ("готово к регистрации" или описание проблемы)
+        if role == "director":
+            for card in cards:
+                card['template_check'] = template_check_service.get_verdict(card)
+
         return cards
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching cards: {str(e)}")
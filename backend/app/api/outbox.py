@@ -1,204 +1,272 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, File, Form, Header, Response, UploadFile
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import StreamingResponse, FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import date, datetime
 from pathlib import Path
 from pydantic import BaseModel
-import io
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
 import uuid
 import base64
-
-from app.models.database import SessionLocal
-from app.schemas.outbox_schemas import RegisterRequest, RegisterResponse
+import hashlib
+
+from app.models.database import AsyncSessionLocal, get_async_db
+from app.schemas.outbox_schemas import (
+    RegisterRequest,
+    RegisterResponse,
+    BatchPrepareRequest,
+    BatchPrepareItem,
+    BatchPrepareResponse
+)
 from app.services.kaiten_service import kaiten_service
 from app.services.file_service import file_service
 from app.services.docx_service import docx_service
 from app.services.config_service import config_service
 from app.services.pdf_service import pdf_service
-from app.services.cryptopro_service import cryptopro_service
+from app.services.pdf_overlay_service import pdf_overlay_service
+from app.services.stamp_service import stamp_service
+from app.services.cryptopro_service import cryptopro_service, GOST_HASH_ALGORITHMS
+from app.services.signature_verification_service import signature_verification_service
+from app.services.numbering_service import numbering_service, NumberReservationError
+from app.services.template_check_service import template_check_service
+from app.services.registration_session_service import registration_session_service
+from app.services.idempotency_service import idempotency_service, IdempotencyError
+from app.services.temp_files_service import temp_files_janitor, TEMP_FILES_DIR
+from app.services.finalization_service import (
+    finalization_service,
+    FinalizationError,
+    outgoing_folder_path,
+    outgoing_sig_name
+)
+from app.models.registration_session import RegistrationSession
+from app.services.docx_template import DocxTemplate
 from app.api.auth import get_current_user
-from app.api.journal import get_next_outgoing_number
+from app.core.config import settings
 
 router = APIRouter(prefix="/api/outbox", tags=["outbox"])
 
-# Директория для временных зарегистрированных файлов
-TEMP_FILES_DIR = Path(__file__).parent.parent.parent / "temp_files"
-TEMP_FILES_DIR.mkdir(exist_ok=True)
-
-
-def get_db():
-    """Dependency для получения сессии БД"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Подпись CAdES-BES занимает единицы килобайт - файл больше лимита подписью не является
+MAX_SIGNATURE_SIZE = 1024 * 1024
+SIGNATURE_CHUNK_SIZE = 64 * 1024
 
 
 @router.post("/prepare-registration", response_model=RegisterResponse)
 async def prepare_registration(
     request: RegisterRequest,
-    db: Session = Depends(get_db),
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
     Подготовить регистрацию документа:
-    - Получить карточку и извлечь title (для поля "Кому")
-    - Получить исполнителя из карточки Kaiten (для генерации номера)
+    - Получить карточку и извлечь title (для поля "Кому"), скачать выбранный DOCX
+    - Параллельно получить исполнителя из карточки Kaiten (для генерации номера)
     - Сгенерировать номер
     - Заменить плейсхолдеры в DOCX
     - Вернуть информацию для предпросмотра
 
+    Повтор запроса с тем же заголовком Idempotency-Key возвращает ту же подготовку
+    (тот же номер и file_id) без повторной конвертации
+
     Args:
         request: Данные запроса (card_id)
+        response: Ответ (заголовок Idempotent-Replayed при повторе)
+        idempotency_key: Ключ идемпотентности клиента
         db: Сессия БД
         current_user: Текущий пользователь
 
     Returns:
         Данные регистрации с номером и датой
     """
-    try:
-        # 1. Получаем карточку для извлечения title
-        card = await kaiten_service.get_card_by_id(request.card_id)
-        if not card:
-            raise HTTPException(status_code=404, detail=f"Card {request.card_id} not found")
-
-        # Извлекаем title карточки - это поле "Кому"
-        to_whom = card.get('title', '')
-
-        # 2. Получаем исполнителя из карточки Kaiten (для генерации номера)
-        executor_data = await kaiten_service.get_executor_from_card(request.card_id)
+    return await _run_idempotent(
+        idempotency_key,
+        current_user,
+        "prepare-registration",
+        request.dict(),
+        response,
+        lambda: _prepare_document(
+            db,
+            request.card_id,
+            request.selected_file_name,
+            current_user.get('username', 'default')
+        )
+    )
 
-        if not executor_data:
-            raise HTTPException(
-                status_code=404,
-                detail="Executor not found in card. Please ensure card has a member with type=2"
-            )
 
-        executor_id = executor_data.get('user_id')
-        executor_name = executor_data.get('full_name')
+async def _run_idempotent(
+    idempotency_key: Optional[str],
+    current_user: dict,
+    endpoint: str,
+    payload: Dict[str, Any],
+    response: Response,
+    handler: Callable[[], Awaitable[Any]]
+) -> Any:
+    """
+    Выполнить обработчик эндпоинта с учётом заголовка Idempotency-Key:
+    без ключа - как обычно; повтор с ключом - сохранённый ответ без выполнения.
+    Ошибка освобождает ключ, чтобы клиент мог повторить запрос
 
-        # 3. Генерируем следующий номер
-        # Используем существующий endpoint get_next_outgoing_number
-        from app.api.journal import get_next_outgoing_number as get_next_number_func
-        from sqlalchemy import func
-        from app.models.outbox_journal import OutboxJournal
+    Args:
+        idempotency_key: Значение заголовка (None - запрос не идемпотентный)
+        current_user: Текущий пользователь (ключи разных пользователей не пересекаются)
+        endpoint: Имя эндпоинта
+        payload: Параметры запроса (повтор с тем же ключом и другими параметрами - 422)
+        response: Ответ эндпоинта
+        handler: Обработчик запроса
 
-        # Получаем правила нумерации для исполнителя
-        numbering_rule = config_service.get_numbering_rule_for_executor(executor_id)
+    Returns:
+        Ответ обработчика или сохранённый ответ
+    """
+    if not idempotency_key:
+        return await handler()
 
-        # Извлекаем параметры из правила
-        executor_code = numbering_rule.get('executor_code', '00')
-        number_format = numbering_rule.get('format', '{number}-{executor_code}')
-        start_number = numbering_rule.get('start_number', 1)
-        reset_yearly = numbering_rule.get('reset_yearly', False)
+    username = current_user.get('username', 'default')
+    try:
+        stored = await idempotency_service.begin(
+            idempotency_key, username, endpoint, idempotency_service.fingerprint(payload)
+        )
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
-        # Определяем фильтр для поиска максимального номера
-        query = db.query(func.max(OutboxJournal.outgoing_no))
+    if stored is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+        return stored
 
-        # Если нумерация сбрасывается ежегодно, фильтруем по текущему году
-        if reset_yearly:
-            current_year = date.today().year
-            query = query.filter(
-                func.extract('year', OutboxJournal.outgoing_date) == current_year
-            )
+    try:
+        result = await handler()
+    except BaseException:
+        await idempotency_service.abandon(idempotency_key, username, endpoint)
+        raise
 
-        # Сквозная нумерация независимо от исполнителя - НЕ фильтруем по executor
+    await idempotency_service.complete(idempotency_key, username, endpoint, jsonable_encoder(result))
+    return result
 
-        # Получаем максимальный номер
-        max_no = query.scalar()
-        next_number = (max_no or (start_number - 1)) + 1
 
-        # Форматируем номер согласно правилу (например, 42-10)
-        formatted_number = number_format.format(
-            number=next_number,
-            executor_code=executor_code
-        )
+async def _prepare_document(
+    db: AsyncSession,
+    card_id: int,
+    selected_file_name: str,
+    username: str,
+    batch_id: Optional[str] = None
+) -> RegisterResponse:
+    """
+    Подготовить один документ к подписанию (общая часть одиночной и пакетной регистрации)
+    и создать сессию регистрации. При ошибке зарезервированный номер освобождается
 
-        # 4. Получаем текущую дату в формате ДД.ММ.ГГГГ
-        today = date.today()
-        outgoing_date = docx_service.format_date(today)
+    Args:
+        db: Сессия БД
+        card_id: ID карточки Kaiten
+        selected_file_name: Имя выбранного DOCX файла
+        username: Пользователь, чей штамп сертификата ставится в документ
+        batch_id: ID пакета подписания, если документ готовится в пакете
 
-        # 5. Проверяем, что выбранный файл - DOCX
-        if not request.selected_file_name.lower().endswith('.docx'):
+    Returns:
+        Данные регистрации с номером и датой
+    """
+    file_id = None
+    try:
+        # 1. Проверяем, что выбранный файл - DOCX (до любых сетевых запросов)
+        if not selected_file_name.lower().endswith('.docx'):
             raise HTTPException(
                 status_code=400,
-                detail=f"Выбранный файл '{request.selected_file_name}' не является DOCX документом. Регистрировать можно только DOCX файлы с полями для заполнения."
+                detail=f"Выбранный файл '{selected_file_name}' не является DOCX документом. Регистрировать можно только DOCX файлы с полями для заполнения."
             )
 
-        # 6. Находим выбранный файл в карточке
-        card_files = card.get('files', [])
-        selected_file = None
-        for file_info in card_files:
-            if file_info.get('name') == request.selected_file_name:
-                selected_file = file_info
-                break
+        # 2. Параллельно получаем карточку (+ шаблон DOCX по её списку файлов)
+        # и исполнителя карточки - эти шаги не зависят друг от друга
+        (card, template), executor_data = await asyncio.gather(
+            _fetch_card_and_template(card_id, selected_file_name),
+            kaiten_service.get_executor_from_card(card_id)
+        )
+
+        # Извлекаем title карточки - это поле "Кому"
+        to_whom = card.get('title', '')
 
-        if not selected_file:
+        if not executor_data:
             raise HTTPException(
                 status_code=404,
-                detail=f"Файл '{request.selected_file_name}' не найден в карточке"
+                detail="Executor not found in card. Please ensure card has a member with type=2"
             )
 
-        # 8. Скачиваем DOCX (в mock режиме используем mock данные)
-        if file_service.use_mock:
-            # В mock режиме создаем простой DOCX с плейсхолдерами
-            print(f"[Mock] Creating mock DOCX with placeholders for file: {request.selected_file_name}")
-            docx_bytes = _create_mock_docx()
-        else:
-            # Скачиваем реальный файл из Kaiten
-            docx_url = selected_file.get('url') or selected_file.get('path')
-            if not docx_url:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"URL файла '{request.selected_file_name}' не найден"
-                )
-            docx_bytes = await docx_service.download_docx_from_url(docx_url)
+        executor_id = executor_data.get('user_id')
+        executor_name = executor_data.get('full_name')
 
-        # 9. Проверяем наличие плейсхолдеров
-        has_placeholders = docx_service.check_has_placeholders(docx_bytes)
+        # 3. Проверяем наличие плейсхолдеров (до выдачи номера)
+        has_placeholders = docx_service.check_has_placeholders(template)
         if not has_placeholders:
             raise HTTPException(
                 status_code=400,
-                detail=f"Файл '{request.selected_file_name}' не содержит полей для заполнения ({{{{outgoing_no}}}}, {{{{outgoing_date}}}}, {{{{stamp}}}}). Регистрировать можно только шаблоны с полями."
+                detail=f"Файл '{selected_file_name}' не содержит полей для заполнения ({{{{outgoing_no}}}}, {{{{outgoing_date}}}}, {{{{stamp}}}}). Регистрировать можно только шаблоны с полями."
             )
 
-        # 10. Заменяем плейсхолдеры (пока без данных сертификата)
+        # 4. Резервируем следующий номер под блокировкой счётчика.
+        # Фиксируем резерв сразу, чтобы не держать блокировку во время конвертации
+        numbering_rule = config_service.get_numbering_rule_for_executor(executor_id)
+        file_id = str(uuid.uuid4())
+        reservation = await db.run_sync(
+            numbering_service.reserve_number,
+            numbering_rule,
+            file_id=file_id,
+            card_id=card_id
+        )
+        await db.commit()
+        next_number = reservation.outgoing_no
+        formatted_number = reservation.formatted_number
+
+        # 5. Получаем текущую дату в формате ДД.ММ.ГГГГ
+        today = date.today()
+        outgoing_date = docx_service.format_date(today)
+
+        # 6. Заменяем плейсхолдеры (штамп сертификата пользователя берётся из кэша)
+        stamp = stamp_service.get_stamp({'username': username})
         modified_docx = docx_service.replace_placeholders(
-            docx_bytes,
+            template,
             formatted_number,
             outgoing_date,
-            certificate_data={'username': current_user.get('username', 'default')}
+            stamp=stamp
         )
 
-        # 11. Конвертируем DOCX в PDF
-        print(f"[Outbox] Converting DOCX to PDF...")
-        try:
-            pdf_bytes = pdf_service.convert_docx_to_pdf(modified_docx)
-            print(f"[Outbox] PDF created: {len(pdf_bytes)} bytes")
-        except Exception as e:
-            print(f"[Outbox] PDF conversion error: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Ошибка конвертации в PDF: {str(e)}"
+        # 7. Получаем PDF: наложением на закэшированный PDF шаблона (если включено)
+        # или полной конвертацией DOCX через LibreOffice
+        pdf_bytes = None
+        if settings.PDF_OVERLAY_ENABLED:
+            pdf_bytes = await asyncio.to_thread(
+                pdf_overlay_service.render, template, formatted_number, outgoing_date, stamp
             )
+            if pdf_bytes:
+                print(f"[Outbox] PDF created by overlay: {len(pdf_bytes)} bytes")
+
+        if pdf_bytes is None:
+            print(f"[Outbox] Converting DOCX to PDF...")
+            try:
+                pdf_bytes = await asyncio.to_thread(pdf_service.convert_docx_to_pdf, modified_docx)
+                print(f"[Outbox] PDF created: {len(pdf_bytes)} bytes")
+            except Exception as e:
+                print(f"[Outbox] PDF conversion error: {e}")
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Ошибка конвертации в PDF: {str(e)}"
+                )
 
-        # 12. НЕ подписываем на сервере - подпись будет создана на клиенте через браузер
+        # 8. НЕ подписываем на сервере - подпись будет создана на клиенте через браузер
         # Вместо этого просто используем DOCX без штампа ЭЦП
         print(f"[Outbox] PDF ready for client-side signing")
         modified_docx_with_stamp = modified_docx  # Используем DOCX без штампа
 
-        # 14. Сохраняем файлы во временное хранилище
+        # 9. Сохраняем файлы во временное хранилище
         # Убеждаемся, что директория существует
         TEMP_FILES_DIR.mkdir(exist_ok=True, parents=True)
 
-        file_id = str(uuid.uuid4())
         # Формируем имя файла: номер_дата_оригинальное_имя
         safe_number = formatted_number.replace('/', '_').replace('\\', '_').replace('-', '_')
         safe_date = outgoing_date.replace('.', '_')
 
         # Санитизируем оригинальное имя файла - убираем проблемные символы
-        base_name = request.selected_file_name.rsplit('.', 1)[0]  # без расширения
+        base_name = selected_file_name.rsplit('.', 1)[0]  # без расширения
         # Заменяем пробелы, скобки и другие проблемные символы
         safe_base_name = base_name.replace(' ', '_').replace('(', '').replace(')', '').replace('[', '').replace(']', '')
 
@@ -214,7 +282,41 @@ async def prepare_registration(
         with open(pdf_file_path, 'wb') as f:
             f.write(pdf_bytes)
 
-        # Подпись (.sig) НЕ создаём здесь - будет создана на клиенте через браузер
+        # Подпись (.sig) НЕ создаём здесь - будет создана на клиенте через браузер.
+        # Заранее считаем хэш ГОСТ, чтобы клиент мог подписать хэш, не скачивая PDF
+        try:
+            document_digests = await cryptopro_service.hash_document(pdf_bytes)
+        except Exception as e:
+            print(f"[Outbox] Warning: Could not hash {pdf_file_path.name}: {e}")
+            document_digests = None
+
+        # 10. Сессия регистрации: всё, что понадобится при подписи, - без повторного
+        # запроса карточки и без доверия к данным клиента
+        await db.run_sync(
+            registration_session_service.create,
+            file_id=file_id,
+            batch_id=batch_id,
+            username=username,
+            outgoing_no=next_number,
+            formatted_number=formatted_number,
+            outgoing_date=today,
+            executor=executor_name,
+            executor_id=executor_id,
+            card_id=card_id,
+            to_whom=to_whom,
+            content=_card_content(card),
+            attachments=[
+                {'name': f.get('name', 'unknown'), 'url': f.get('url') or f.get('path')}
+                for f in card.get('files', [])
+                if not f.get('name', '').lower().endswith('.docx') and (f.get('url') or f.get('path'))
+            ],
+            selected_file_name=selected_file_name,
+            docx_file=docx_file_path.name,
+            pdf_file=pdf_file_path.name,
+            pdf_size=len(pdf_bytes),
+            document_digests=document_digests
+        )
+        await db.commit()
 
         print(f"[Outbox] Files saved:")
         print(f"  - DOCX: {docx_file_path}")
@@ -236,71 +338,153 @@ async def prepare_registration(
             docx_preview_url=download_url,
             sign_url=sign_url,
             file_id=file_id,
+            card_id=card_id,
+            to_whom=to_whom,
+            pdf_file=f"{file_id}_{pdf_filename}",
+            document_digests=document_digests,
             message=f"Документ готов к подписанию. Номер: {formatted_number} от {outgoing_date}"
         )
 
     except HTTPException:
+        await _release_reserved_number(db, file_id)
         raise
     except Exception as e:
+        await _release_reserved_number(db, file_id)
         print(f"Error preparing registration: {e}")
         raise HTTPException(status_code=500, detail=f"Error preparing registration: {str(e)}")
 
 
-def _create_mock_docx() -> bytes:
-    """Создать mock DOCX файл с плейсхолдерами для тестирования"""
-    from docx import Document
+async def _release_reserved_number(db: AsyncSession, file_id: Optional[str]):
+    """Освободить номер, зарезервированный неудавшейся подготовкой регистрации"""
+    await db.rollback()
+    if not file_id:
+        return
+    try:
+        await db.run_sync(numbering_service.release_reservation, file_id)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        print(f"[Outbox] Warning: Could not release number reservation {file_id}: {e}")
+
+
+def _card_content(card: Dict) -> str:
+    """Краткое содержание карточки: свойство "Краткое содержание", иначе описание"""
+    properties = card.get('properties', {}) or {}
+    content = properties.get(settings.KAITEN_PROPERTY_CONTENT, '') or ''
+    # Если в свойствах нет, пробуем description
+    if not content:
+        content = card.get('description', '') or ''
+    return content
 
-    doc = Document()
-    doc.add_heading('Исходящее письмо', 0)
 
-    doc.add_paragraph(f'Исх. № {{{{outgoing_no}}}} от {{{{outgoing_date}}}}')
-    doc.add_paragraph('')
-    doc.add_paragraph('Уважаемые коллеги,')
-    doc.add_paragraph('')
-    doc.add_paragraph('Направляем Вам информацию по запросу.')
-    doc.add_paragraph('')
-    doc.add_paragraph('С уважением,')
-    doc.add_paragraph('{{stamp}}')
+async def _fetch_card_and_template(card_id: int, selected_file_name: str) -> Tuple[Dict, DocxTemplate]:
+    """
+    Получить карточку и шаблон выбранного DOCX из её списка файлов.
+    Карточка возвращается вместе с шаблоном, чтобы не запрашивать её повторно.
+    Если шаблон уже скачан и проверен фоновым polling, он берётся из кэша.
 
-    output = io.BytesIO()
-    doc.save(output)
-    output.seek(0)
-    return output.read()
+    Args:
+        card_id: ID карточки Kaiten
+        selected_file_name: Имя выбранного DOCX файла
+
+    Returns:
+        Кортеж (данные карточки, разобранный шаблон DOCX)
+    """
+    card = await kaiten_service.get_card_by_id(card_id)
+    if not card:
+        raise HTTPException(status_code=404, detail=f"Card {card_id} not found")
+
+    # Находим выбранный файл в карточке
+    selected_file = None
+    for file_info in card.get('files', []):
+        if file_info.get('name') == selected_file_name:
+            selected_file = file_info
+            break
+
+    if not selected_file:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Файл '{selected_file_name}' не найден в карточке"
+        )
+
+    # Шаблон, заранее проверенный при появлении карточки в колонке "На подпись"
+    template = template_check_service.get_template(selected_file)
+    if template:
+        print(f"[Outbox] Using pre-checked template for file: {selected_file_name}")
+        return card, template
+
+    # Скачиваем DOCX (в mock режиме используем mock данные)
+    if file_service.use_mock:
+        # В mock режиме создаем простой DOCX с плейсхолдерами
+        print(f"[Mock] Creating mock DOCX with placeholders for file: {selected_file_name}")
+        docx_bytes = docx_service.create_mock_docx()
+    else:
+        # Скачиваем реальный файл из Kaiten
+        docx_url = selected_file.get('url') or selected_file.get('path')
+        if not docx_url:
+            raise HTTPException(
+                status_code=404,
+                detail=f"URL файла '{selected_file_name}' не найден"
+            )
+        docx_bytes = await docx_service.download_docx_from_url(docx_url)
+
+    # Разбираем шаблон один раз - для проверки и замены плейсхолдеров
+    try:
+        return card, docx_service.parse_template(docx_bytes)
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Файл '{selected_file_name}' не удалось прочитать как DOCX: {str(e)}"
+        )
 
 
 class ClientSignatureUpload(BaseModel):
-    """Схема для приёма подписи, созданной на клиенте"""
+    """Схема для приёма подписи, созданной на клиенте.
+    Данные для журнала (номер, "Кому", исполнитель) берутся из сессии регистрации"""
     file_id: str  # ID временного файла
     signature: str  # Base64 подпись
     thumbprint: str  # Отпечаток сертификата
     cn: str  # Common Name владельца сертификата
-    # Дополнительные данные для записи в журнал
-    card_id: int  # ID карточки Kaiten
-    outgoing_no: int  # Номер документа (число)
-    formatted_number: str  # Форматированный номер (например, "178-01")
-    outgoing_date: str  # Дата в формате ДД.ММ.ГГГГ
-    to_whom: str  # Кому (из названия карточки)
-    executor: str  # Исполнитель
 
 
 @router.post("/upload-client-signature")
 async def upload_client_signature(
     data: ClientSignatureUpload,
-    db: Session = Depends(get_db),
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
-    Принять подпись, созданную на клиенте (через браузер с КриптоПро)
-    и создать запись в журнале исходящих документов
+    Принять подпись, созданную на клиенте (через браузер с КриптоПро).
+    Подпись проверяется и сохраняется, номер закрепляется - и ответ уходит сразу;
+    папка исходящих и запись в журнале создаются фоновой финализацией
+    (ход - в /status/{file_id}). Повтор с тем же Idempotency-Key получает
+    сохранённый ответ, а не 409
 
     Args:
         data: Данные подписи
+        response: Ответ (заголовок Idempotent-Replayed при повторе)
+        idempotency_key: Ключ идемпотентности клиента
         db: Сессия БД
         current_user: Текущий пользователь
 
     Returns:
-        Результат сохранения подписи и создания записи в журнале
+        Результат приёма подписи
     """
+    return await _run_idempotent(
+        idempotency_key,
+        current_user,
+        "upload-client-signature",
+        data.dict(),
+        response,
+        lambda: _upload_client_signature(db, data)
+    )
+
+
+async def _upload_client_signature(db: AsyncSession, data: ClientSignatureUpload) -> Dict:
+    """Принять подпись в Base64 (тело upload_client_signature)"""
+    part_path = None
     try:
         # Декодируем подпись из Base64
         try:
@@ -311,188 +495,126 @@ async def upload_client_signature(
                 detail=f"Неверный формат подписи Base64: {str(e)}"
             )
 
-        # Проверяем, что файл существует
-        # Ищем файлы с этим file_id
-        matching_files = list(TEMP_FILES_DIR.glob(f"{data.file_id}_*.pdf"))
-        if not matching_files:
+        # Сессия регистрации и подготовленный PDF
+        session = await _get_prepared_session(db, data.file_id)
+        pdf_file_path = TEMP_FILES_DIR / session.pdf_file
+        pdf_bytes = pdf_file_path.read_bytes()
+
+        # Проверяем, что подпись соответствует подготовленному PDF
+        # (подпись по хэшу сверяется с заранее вычисленным хэшем ГОСТ)
+        verification = (await _verify_client_signatures(db, [(session, pdf_bytes, sig_bytes)]))[0]
+        if verification['status'] == 'invalid' and settings.SIGNATURE_REJECT_INVALID:
             raise HTTPException(
-                status_code=404,
-                detail=f"PDF файл с ID {data.file_id} не найден"
+                status_code=400,
+                detail=f"Подпись не прошла проверку: {verification['error']}"
             )
 
-        pdf_file_path = matching_files[0]
-
-        # Создаём .sig файл рядом с PDF
+        # .sig рядом с PDF (его скачивает sign.html и берёт финализация) - сначала
+        # во временный файл запроса, на место он встаёт после приёма подписи
         sig_file_path = pdf_file_path.with_suffix('.pdf.sig')
-        sig_file_path.write_bytes(sig_bytes)
+        part_path = _signature_part_path(sig_file_path)
+        part_path.write_bytes(sig_bytes)
 
-        # Логируем информацию о подписи
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"""
-=== Подпись получена от клиента ===
-Время: {timestamp}
-Владелец сертификата: {data.cn}
-Отпечаток: {data.thumbprint}
-PDF файл: {pdf_file_path.name}
-Размер PDF: {pdf_file_path.stat().st_size} байт
-Размер подписи: {len(sig_bytes)} байт
-========================
-"""
-        print(log_entry)
-
-        # Сохраняем в лог-файл
-        log_path = TEMP_FILES_DIR / "signatures.log"
-        try:
-            with open(log_path, "a", encoding="utf-8") as f:
-                f.write(log_entry + "\n")
-        except Exception as e:
-            print(f"[Outbox] Warning: Could not write to log file: {e}")
+        result = await _accept_client_signature(
+            db, session, data.cn, data.thumbprint, sig_file_path, part_path, sig_bytes, verification
+        )
+        result["sig_file"] = sig_file_path.name
+        return result
 
-        # ========== СОЗДАНИЕ ЗАПИСИ В ЖУРНАЛЕ ==========
+    except HTTPException:
+        await db.rollback()
+        if part_path:
+            part_path.unlink(missing_ok=True)
+        raise
+    except Exception as e:
+        await db.rollback()
+        if part_path:
+            part_path.unlink(missing_ok=True)
+        print(f"[Outbox] Error uploading client signature: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ошибка сохранения подписи: {str(e)}"
+        )
 
-        # 1. Получаем карточку Kaiten для извлечения краткого содержания
-        print(f"[Outbox] Getting Kaiten card {data.card_id} for journal entry...")
-        card = await kaiten_service.get_card_by_id(data.card_id)
-        if not card:
-            raise HTTPException(status_code=404, detail=f"Card {data.card_id} not found")
 
-        # Извлекаем краткое содержание из свойства карточки (properties)
-        from app.core.config import settings as app_settings
-        properties = card.get('properties', {})
-        content = properties.get(app_settings.KAITEN_PROPERTY_CONTENT, '') or ''
-        # Если в свойствах нет, пробуем description
-        if not content:
-            content = card.get('description', '') or ''
+@router.post("/upload-client-signature/binary")
+async def upload_client_signature_binary(
+    response: Response,
+    signature: UploadFile = File(...),
+    file_id: str = Form(...),
+    thumbprint: str = Form(...),
+    cn: str = Form(...),
+    sha256: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Принять подпись клиента файлом (multipart, DER без Base64).
+    Подпись потоком пишется сразу в папку исходящих (без копии в temp_files)
+    и сверяется с контрольной суммой SHA-256, если клиент её передал.
+    Запись в журнал создаётся фоновой финализацией
 
-        # Формируем ссылку на карточку Kaiten
-        kaiten_url = f"https://outbox.kaiten.ru/space/397084/card/{data.card_id}"
+    Args:
+        response: Ответ (заголовок Idempotent-Replayed при повторе)
+        signature: Файл подписи (.sig, DER)
+        file_id: ID временного файла
+        thumbprint: Отпечаток сертификата
+        cn: Common Name владельца сертификата
+        sha256: Контрольная сумма подписи (hex)
+        idempotency_key: Ключ идемпотентности клиента
+        db: Сессия БД
+        current_user: Текущий пользователь
 
-        # 2. Читаем файлы
-        print(f"[Outbox] Reading PDF and SIG files...")
-        pdf_bytes = pdf_file_path.read_bytes()
+    Returns:
+        Результат приёма подписи
+    """
+    return await _run_idempotent(
+        idempotency_key,
+        current_user,
+        "upload-client-signature",
+        {'file_id': file_id, 'thumbprint': thumbprint, 'cn': cn, 'sha256': sha256},
+        response,
+        lambda: _upload_client_signature_binary(db, signature, file_id, thumbprint, cn, sha256)
+    )
 
-        # 3. Получаем приложения (все файлы из карточки, кроме основного DOCX)
-        print(f"[Outbox] Getting attachments from Kaiten...")
-        attachments_bytes = None
-        card_files = card.get('files', [])
-
-        # Фильтруем файлы: исключаем основной DOCX, который был зарегистрирован
-        # Это определяется по имени файла из registrationResult
-        # Но нам нужно знать, какой файл был выбран - это сложно определить здесь
-        # Поэтому возьмём все файлы, кроме .docx файлов (так как основной уже в PDF)
-        attachment_files = [f for f in card_files if not f.get('name', '').lower().endswith('.docx')]
-
-        if attachment_files:
-            print(f"[Outbox] Found {len(attachment_files)} attachments")
-            # Скачиваем и упаковываем в ZIP архив
-            import zipfile
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for file_info in attachment_files:
-                    file_name = file_info.get('name', 'unknown')
-                    file_url = file_info.get('url') or file_info.get('path')
-                    if file_url:
-                        try:
-                            # Скачиваем файл
-                            file_bytes = await file_service.download_file(file_url)
-                            zip_file.writestr(file_name, file_bytes)
-                            print(f"  - Added: {file_name}")
-                        except Exception as e:
-                            print(f"  - Failed to download {file_name}: {e}")
-
-            attachments_bytes = zip_buffer.getvalue()
-            print(f"[Outbox] Attachments archive size: {len(attachments_bytes)} bytes")
-
-        # ========== СОХРАНЕНИЕ ФАЙЛОВ В ПАПКУ ИСХОДЯЩИХ ==========
-
-        # 4. Создаём папку и сохраняем файлы в /mnt/doc/Исходящие/{номер}
-        from app.core.config import settings
-        outgoing_folder = Path(settings.OUTGOING_FILES_PATH) / data.formatted_number
-
-        print(f"[Outbox] Creating folder: {outgoing_folder}")
-        try:
-            outgoing_folder.mkdir(parents=True, exist_ok=True)
-        except PermissionError as e:
-            error_msg = f"Нет прав на создание папки {outgoing_folder}. Создайте папку вручную и настройте права: sudo mkdir -p {Path(settings.OUTGOING_FILES_PATH)} && sudo chown -R $USER:$USER {Path(settings.OUTGOING_FILES_PATH)}"
-            print(f"[Outbox] ERROR: Permission denied creating folder: {outgoing_folder}")
-            print(f"[Outbox] Please run: sudo mkdir -p {Path(settings.OUTGOING_FILES_PATH)} && sudo chown -R $USER:$USER {Path(settings.OUTGOING_FILES_PATH)}")
-            raise HTTPException(status_code=500, detail=error_msg)
-
-        # Сохраняем PDF
-        pdf_filename = pdf_file_path.name.replace(f"{data.file_id}_", "")  # Убираем file_id из имени
-        pdf_save_path = outgoing_folder / pdf_filename
-        pdf_save_path.write_bytes(pdf_bytes)
-        print(f"[Outbox] Saved PDF: {pdf_save_path}")
-
-        # Сохраняем SIG
-        sig_filename = pdf_filename.replace('.pdf', '.pdf.sig')
-        sig_save_path = outgoing_folder / sig_filename
-        sig_save_path.write_bytes(sig_bytes)
-        print(f"[Outbox] Saved SIG: {sig_save_path}")
-
-        # Сохраняем приложения (отдельные файлы, а не архив)
-        if attachment_files:
-            print(f"[Outbox] Saving {len(attachment_files)} attachments to folder...")
-            for file_info in attachment_files:
-                file_name = file_info.get('name', 'unknown')
-                file_url = file_info.get('url') or file_info.get('path')
-                if file_url:
-                    try:
-                        # Скачиваем файл (повторно, если нужно)
-                        file_bytes = await file_service.download_file(file_url)
-                        attachment_save_path = outgoing_folder / file_name
-                        attachment_save_path.write_bytes(file_bytes)
-                        print(f"  - Saved: {file_name}")
-                    except Exception as e:
-                        print(f"  - Failed to save {file_name}: {e}")
-
-        print(f"[Outbox] All files saved to: {outgoing_folder}")
-
-        # 6. Конвертируем дату из ДД.ММ.ГГГГ в date
-        from datetime import datetime as dt
-        outgoing_date_obj = dt.strptime(data.outgoing_date, "%d.%m.%Y").date()
-
-        # 7. Создаём запись в журнале
-        from app.models.outbox_journal import OutboxJournal
-
-        print(f"[Outbox] Creating journal entry...")
-        journal_entry = OutboxJournal(
-            outgoing_no=data.outgoing_no,  # Числовая часть (например, 178)
-            formatted_number=data.formatted_number,  # Полный форматированный номер (например, "178-01")
-            outgoing_date=outgoing_date_obj,
-            to_whom=data.to_whom,
-            executor=data.executor,
-            content=content[:500] if content else None,  # Ограничиваем длину
-            kaiten_card_url=kaiten_url,
-            file_blob=pdf_bytes,
-            sig_blob=sig_bytes,
-            attachments_blob=attachments_bytes,
-            folder_path=str(outgoing_folder)  # Путь к папке с файлами
-        )
 
-        db.add(journal_entry)
-        db.commit()
-        db.refresh(journal_entry)
+async def _upload_client_signature_binary(
+    db: AsyncSession,
+    signature: UploadFile,
+    file_id: str,
+    thumbprint: str,
+    cn: str,
+    sha256: Optional[str]
+) -> Dict:
+    """Принять подпись файлом (тело upload_client_signature_binary)"""
+    part_path = None
+    try:
+        session = await _get_prepared_session(db, file_id)
+        sig_path = _outgoing_folder(session.formatted_number) / outgoing_sig_name(session)
+        sig_bytes, part_path = await _stream_signature(signature, sig_path, sha256)
+        pdf_bytes = (TEMP_FILES_DIR / session.pdf_file).read_bytes()
 
-        print(f"[Outbox] Journal entry created: ID={journal_entry.id}")
+        verification = (await _verify_client_signatures(db, [(session, pdf_bytes, sig_bytes)]))[0]
+        if verification['status'] == 'invalid' and settings.SIGNATURE_REJECT_INVALID:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Подпись не прошла проверку: {verification['error']}"
+            )
 
-        return {
-            "success": True,
-            "message": "Подпись сохранена, файлы записаны в папку и запись добавлена в журнал",
-            "pdf_file": pdf_file_path.name,
-            "sig_file": sig_file_path.name,
-            "folder_path": str(outgoing_folder),
-            "journal_entry_id": journal_entry.id,
-            "timestamp": timestamp,
-            "certificate": {
-                "cn": data.cn,
-                "thumbprint": data.thumbprint
-            }
-        }
+        return await _accept_client_signature(db, session, cn, thumbprint, sig_path, part_path, sig_bytes, verification)
 
     except HTTPException:
+        await db.rollback()
+        if part_path:
+            part_path.unlink(missing_ok=True)
         raise
     except Exception as e:
+        await db.rollback()
+        if part_path:
+            part_path.unlink(missing_ok=True)
         print(f"[Outbox] Error uploading client signature: {e}")
         import traceback
         traceback.print_exc()
@@ -502,6 +624,508 @@ PDF файл: {pdf_file_path.name}
         )
 
 
+async def _get_prepared_session(db: AsyncSession, file_id: str) -> RegistrationSession:
+    """
+    Найти сессию регистрации, ожидающую подписи, и проверить наличие подготовленного PDF
+
+    Raises:
+        HTTPException: 404 - сессии или PDF нет, 409 - документ уже подписан или подготовка отменена
+    """
+    session = await db.run_sync(registration_session_service.get, file_id)
+    if not session:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Подготовленный документ с ID {file_id} не найден"
+        )
+    if session.status != "prepared":
+        raise HTTPException(
+            status_code=409,
+            detail=f"Документ {session.formatted_number} уже обработан (статус: {session.status})"
+        )
+    if not (TEMP_FILES_DIR / session.pdf_file).exists():
+        raise HTTPException(
+            status_code=404,
+            detail=f"PDF файл с ID {file_id} не найден"
+        )
+    return session
+
+
+async def _accept_client_signature(
+    db: AsyncSession,
+    session: RegistrationSession,
+    cn: str,
+    thumbprint: str,
+    sig_path: Path,
+    part_path: Path,
+    sig_bytes: bytes,
+    verification: Dict
+) -> Dict:
+    """
+    Принять проверенную подпись (с commit): закрепить номер и перевести сессию
+    в статус "signed", поставить подпись на место и документ - в очередь фоновой
+    финализации. Подпись встаёт на место только после commit: параллельный
+    повтор загрузки получает 409 и не затирает уже принятую подпись.
+    После commit документ не потеряется - даже если процесс упадёт, финализацию
+    подхватит обход БД при следующем запуске
+
+    Args:
+        db: Сессия БД
+        session: Сессия регистрации
+        cn: Common Name владельца сертификата
+        thumbprint: Отпечаток сертификата
+        sig_path: Итоговый путь подписи
+        part_path: Временный файл подписи этого запроса (_signature_part_path)
+        sig_bytes: Подпись
+        verification: Результат проверки подписи
+
+    Returns:
+        Ответ API
+
+    Raises:
+        HTTPException: 409 - документ уже подписан параллельным запросом или резерв номера истёк
+    """
+    timestamp = _log_client_signature(cn, thumbprint, session, len(sig_bytes))
+    await db.run_sync(_mark_signed, session, cn, thumbprint, sig_path, verification)
+    await db.commit()
+    part_path.replace(sig_path)
+    finalization_service.enqueue(session.file_id)
+
+    print(f"[Outbox] Signature accepted: {session.formatted_number}, finalization queued")
+
+    return {
+        "success": True,
+        "status": "signed",
+        "message": "Подпись принята, документ записывается в папку исходящих и в журнал",
+        "file_id": session.file_id,
+        "formatted_number": session.formatted_number,
+        "pdf_file": session.pdf_file,
+        "sig_file": sig_path.name,
+        "sig_status": verification['status'],
+        "status_url": f"/api/outbox/status/{session.file_id}",
+        "timestamp": timestamp,
+        "certificate": {
+            "cn": cn,
+            "thumbprint": thumbprint
+        }
+    }
+
+
+def _mark_signed(
+    db: Session,
+    session: RegistrationSession,
+    cn: str,
+    thumbprint: str,
+    sig_path: Path,
+    verification: Dict
+):
+    """
+    Закрепить номер и отметить сессию подписанной (без commit - пакет фиксирует
+    все документы одной транзакцией). Синхронная часть: вызывается через
+    AsyncSession.run_sync
+
+    Raises:
+        HTTPException: 409 - документ уже подписан параллельным запросом или резерв номера истёк
+    """
+    # Блокируем сессию: повторная или параллельная загрузка подписи не создаст дубль
+    locked = registration_session_service.get(db, session.file_id, for_update=True)
+    if not locked or locked.status != "prepared":
+        raise HTTPException(
+            status_code=409,
+            detail=f"Документ {session.formatted_number} уже обработан"
+        )
+    try:
+        numbering_service.commit_reservation(db, session.file_id, session.outgoing_no)
+    except NumberReservationError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    registration_session_service.mark_signed(db, locked, str(sig_path), verification['status'], cn, thumbprint)
+
+
+def _signature_part_path(target_path: Path) -> Path:
+    """
+    Временный файл подписи, свой у каждого запроса (<имя>.<uuid>.part): параллельные
+    загрузки подписи одного документа не пишут в один файл
+    """
+    return target_path.with_name(f"{target_path.name}.{uuid.uuid4().hex}.part")
+
+
+async def _stream_signature(
+    upload: UploadFile,
+    target_path: Path,
+    expected_sha256: Optional[str] = None
+) -> Tuple[bytes, Path]:
+    """
+    Записать загружаемую подпись потоком во временный файл запроса рядом с
+    итоговым местом хранения. На место (target_path) файл ставит
+    _accept_client_signature после приёма подписи; файл с неверным размером или
+    контрольной суммой удаляется сразу - в папке не остаётся обрывков
+
+    Args:
+        upload: Загружаемый файл подписи
+        target_path: Итоговый путь .sig
+        expected_sha256: Ожидаемая контрольная сумма SHA-256 (hex), если передана клиентом
+
+    Returns:
+        Содержимое подписи (для проверки и записи в журнал) и временный файл
+    """
+    part_path = _signature_part_path(target_path)
+    checksum = hashlib.sha256()
+    chunks = []
+    size = 0
+    try:
+        with open(part_path, "wb") as f:
+            while chunk := await upload.read(SIGNATURE_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_SIGNATURE_SIZE:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Файл подписи больше {MAX_SIGNATURE_SIZE // 1024} КБ"
+                    )
+                checksum.update(chunk)
+                f.write(chunk)
+                chunks.append(chunk)
+
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Пустой файл подписи")
+        if expected_sha256 and checksum.hexdigest() != expected_sha256.strip().lower():
+            raise HTTPException(
+                status_code=400,
+                detail="Контрольная сумма подписи не совпадает - файл повреждён при передаче"
+            )
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+
+    print(f"[Outbox] Signature received: {part_path} ({size} bytes)")
+    return b"".join(chunks), part_path
+
+
+async def _verify_client_signatures(
+    db: AsyncSession,
+    documents: List[Tuple[RegistrationSession, bytes, bytes]]
+) -> List[Dict]:
+    """
+    Проверить подписи клиента одним вызовом (cryptcp проверяет их пачками).
+    Подпись по хэшу сверяется с хэшем ГОСТ, сохранённым в сессии при подготовке
+
+    Args:
+        db: Сессия БД
+        documents: Список (сессия регистрации, содержимое PDF, подпись)
+
+    Returns:
+        Результаты проверки в порядке документов
+    """
+    verifications = await signature_verification_service.verify_many(
+        db,
+        [(pdf_bytes, sig_bytes) for _, pdf_bytes, sig_bytes in documents],
+        known_digests=[
+            {GOST_HASH_ALGORITHMS[name]: value for name, value in (session.document_digests or {}).items()}
+            for session, _, _ in documents
+        ]
+    )
+    await db.commit()
+    for (session, _, _), verification in zip(documents, verifications):
+        print(f"[Outbox] Signature check {session.pdf_file}: {verification['status']} ({verification['method']})")
+    return verifications
+
+
+def _log_client_signature(cn: str, thumbprint: str, session: RegistrationSession, sig_size: int) -> str:
+    """Записать сведения о полученной подписи в консоль и signatures.log"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    log_entry = f"""
+=== Подпись получена от клиента ===
+Время: {timestamp}
+Владелец сертификата: {cn}
+Отпечаток: {thumbprint}
+PDF файл: {session.pdf_file}
+Размер PDF: {session.pdf_size} байт
+Размер подписи: {sig_size} байт
+========================
+"""
+    print(log_entry)
+
+    log_path = TEMP_FILES_DIR / "signatures.log"
+    try:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(log_entry + "\n")
+    except Exception as e:
+        print(f"[Outbox] Warning: Could not write to log file: {e}")
+    return timestamp
+
+
+def _outgoing_folder(formatted_number: str) -> Path:
+    """Создать (если нужно) папку документа /mnt/doc/Исходящие/{номер}"""
+    try:
+        return outgoing_folder_path(formatted_number)
+    except FinalizationError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ========== ПАКЕТНОЕ ПОДПИСАНИЕ ==========
+
+@router.post("/batch/prepare", response_model=BatchPrepareResponse)
+async def prepare_batch(
+    request: BatchPrepareRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Подготовить пакет документов к подписанию одним сертификатом.
+    Документы готовятся параллельно (не более BATCH_PREPARE_CONCURRENCY одновременно),
+    ошибка одного документа не прерывает пакет. Состав пакета хранится в сессиях регистрации
+
+    Args:
+        request: Список карточек и выбранных DOCX
+        current_user: Текущий пользователь
+
+    Returns:
+        Манифест пакета: для каждого документа - данные регистрации (PDF, хэши) или ошибка
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Пакет не содержит документов")
+    if len(request.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"В пакете не более {settings.BATCH_MAX_ITEMS} документов"
+        )
+
+    batch_id = str(uuid.uuid4())
+    username = current_user.get('username', 'default')
+    semaphore = asyncio.Semaphore(max(1, settings.BATCH_PREPARE_CONCURRENCY))
+
+    async def prepare_item(item: RegisterRequest) -> BatchPrepareItem:
+        async with semaphore:
+            # У каждого документа своя сессия - резерв номера фиксируется независимо
+            db = AsyncSessionLocal()
+            try:
+                registration = await _prepare_document(
+                    db, item.card_id, item.selected_file_name, username, batch_id=batch_id
+                )
+                return BatchPrepareItem(
+                    card_id=item.card_id,
+                    selected_file_name=item.selected_file_name,
+                    status="ready",
+                    registration=registration
+                )
+            except HTTPException as e:
+                error = e.detail
+            except Exception as e:
+                error = str(e)
+            finally:
+                await db.close()
+            print(f"[Outbox] Batch item card {item.card_id} failed: {error}")
+            return BatchPrepareItem(
+                card_id=item.card_id,
+                selected_file_name=item.selected_file_name,
+                status="error",
+                error=str(error)
+            )
+
+    items = await asyncio.gather(*[prepare_item(item) for item in request.items])
+
+    ready = sum(1 for item in items if item.status == "ready")
+    print(f"[Outbox] Batch {batch_id} prepared: {ready}/{len(items)} documents ready")
+    return BatchPrepareResponse(
+        batch_id=batch_id,
+        created_at=datetime.now().isoformat(),
+        items=items
+    )
+
+
+@router.post("/batch/{batch_id}/signatures")
+async def upload_batch_signatures(
+    batch_id: str,
+    signatures: List[UploadFile] = File(...),
+    thumbprint: str = Form(...),
+    cn: str = Form(...),
+    checksums: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Принять подписи пакета одним multipart запросом. Каждая подпись - файл
+    "<file_id>.sig" (DER), который потоком пишется сразу в папку исходящих.
+    Принятые подписи (закреплённые номера) фиксируются одной транзакцией,
+    документ с ошибкой откатывается отдельно (savepoint) и не мешает остальным.
+    Папки и записи журнала создаются фоновой финализацией
+
+    Args:
+        batch_id: ID пакета из /batch/prepare
+        signatures: Подписи документов
+        thumbprint: Отпечаток сертификата
+        cn: Common Name владельца сертификата
+        checksums: JSON {file_id: SHA-256 подписи (hex)} для проверки целостности
+        db: Сессия БД
+        current_user: Текущий пользователь
+
+    Returns:
+        Итоги пакета и результат по каждому документу
+    """
+    batch_sessions = await db.run_sync(registration_session_service.get_batch, batch_id)
+    if not batch_sessions:
+        raise HTTPException(status_code=404, detail=f"Пакет {batch_id} не найден")
+    sessions = {session.file_id: session for session in batch_sessions if session.status == "prepared"}
+
+    try:
+        expected_checksums = json.loads(checksums) if checksums else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="checksums должен быть JSON объектом {file_id: sha256}")
+
+    results = {}
+    documents = []  # (сессия, PDF, подпись, путь .sig, временный файл подписи)
+    for upload in signatures:
+        file_id = Path(upload.filename or "").name
+        if file_id.endswith(".sig"):
+            file_id = file_id[:-len(".sig")]
+        session = sessions.get(file_id)
+        if session is None or file_id in results:
+            results[file_id] = {"file_id": file_id, "status": "error", "error": "Документ не входит в пакет, уже подписан или подпись передана повторно"}
+            continue
+        try:
+            pdf_file_path = TEMP_FILES_DIR / session.pdf_file
+            if not pdf_file_path.exists():
+                raise HTTPException(status_code=404, detail=f"PDF файл с ID {file_id} не найден")
+            sig_path = _outgoing_folder(session.formatted_number) / outgoing_sig_name(session)
+            sig_bytes, part_path = await _stream_signature(upload, sig_path, expected_checksums.get(file_id))
+        except HTTPException as e:
+            results[file_id] = {"file_id": file_id, "status": "error", "error": e.detail}
+            continue
+        results[file_id] = None
+        documents.append((session, pdf_file_path.read_bytes(), sig_bytes, sig_path, part_path))
+
+    accepted = []
+    try:
+        # 1. Проверяем все подписи одним вызовом
+        verifications = await _verify_client_signatures(
+            db,
+            [(session, pdf_bytes, sig_bytes) for session, pdf_bytes, sig_bytes, _, _ in documents]
+        )
+
+        # 2. Закрепляем номера принятых подписей одной транзакцией (savepoint на документ)
+        for (session, _, sig_bytes, sig_path, part_path), verification in zip(documents, verifications):
+            # Откат savepoint сбрасывает атрибуты сессии - значения для ответа берутся заранее
+            file_id, formatted_number = session.file_id, session.formatted_number
+            try:
+                if verification['status'] == 'invalid' and settings.SIGNATURE_REJECT_INVALID:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Подпись не прошла проверку: {verification['error']}"
+                    )
+                async with db.begin_nested():
+                    await db.run_sync(_mark_signed, session, cn, thumbprint, sig_path, verification)
+            except HTTPException as e:
+                part_path.unlink(missing_ok=True)
+                print(f"[Outbox] Batch item {formatted_number} failed: {e.detail}")
+                results[file_id] = {
+                    "file_id": file_id,
+                    "status": "error",
+                    "error": e.detail
+                }
+                continue
+            _log_client_signature(cn, thumbprint, session, len(sig_bytes))
+            accepted.append((session, verification, sig_path, part_path))
+
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        # Удаляются только свои временные файлы - принятые подписи других запросов не трогаем
+        for _, _, _, _, part_path in documents:
+            part_path.unlink(missing_ok=True)
+        print(f"[Outbox] Error accepting batch {batch_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка сохранения пакета подписей: {str(e)}")
+
+    # Номера закреплены - подписи встают на место
+    for session, verification, sig_path, part_path in accepted:
+        part_path.replace(sig_path)
+        finalization_service.enqueue(session.file_id)
+        results[session.file_id] = {
+            "file_id": session.file_id,
+            "status": "signed",
+            "card_id": session.card_id,
+            "formatted_number": session.formatted_number,
+            "outgoing_date": docx_service.format_date(session.outgoing_date),
+            "sig_status": verification['status'],
+            "status_url": f"/api/outbox/status/{session.file_id}"
+        }
+
+    # Документы пакета, подпись которых не передана
+    for file_id in sessions:
+        if file_id not in results:
+            results[file_id] = {"file_id": file_id, "status": "missing", "error": "Подпись не передана"}
+
+    signed = sum(1 for result in results.values() if result['status'] == 'signed')
+    print(f"[Outbox] Batch {batch_id}: {signed}/{len(results)} signatures accepted, finalization queued")
+    return {
+        "batch_id": batch_id,
+        "signed": signed,
+        "failed": len(results) - signed,
+        "items": list(results.values()),
+        "certificate": {
+            "cn": cn,
+            "thumbprint": thumbprint
+        }
+    }
+
+
+@router.post("/release/{file_id}")
+async def release_registration(
+    file_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Отменить подготовленную регистрацию и освободить зарезервированный номер
+    (номер будет выдан следующему документу)
+
+    Args:
+        file_id: ID подготовленных файлов
+        db: Сессия БД
+        current_user: Текущий пользователь
+
+    Returns:
+        Результат освобождения номера
+    """
+    try:
+        await db.run_sync(registration_session_service.mark_released, file_id)
+        released = await db.run_sync(numbering_service.release_reservation, file_id)
+        await db.commit()
+        return {"file_id": file_id, "released": released}
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error releasing reservation: {str(e)}")
+
+
+@router.get("/hash/{file_id}")
+async def get_document_hash(
+    file_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Получить хэш ГОСТ Р 34.11-2012 подготовленного PDF для подписи по хэшу (SignHash).
+    Подпись по хэшу загружается через upload-client-signature и сверяется с PDF на сервере
+
+    Args:
+        file_id: ID подготовленных файлов
+        db: Сессия БД
+        current_user: Текущий пользователь
+
+    Returns:
+        Хэши документа; hash_signing=False, если хэш вычислить нельзя
+        (КриптоПро на сервере не установлен) - тогда подписывается весь PDF
+    """
+    session = await db.run_sync(registration_session_service.get, file_id)
+    if not session:
+        raise HTTPException(status_code=404, detail=f"PDF файл с ID {file_id} не найден")
+
+    digests = session.document_digests
+    return {
+        "file_id": file_id,
+        "hash_signing": bool(digests),
+        "digests": digests or {},
+        "pdf_file": session.pdf_file,
+        "pdf_size": session.pdf_size
+    }
+
+
 @router.get("/download/{filename}")
 async def download_file(filename: str):
     """
@@ -539,40 +1163,163 @@ async def download_file(filename: str):
 
 
 @router.get("/status/{file_id}")
-async def get_file_status(file_id: str):
+async def get_file_status(file_id: str, db: AsyncSession = Depends(get_async_db)):
     """
-    Получить статус файлов (PDF, DOCX, SIG) по file_id
+    Получить статус файлов (PDF, DOCX, SIG) и сессии регистрации по file_id.
+    После загрузки подписи здесь видно ход фоновой финализации:
+    "signed" (этап, попытки, последняя ошибка) -> "finalized" (journal_entry_id) или "failed"
 
     Args:
         file_id: ID файла
+        db: Сессия БД
 
     Returns:
         Информация о существующих файлах
     """
-    pdf_files = list(TEMP_FILES_DIR.glob(f"{file_id}_*.pdf"))
-    docx_files = list(TEMP_FILES_DIR.glob(f"{file_id}_*.docx"))
-    sig_files = list(TEMP_FILES_DIR.glob(f"{file_id}_*.pdf.sig"))
+    session = await db.run_sync(registration_session_service.get, file_id)
+    if not session:
+        return {
+            "file_id": file_id,
+            "pdf_exists": False,
+            "docx_exists": False,
+            "sig_exists": False,
+        }
+
+    pdf_path = TEMP_FILES_DIR / session.pdf_file
+    docx_path = TEMP_FILES_DIR / session.docx_file if session.docx_file else None
+    sig_path = Path(session.sig_path) if session.sig_path else pdf_path.with_suffix('.pdf.sig')
 
     result = {
         "file_id": file_id,
-        "pdf_exists": len(pdf_files) > 0,
-        "docx_exists": len(docx_files) > 0,
-        "sig_exists": len(sig_files) > 0,
+        "status": session.status,
+        "formatted_number": session.formatted_number,
+        "journal_entry_id": session.journal_entry_id,
+        "sig_status": session.sig_status,
+        "finalization": {
+            "stage": session.finalize_stage,
+            "attempts": session.finalize_attempts or 0,
+            "error": session.finalize_error,
+            "next_attempt_at": session.finalize_next_at.isoformat() if session.finalize_next_at else None
+        },
+        "pdf_exists": pdf_path.exists(),
+        "docx_exists": bool(docx_path and docx_path.exists()),
+        "sig_exists": sig_path.exists(),
     }
 
-    if pdf_files:
-        pdf_path = pdf_files[0]
+    if result["pdf_exists"]:
         result["pdf_file"] = pdf_path.name
-        result["pdf_size"] = pdf_path.stat().st_size
+        result["pdf_size"] = session.pdf_size
 
-    if docx_files:
-        docx_path = docx_files[0]
+    if result["docx_exists"]:
         result["docx_file"] = docx_path.name
         result["docx_size"] = docx_path.stat().st_size
 
-    if sig_files:
-        sig_path = sig_files[0]
+    if result["sig_exists"]:
         result["sig_file"] = sig_path.name
         result["sig_size"] = sig_path.stat().st_size
 
     return result
+
+
+@router.post("/finalize/{file_id}/retry")
+async def retry_finalization(
+    file_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Повторить фоновую финализацию документа в статусе "failed"
+    (например, после исправления прав на папку исходящих)
+
+    Args:
+        file_id: ID подготовленных файлов
+        db: Сессия БД
+        current_user: Текущий пользователь
+
+    Returns:
+        Статус документа
+    """
+    try:
+        session = await db.run_sync(registration_session_service.mark_retry, file_id)
+        if not session:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Документ {file_id} не найден или его финализация не завершилась ошибкой"
+            )
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Ошибка повтора финализации: {str(e)}")
+
+    finalization_service.enqueue(file_id)
+    return {"file_id": file_id, "status": session.status}
+
+
+@router.get("/finalize/metrics")
+async def get_finalization_metrics(
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Получить метрики фоновой финализации (очередь, записано, повторы, ошибки)
+
+    Args:
+        current_user: Текущий пользователь
+
+    Returns:
+        Метрики финализации
+    """
+    return finalization_service.get_metrics()
+
+
+@router.get("/cryptopro/metrics")
+async def get_cryptopro_metrics(
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Получить метрики пула процессов cryptcp (запуски, документы, ошибки, таймауты, загрузка)
+
+    Args:
+        current_user: Текущий пользователь
+
+    Returns:
+        Метрики пула
+    """
+    return cryptopro_service.get_metrics()
+
+
+@router.get("/temp-files/metrics")
+async def get_temp_files_metrics(
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Получить метрики уборки temp_files (размер, число файлов, истёкшие сессии, вытеснения по квоте)
+
+    Args:
+        current_user: Текущий пользователь
+
+    Returns:
+        Метрики уборки
+    """
+    return temp_files_janitor.get_metrics()
+
+
+@router.post("/temp-files/cleanup")
+async def cleanup_temp_files(
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Запустить уборку temp_files немедленно
+
+    Args:
+        current_user: Текущий пользователь
+
+    Returns:
+        Метрики после уборки
+    """
+    try:
+        return await temp_files_janitor.run_once()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка уборки temp_files: {str(e)}")
@@ -7,7 +7,12 @@ import asyncio
 from pathlib import Path
 from app.core.config import settings
 from app.api import kaiten, files, auth, journal, outbox
+from app.models.database import async_engine
 from app.services.kaiten_service import kaiten_service
+from app.services.template_check_service import template_check_service
+from app.services.temp_files_service import temp_files_janitor
+from app.services.finalization_service import finalization_service
+from app.services.blob_tiering_service import blob_tiering_service
 
 
 # Фоновые задачи для polling
@@ -21,8 +26,9 @@ async def lifespan(app: FastAPI):
     print("[Startup] Starting background polling tasks...")
 
     # Создаем задачу для polling колонки "На подпись" (для director)
+    # с предварительной проверкой шаблонов новых карточек
     task_director = asyncio.create_task(
-        kaiten_service.poll_cards("На подпись")
+        kaiten_service.poll_cards("На подпись", on_cards=template_check_service.validate_cards)
     )
     background_tasks.add(task_director)
 
@@ -32,6 +38,19 @@ async def lifespan(app: FastAPI):
     )
     background_tasks.add(task_head)
 
+    # Уборка temp_files: истечение неподписанных подготовок, квота
+    task_janitor = asyncio.create_task(temp_files_janitor.run_forever())
+    background_tasks.add(task_janitor)
+
+    # Фоновая финализация подписанных документов (папка исходящих, журнал)
+    task_finalize = asyncio.create_task(finalization_service.run_forever())
+    background_tasks.add(task_finalize)
+
+    # Холодное хранение файлов журнала прошлых лет (сжатые архивы)
+    if settings.BLOB_TIERING_ENABLED:
+        task_tiering = asyncio.create_task(blob_tiering_service.run_forever())
+        background_tasks.add(task_tiering)
+
     print("[Startup] Background tasks started")
 
     yield
@@ -41,6 +60,8 @@ async def lifespan(app: FastAPI):
     for task in background_tasks:
         task.cancel()
     await asyncio.gather(*background_tasks, return_exceptions=True)
+    # Закрываем соединения пула асинхронного engine
+    await async_engine.dispose()
     print("[Shutdown] All tasks stopped")
 
 
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime
+from sqlalchemy.sql import func
+from app.models.database import Base
+
+
+class Blob(Base):
+    """Файл в хранилище по содержимому (SHA-256) и число ссылающихся на него записей"""
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)  # 0 - файл удаляется сборкой мусора
+    # "hot" - отдельный файл в BLOB_STORE_PATH, "cold" - сжат (zstd) в архив BLOB_COLD_PATH/<pack>
+    tier = Column(String, nullable=False, default="hot", server_default="hot")
+    pack = Column(String, nullable=True)  # Имя архива ("2024-03" или "2024")
+    pack_offset = Column(BigInteger, nullable=True)  # Смещение сжатого файла в архиве
+    pack_length = Column(BigInteger, nullable=True)  # Размер сжатого файла
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+
+    def __repr__(self):
+        return f"<Blob(sha256={self.sha256[:12]}, size={self.size}, refcount={self.refcount}, tier='{self.tier}')>"
@@ -1,13 +1,19 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
-# Создаем engine для подключения к БД
+# Создаем engine для подключения к БД (фоновые задачи, потоки, скрипты, миграции)
 engine = create_engine(
     settings.DATABASE_URL,
     echo=settings.DEBUG,
-    future=True
+    future=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=settings.DB_POOL_RECYCLE_SECONDS
 )
 
 # Создаем сессию
@@ -17,6 +23,37 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+
+def async_database_url(url: str) -> str:
+    """URL БД для асинхронного драйвера: postgresql[+psycopg2]://... -> postgresql+asyncpg://..."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "postgresql":
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    return parsed.render_as_string(hide_password=False)
+
+
+# Асинхронный engine для запросов API: ожидание БД не занимает цикл событий,
+# и медленный запрос не задерживает остальные запросы того же воркера.
+# Пул проверяет соединение перед выдачей (pre-ping), asyncpg кэширует
+# подготовленные выражения на каждом соединении
+async_engine = create_async_engine(
+    async_database_url(settings.DATABASE_URL),
+    echo=settings.DEBUG,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+    connect_args={"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+)
+
+# Асинхронная сессия (объекты не истекают после commit - к ним обращаются без нового запроса)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Базовый класс для моделей
 Base = declarative_base()
 
@@ -28,3 +65,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Dependency для получения асинхронной сессии БД
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, JSON, UniqueConstraint
+from sqlalchemy.sql import func
+from app.models.database import Base
+
+
+class IdempotencyKey(Base):
+    """Сохранённый ответ запроса с заголовком Idempotency-Key (повтор получает его без повторной работы)"""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("username", "endpoint", "key", name="uq_idempotency_keys_user_endpoint_key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, nullable=False)  # Значение заголовка Idempotency-Key
+    username = Column(String, nullable=False)  # Ключи разных пользователей не пересекаются
+    endpoint = Column(String, nullable=False)  # Например, "prepare-registration"
+    request_hash = Column(String(64), nullable=False)  # SHA-256 параметров запроса
+    status = Column(String, nullable=False, default="in_progress")  # "in_progress" или "completed"
+    status_code = Column(Integer, nullable=True)
+    response = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(endpoint='{self.endpoint}', key='{self.key}', status='{self.status}')>"
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, BigInteger, DateTime
+from sqlalchemy.sql import func
+from app.models.database import Base
+
+
+class JournalVersion(Base):
+    """Версия журнала (одна строка): растёт в транзакции каждого изменения записей"""
+    __tablename__ = "journal_version"
+
+    id = Column(Integer, primary_key=True)  # Всегда 1
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<JournalVersion(version={self.version})>"
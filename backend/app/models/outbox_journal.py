@@ -1,11 +1,55 @@
-from sqlalchemy import Column, Integer, String, Date, LargeBinary, DateTime
+from sqlalchemy import Column, Integer, String, Text, Date, LargeBinary, DateTime, JSON, Index, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from app.models.database import Base
 
 
+# Конфигурация полнотекстового поиска (русская морфология)
+SEARCH_CONFIG = "russian"
+
+# Поля поиска одной строкой - для триграммного (нечёткого) поиска
+SEARCH_TEXT_SQL = (
+    "coalesce(formatted_number, '') || ' ' || coalesce(to_whom, '') || ' ' || "
+    "coalesce(executor, '') || ' ' || coalesce(content, '')"
+)
+
+# Поисковый вектор: номер и адресат весят больше содержания, исполнитель - меньше
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('russian', coalesce(formatted_number, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(to_whom, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(content, '')), 'B') || "
+    "setweight(to_tsvector('russian', coalesce(executor, '')), 'C')"
+)
+
+
 class OutboxJournal(Base):
-    """Модель журнала исходящих документов"""
+    """
+    Модель журнала исходящих документов.
+    Файлы новых записей лежат в хранилище по содержимому (blob_service),
+    запись хранит их SHA-256. BLOB столбцы остались у записей, созданных
+    до хранилища (перенос - migrate_journal_blobs.py); они отложены: запрос
+    записи их не читает, пока к ним не обратятся (или не запросят через undefer / проекцию)
+    """
     __tablename__ = "outbox_journal"
+    __table_args__ = (
+        # Порядок списка журнала и курсор страницы (outgoing_no, id)
+        Index("ix_outbox_journal_outgoing_no_id", "outgoing_no", "id"),
+        # Фильтр по интервалу дат; id и sig_status в индексе - счётчики по фильтрам
+        # считаются сканированием только индекса
+        Index(
+            "ix_outbox_journal_date_no", "outgoing_date", "outgoing_no",
+            postgresql_include=["id", "sig_status"]
+        ),
+        # Поиск: полнотекстовый и триграммный (частичные совпадения, опечатки; нужен pg_trgm)
+        Index("ix_outbox_journal_search_vector", "search_vector", postgresql_using="gin"),
+        Index(
+            "ix_outbox_journal_search_trgm", "search_text",
+            postgresql_using="gin", postgresql_ops={"search_text": "gin_trgm_ops"}
+        ),
+        # Инкрементальная выгрузка для внешних систем: записи после отметки (created_at, id)
+        Index("ix_outbox_journal_created_at_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     outgoing_no = Column(Integer, nullable=False, index=True)  # Числовая часть номера (например, 178)
@@ -15,11 +59,20 @@ class OutboxJournal(Base):
     executor = Column(String, nullable=True)
     content = Column(String, nullable=True)  # Краткое содержание
     kaiten_card_url = Column(String, nullable=True)  # Ссылка на карточку Kaiten
-    file_blob = Column(LargeBinary, nullable=True)  # PDF письма
-    sig_blob = Column(LargeBinary, nullable=True)  # Файл подписи .sig
-    attachments_blob = Column(LargeBinary, nullable=True)  # Приложения (архив)
+    file_blob = deferred(Column(LargeBinary, nullable=True))  # PDF письма
+    sig_blob = deferred(Column(LargeBinary, nullable=True))  # Файл подписи .sig
+    attachments_blob = deferred(Column(LargeBinary, nullable=True))  # Приложения (архив)
+    file_sha256 = Column(String(64), nullable=True)  # PDF письма в хранилище
+    sig_sha256 = Column(String(64), nullable=True)  # Подпись в хранилище
+    attachments = Column(JSON(none_as_null=True), nullable=True)  # Приложения в хранилище: [{'name', 'sha256', 'size'}]
     folder_path = Column(String, nullable=True)
+    sig_status = Column(String, nullable=True, index=True)  # Результат проверки подписи (NULL - не проверялась)
+    sig_checked_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    # Поиск (вычисляются БД при записи, миграция 0010)
+    search_text = deferred(Column(Text, Computed(SEARCH_TEXT_SQL, persisted=True)))
+    search_vector = deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True)))
+
     def __repr__(self):
         return f"<OutboxJournal(outgoing_no={self.outgoing_no}, date={self.outgoing_date})>"
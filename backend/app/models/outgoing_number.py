@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, String, DateTime, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from app.models.database import Base
+
+
+class OutgoingNumberCounter(Base):
+    """Счётчик исходящих номеров (одна строка на область нумерации)"""
+    __tablename__ = "outgoing_number_counters"
+
+    scope = Column(String, primary_key=True)  # Год ("2026") или "all" для сквозной нумерации
+    last_number = Column(Integer, nullable=False)  # Последний выданный номер
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<OutgoingNumberCounter(scope='{self.scope}', last_number={self.last_number})>"
+
+
+class NumberReservation(Base):
+    """Резерв исходящего номера на время подписания документа"""
+    __tablename__ = "outgoing_number_reservations"
+    __table_args__ = (
+        UniqueConstraint("year", "outgoing_no", name="uq_number_reservation_year_no"),
+        Index("ix_number_reservation_year_status_no", "year", "status", "outgoing_no"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    year = Column(Integer, nullable=False)  # Год выдачи номера
+    outgoing_no = Column(Integer, nullable=False)  # Числовая часть номера
+    formatted_number = Column(String, nullable=False)  # Форматированный номер (например, "178-01")
+    file_id = Column(String, nullable=True, index=True)  # ID подготовленных файлов в temp_files
+    card_id = Column(Integer, nullable=True)  # ID карточки Kaiten
+    status = Column(String, nullable=False, default="reserved")  # "reserved", "committed" или "released"
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<NumberReservation(outgoing_no={self.outgoing_no}, year={self.year}, status='{self.status}')>"
@@ -0,0 +1,59 @@
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, JSON
+from sqlalchemy.sql import func
+from app.models.database import Base
+
+
+class RegistrationSession(Base):
+    """
+    Сессия регистрации документа: от подготовки PDF до записи в журнал.
+    Хранит всё, что нужно шагу подписи, - файлы, хэши, номер и снимок карточки Kaiten
+    """
+    __tablename__ = "registration_sessions"
+
+    file_id = Column(String, primary_key=True)  # ID подготовленных файлов в temp_files
+    batch_id = Column(String, nullable=True, index=True)  # ID пакета подписания (если документ из пакета)
+    # "prepared" -> "signed" (подпись принята) -> "finalized" (запись в журнале);
+    # "failed" - финализация не удалась, "released"/"expired" - подготовка отменена или истекла
+    status = Column(String, nullable=False, default="prepared", index=True)
+    username = Column(String, nullable=True)  # Кто готовил документ
+
+    # Номер (зарезервирован в outgoing_number_reservations под тем же file_id)
+    outgoing_no = Column(Integer, nullable=False)
+    formatted_number = Column(String, nullable=False)
+    outgoing_date = Column(Date, nullable=False)
+    executor = Column(String, nullable=True)
+    executor_id = Column(Integer, nullable=True)
+
+    # Снимок карточки Kaiten на момент подготовки
+    card_id = Column(Integer, nullable=False, index=True)
+    to_whom = Column(String, nullable=True)  # Название карточки
+    content = Column(Text, nullable=True)  # Краткое содержание
+    attachments = Column(JSON, nullable=True)  # [{'name', 'url'}] - файлы карточки, кроме DOCX
+
+    # Файлы в temp_files (имена) и хэши ГОСТ подготовленного PDF
+    selected_file_name = Column(String, nullable=False)
+    docx_file = Column(String, nullable=True)
+    pdf_file = Column(String, nullable=False)
+    pdf_size = Column(Integer, nullable=True)
+    document_digests = Column(JSON, nullable=True)
+
+    # Результат подписания
+    sig_path = Column(String, nullable=True)  # Принятая подпись (в папке исходящих или temp_files)
+    sig_status = Column(String, nullable=True)  # Результат проверки подписи
+    signer_cn = Column(String, nullable=True)
+    signer_thumbprint = Column(String, nullable=True)
+    signed_at = Column(DateTime(timezone=True), nullable=True)
+    journal_entry_id = Column(Integer, nullable=True)
+
+    # Фоновая финализация (приложения -> папка исходящих -> журнал)
+    finalize_stage = Column(String, nullable=True)  # Последний начатый этап
+    finalize_attempts = Column(Integer, nullable=False, default=0)
+    finalize_error = Column(Text, nullable=True)
+    finalize_next_at = Column(DateTime(timezone=True), nullable=True)  # Не раньше этого момента (повтор после ошибки)
+    attachment_blobs = Column(JSON, nullable=True)  # Скачанные приложения в хранилище: [{'name', 'sha256', 'size'}]
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<RegistrationSession(file_id='{self.file_id}', number='{self.formatted_number}', status='{self.status}')>"
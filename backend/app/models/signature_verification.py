@@ -0,0 +1,19 @@
+from sqlalchemy import Column, String, DateTime
+from sqlalchemy.sql import func
+from app.models.database import Base
+
+
+class SignatureVerification(Base):
+    """Кэш результатов проверки отсоединённых подписей по хэшам PDF и подписи"""
+    __tablename__ = "signature_verifications"
+
+    pdf_sha256 = Column(String(64), primary_key=True)
+    sig_sha256 = Column(String(64), primary_key=True)
+    status = Column(String, nullable=False)  # "valid", "invalid", "unverified" или "error"
+    method = Column(String, nullable=False)  # "cryptcp" или "structure" (только разбор CMS)
+    signer = Column(String, nullable=True)  # Владелец сертификата подписанта
+    error = Column(String, nullable=True)
+    checked_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<SignatureVerification(pdf={self.pdf_sha256[:12]}, status='{self.status}')>"
@@ -35,6 +35,11 @@ class JournalEntryResponse(BaseModel):
     executor: str | None = None
     content: str | None = None  # Краткое содержание
     folder_path: str | None = None
+    sig_status: str | None = None  # Результат проверки подписи (valid, invalid, unverified, error)
+    has_file: bool = False  # Есть PDF (скачивается через /entries/{id}/files/pdf)
+    has_sig: bool = False  # Есть подпись
+    has_attachments: bool = False  # Есть архив приложений
+    highlight: dict[str, str] | None = None  # Адресат и содержание с совпадениями поиска в [[ ]]
     created_at: str
 
     class Config:
@@ -79,7 +84,8 @@ class JournalEntryUpdate(BaseModel):
 class JournalListResponse(BaseModel):
     """Схема для списка записей журнала"""
     entries: list[JournalEntryResponse]
-    total: int
+    total: int | None = None  # Общее число записей по фильтрам (None, если не запрошено)
+    next_cursor: str | None = None  # Курсор следующей страницы (None - это последняя страница)
 
     class Config:
         json_schema_extra = {
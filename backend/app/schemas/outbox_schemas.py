@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
 from datetime import date
 
 
@@ -19,4 +19,29 @@ class RegisterResponse(BaseModel):
     docx_preview_url: Optional[str] = None
     sign_url: Optional[str] = None  # URL для подписания документа
     file_id: Optional[str] = None  # ID файла для подписания
+    card_id: Optional[int] = None  # ID карточки Kaiten
+    to_whom: Optional[str] = None  # Кому (из названия карточки)
+    pdf_file: Optional[str] = None  # Имя подготовленного PDF во временном хранилище
+    document_digests: Optional[Dict[str, str]] = None  # Хэши ГОСТ Р 34.11-2012 PDF для подписи по хэшу
     message: str
+
+
+class BatchPrepareRequest(BaseModel):
+    """Запрос на пакетную подготовку документов к подписанию"""
+    items: List[RegisterRequest]
+
+
+class BatchPrepareItem(BaseModel):
+    """Результат подготовки одного документа пакета"""
+    card_id: int
+    selected_file_name: str
+    status: str  # ready | error
+    registration: Optional[RegisterResponse] = None
+    error: Optional[str] = None
+
+
+class BatchPrepareResponse(BaseModel):
+    """Манифест пакета: подготовленные PDF и их хэши для подписи одним сертификатом"""
+    batch_id: str
+    created_at: str
+    items: List[BatchPrepareItem]
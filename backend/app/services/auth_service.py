@@ -1,9 +1,11 @@
+import asyncio
 from datetime import datetime, timedelta
 from typing import Optional, Dict
 from jose import JWTError, jwt
 import bcrypt
+from sqlalchemy import select
 from app.core.config import settings
-from app.models.database import SessionLocal
+from app.models.database import AsyncSessionLocal
 from app.models.user import User
 
 
@@ -18,9 +20,9 @@ class AuthService:
         """Получить хеш пароля"""
         return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
-    def authenticate_user(self, username: str, password: str) -> Optional[Dict]:
+    async def authenticate_user(self, username: str, password: str) -> Optional[Dict]:
         """
-        Аутентифицировать пользователя
+        Аутентифицировать пользователя (bcrypt считается в отдельном потоке)
 
         Args:
             username: Имя пользователя
@@ -29,14 +31,14 @@ class AuthService:
         Returns:
             Данные пользователя или None
         """
-        db = SessionLocal()
         try:
-            user = db.query(User).filter(User.username == username).first()
+            async with AsyncSessionLocal() as db:
+                user = await db.scalar(select(User).where(User.username == username))
             if not user:
                 print(f"[Auth] User '{username}' not found in database")
                 return None
 
-            if not self.verify_password(password, user.hashed_password):
+            if not await asyncio.to_thread(self.verify_password, password, user.hashed_password):
                 print(f"[Auth] Invalid password for user '{username}'")
                 return None
 
@@ -50,8 +52,6 @@ class AuthService:
         except Exception as e:
             print(f"[Auth] Error during authentication: {e}")
             return None
-        finally:
-            db.close()
 
     def create_access_token(self, data: dict, expires_delta: Optional[timedelta] = None) -> str:
         """
@@ -92,22 +92,19 @@ class AuthService:
         except JWTError:
             return None
 
-    def get_user_by_username(self, username: str) -> Optional[Dict]:
+    async def get_user_by_username(self, username: str) -> Optional[Dict]:
         """Получить пользователя по username"""
-        db = SessionLocal()
-        try:
-            user = db.query(User).filter(User.username == username).first()
-            if not user:
-                return None
+        async with AsyncSessionLocal() as db:
+            user = await db.scalar(select(User).where(User.username == username))
+        if not user:
+            return None
 
-            return {
-                'id': user.id,
-                'username': user.username,
-                'role': user.role,
-                'full_name': user.username
-            }
-        finally:
-            db.close()
+        return {
+            'id': user.id,
+            'username': user.username,
+            'role': user.role,
+            'full_name': user.username
+        }
 
 
 # Singleton instance
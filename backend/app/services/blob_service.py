@@ -0,0 +1,374 @@
+import fcntl
+import hashlib
+import io
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.blob import Blob
+from app.models.database import SessionLocal
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class BlobMissingError(Exception):
+    """Файла нет в хранилище, а содержимого для восстановления нет под рукой"""
+    pass
+
+
+class BlobStoreBackend:
+    """
+    Хранилище содержимого по SHA-256. Реализация по умолчанию - LocalBlobStore;
+    другое хранилище (например, S3) подключается через BLOB_STORE_BACKEND
+    """
+
+    def exists(self, digest: str) -> bool:
+        raise NotImplementedError
+
+    def put(self, digest: str, data: bytes):
+        """Сохранить содержимое (если его ещё нет)"""
+        raise NotImplementedError
+
+    def open(self, digest: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def delete(self, digest: str):
+        raise NotImplementedError
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        """Путь к файлу на диске (для жёстких ссылок) или None, если хранилище не локальное"""
+        return None
+
+
+class LocalBlobStore(BlobStoreBackend):
+    """
+    Файлы на локальном диске: <root>/ab/cd/<sha256>. Файлы только для чтения -
+    жёсткая ссылка в папке исходящих не даст случайно изменить содержимое хранилища
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def exists(self, digest: str) -> bool:
+        return self._path(digest).exists()
+
+    def put(self, digest: str, data: bytes):
+        path = self._path(digest)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Уникальный .part: параллельные записи одного содержимого не мешают друг другу
+        part_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+        try:
+            part_path.write_bytes(data)
+            os.chmod(part_path, 0o444)
+            os.replace(part_path, path)
+        finally:
+            part_path.unlink(missing_ok=True)
+
+    def open(self, digest: str) -> BinaryIO:
+        return open(self._path(digest), "rb")
+
+    def delete(self, digest: str):
+        self._path(digest).unlink(missing_ok=True)
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        return self._path(digest)
+
+
+# Доступные хранилища (BLOB_STORE_BACKEND)
+BLOB_STORE_BACKENDS = {
+    "local": lambda: LocalBlobStore(Path(settings.BLOB_STORE_PATH)),
+}
+
+
+class BlobService:
+    """
+    Хранилище файлов журнала по содержимому.
+
+    Файл сохраняется один раз под своим SHA-256, записи журнала ссылаются на хэш.
+    Таблица blobs ведёт счётчик ссылок: одинаковые приложения разных писем
+    (типовые формы, регламенты) хранятся в одном экземпляре. Файл без ссылок
+    удаляется сборкой мусора через BLOB_GC_GRACE_HOURS - не сразу, чтобы откат
+    транзакции или повторная ссылка не застали файл удалённым.
+
+    Старые файлы переносятся в холодное хранение (archive): сжатый кадр zstd
+    дописывается в архив месяца или года в BLOB_COLD_PATH, смещение запоминается
+    в blobs. Чтение прозрачно - файла нет в хранилище, он распаковывается из архива.
+    """
+
+    def __init__(self):
+        self._backend: Optional[BlobStoreBackend] = None
+        self._metrics = {
+            'stored': 0,
+            'dedup_hits': 0,
+            'hardlinks': 0,
+            'copies': 0,
+            'gc_removed': 0,
+            'gc_removed_bytes': 0,
+            'archived': 0,
+            'archived_bytes': 0,
+            'archived_compressed_bytes': 0,
+            'cold_reads': 0
+        }
+
+    @property
+    def backend(self) -> BlobStoreBackend:
+        if self._backend is None:
+            factory = BLOB_STORE_BACKENDS.get(settings.BLOB_STORE_BACKEND)
+            if factory is None:
+                raise ValueError(f"Неизвестное хранилище файлов BLOB_STORE_BACKEND={settings.BLOB_STORE_BACKEND}")
+            self._backend = factory()
+        return self._backend
+
+    def get_metrics(self) -> Dict:
+        """Метрики хранилища (сохранено, совпадения, ссылки и копии в папке исходящих, сборка мусора)"""
+        return dict(self._metrics)
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def put(self, data: bytes) -> str:
+        """
+        Сохранить содержимое без ссылки на него (идемпотентно). Ссылку добавляет
+        add_ref в транзакции записи, которая на файл ссылается
+
+        Returns:
+            SHA-256 содержимого
+        """
+        digest = self.digest(data)
+        self.backend.put(digest, data)
+        return digest
+
+    def store(self, db: Session, data: bytes) -> str:
+        """
+        Сохранить содержимое и добавить ссылку на него (фиксируется вызывающим кодом)
+
+        Returns:
+            SHA-256 содержимого
+        """
+        digest = self.put(data)
+        self.add_ref(db, digest, len(data), data)
+        return digest
+
+    def add_ref(self, db: Session, digest: str, size: int, data: Optional[bytes] = None):
+        """
+        Добавить ссылку на файл (фиксируется вызывающим кодом). Строка blobs
+        блокируется, поэтому сборка мусора не удалит файл, на который ссылаются.
+        Если файл успели удалить, он восстанавливается из data; файл из холодного
+        хранения, на который снова ссылаются (и он снова лежит в хранилище), становится горячим
+
+        Raises:
+            BlobMissingError: Файла нет, а data не передано
+        """
+        blob = db.query(Blob).filter(Blob.sha256 == digest).with_for_update().first()
+        if blob is None:
+            try:
+                with db.begin_nested():
+                    db.add(Blob(sha256=digest, size=size, refcount=1))
+                self._metrics['stored'] += 1
+            except IntegrityError:
+                # Параллельная транзакция добавила ту же строку
+                blob = db.query(Blob).filter(Blob.sha256 == digest).with_for_update().first()
+        if blob is not None:
+            blob.refcount += 1
+            self._metrics['dedup_hits'] += 1
+
+        hot = self.backend.exists(digest)
+        if not hot and data is not None:
+            self.backend.put(digest, data)
+            hot = True
+        if blob is not None and blob.tier == "cold":
+            if hot:
+                blob.tier = "hot"
+                blob.pack = None
+                blob.pack_offset = None
+                blob.pack_length = None
+        elif not hot:
+            raise BlobMissingError(f"Файл {digest} отсутствует в хранилище")
+        db.flush()
+
+    def release(self, db: Session, digest: Optional[str]):
+        """Убрать ссылку на файл (фиксируется вызывающим кодом); файл удалит сборка мусора"""
+        if not digest:
+            return
+        db.query(Blob).filter(Blob.sha256 == digest, Blob.refcount > 0).update(
+            {Blob.refcount: Blob.refcount - 1}, synchronize_session=False
+        )
+
+    def read(self, digest: str) -> bytes:
+        """Прочитать файл целиком (из хранилища или из архива холодного хранения)"""
+        with self.open(digest) as f:
+            return f.read()
+
+    def open(self, digest: str) -> BinaryIO:
+        """Открыть файл на чтение (из хранилища или из архива холодного хранения)"""
+        try:
+            return self.backend.open(digest)
+        except FileNotFoundError:
+            return self._open_cold(digest)
+
+    def resolve(self, digest: Optional[str], inline: Optional[bytes]) -> Optional[bytes]:
+        """Содержимое файла записи журнала: из хранилища по хэшу или из BLOB столбца (записи до хранилища)"""
+        if digest:
+            return self.read(digest)
+        return inline
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        return self.backend.local_path(digest)
+
+    def link_or_copy(self, digest: str, target: Path, data: Optional[bytes] = None):
+        """
+        Поместить файл хранилища в папку исходящих: жёсткой ссылкой (BLOB_STORE_HARDLINKS),
+        а если хранилище на другой файловой системе или ссылки не поддерживаются - копией.
+        Повторный вызов безопасен
+
+        Args:
+            digest: SHA-256 содержимого
+            target: Путь в папке исходящих
+            data: Содержимое (чтобы не читать его из хранилища для копии)
+        """
+        source = self.backend.local_path(digest)
+        if settings.BLOB_STORE_HARDLINKS and source is not None:
+            try:
+                if target.exists() and os.path.samefile(source, target):
+                    return
+                part_path = target.with_name(f"{target.name}.{uuid.uuid4().hex}.part")
+                os.link(source, part_path)
+                os.replace(part_path, target)
+                self._metrics['hardlinks'] += 1
+                return
+            except OSError:
+                # EXDEV (другая файловая система), EPERM (ссылки запрещены) и т. п.
+                pass
+
+        if data is not None:
+            target.write_bytes(data)
+        elif source is not None and source.exists():
+            shutil.copyfile(source, target)
+        else:
+            target.write_bytes(self.read(digest))
+        self._metrics['copies'] += 1
+
+    def collect_garbage(self, db: Session) -> int:
+        """
+        Удалить файлы без ссылок, освобождённые раньше BLOB_GC_GRACE_HOURS
+        (каждый файл - своей транзакцией)
+
+        Returns:
+            Число удалённых файлов
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.BLOB_GC_GRACE_HOURS)
+        candidates = [
+            row.sha256 for row in db.query(Blob.sha256).filter(
+                Blob.refcount == 0,
+                Blob.updated_at < cutoff
+            ).all()
+        ]
+        removed = 0
+        for digest in candidates:
+            blob = db.query(Blob).filter(Blob.sha256 == digest).with_for_update().first()
+            if blob is None or blob.refcount > 0:
+                db.rollback()
+                continue
+            # Удаляем файл под блокировкой строки: add_ref ждёт её и восстановит файл при необходимости
+            self.backend.delete(digest)
+            self._metrics['gc_removed_bytes'] += blob.size
+            db.delete(blob)
+            db.commit()
+            removed += 1
+        self._metrics['gc_removed'] += removed
+        return removed
+
+    def archive(self, db: Session, digest: str, pack: str) -> bool:
+        """
+        Перенести файл в холодное хранение: сжать и дописать в архив pack,
+        затем удалить из хранилища (фиксирует транзакцию)
+
+        Args:
+            db: Сессия БД
+            digest: SHA-256 файла
+            pack: Имя архива ("2024-03" или "2024")
+
+        Returns:
+            True - файл перенесён, False - он уже в архиве или удалён
+        """
+        if zstandard is None:
+            raise RuntimeError("zstandard не установлен - холодное хранение недоступно")
+
+        blob = db.query(Blob).filter(Blob.sha256 == digest).with_for_update().first()
+        if blob is None or blob.tier == "cold" or blob.refcount == 0:
+            db.rollback()
+            return False
+
+        with self.backend.open(digest) as f:
+            data = f.read()
+        frame = zstandard.ZstdCompressor(level=settings.BLOB_COLD_ZSTD_LEVEL).compress(data)
+
+        pack_path = self._pack_path(pack)
+        pack_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(pack_path, "ab") as f:
+            # Архив дописывается под блокировкой файла: смещение не разойдётся с другим процессом
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(frame)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        blob.tier = "cold"
+        blob.pack = pack
+        blob.pack_offset = offset
+        blob.pack_length = len(frame)
+        db.commit()
+        # Кадр в архиве и запись о нём зафиксированы - горячая копия больше не нужна
+        self.backend.delete(digest)
+
+        self._metrics['archived'] += 1
+        self._metrics['archived_bytes'] += len(data)
+        self._metrics['archived_compressed_bytes'] += len(frame)
+        return True
+
+    def _pack_path(self, pack: str) -> Path:
+        return Path(settings.BLOB_COLD_PATH) / f"{pack}.zst"
+
+    def _open_cold(self, digest: str) -> BinaryIO:
+        """Распаковать файл из архива холодного хранения"""
+        db = SessionLocal()
+        try:
+            row = db.query(Blob.pack, Blob.pack_offset, Blob.pack_length).filter(
+                Blob.sha256 == digest,
+                Blob.tier == "cold"
+            ).first()
+        finally:
+            db.close()
+        if row is None:
+            raise FileNotFoundError(f"Файл {digest} отсутствует в хранилище")
+        if zstandard is None:
+            raise RuntimeError("zstandard не установлен - файл из холодного хранения не прочитать")
+
+        with open(self._pack_path(row.pack), "rb") as f:
+            f.seek(row.pack_offset)
+            frame = f.read(row.pack_length)
+        data = zstandard.ZstdDecompressor().decompress(frame)
+        if self.digest(data) != digest:
+            raise RuntimeError(f"Файл {digest} в архиве {row.pack} повреждён")
+        self._metrics['cold_reads'] += 1
+        return io.BytesIO(data)
+
+
+blob_service = BlobService()
@@ -0,0 +1,235 @@
+import asyncio
+import io
+import time
+import zipfile
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List
+from sqlalchemy import or_
+from sqlalchemy.orm import Session, undefer
+from app.core.config import settings
+from app.models.blob import Blob
+from app.models.database import SessionLocal
+from app.models.outbox_journal import OutboxJournal
+from app.services.blob_service import blob_service
+
+
+# Сколько хэшей проверяется в blobs одним запросом
+DIGEST_QUERY_CHUNK = 500
+
+
+class BlobTieringService:
+    """
+    Холодное хранение файлов журнала.
+
+    Периодически (BLOB_TIERING_INTERVAL_HOURS) файлы записей старше
+    BLOB_COLD_AFTER_DAYS сжимаются в архивы за месяц или год даты записи
+    (BLOB_COLD_PACK_PERIOD). Записи текущего года остаются горячими, как и файлы,
+    на которые ссылается хоть одна свежая запись (общие приложения). Файлы старых
+    записей, ещё лежащие в BLOB столбцах БД, сначала переносятся в хранилище -
+    таблица журнала и её резервная копия перестают расти вместе с архивом.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._metrics = {
+            'runs': 0,
+            'last_run_at': None,
+            'last_run_seconds': 0.0,
+            'last_cutoff': None,
+            'inline_moved': 0,
+            'archived': 0,
+            'errors': 0
+        }
+
+    def get_metrics(self) -> Dict:
+        """Метрики переноса в холодное хранение"""
+        return dict(self._metrics)
+
+    async def run_forever(self):
+        """Фоновая задача: перенос с интервалом BLOB_TIERING_INTERVAL_HOURS"""
+        print(f"[BlobTiering] Started (every {settings.BLOB_TIERING_INTERVAL_HOURS}h, after {settings.BLOB_COLD_AFTER_DAYS} days)")
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._metrics['errors'] += 1
+                print(f"[BlobTiering] Error: {e}")
+            await asyncio.sleep(settings.BLOB_TIERING_INTERVAL_HOURS * 3600)
+
+    async def run_once(self) -> Dict:
+        """
+        Выполнить один проход (в отдельном потоке - сжатие и работа с БД блокирующие)
+
+        Returns:
+            Метрики после прохода
+        """
+        async with self._lock:
+            await asyncio.to_thread(self._tier)
+        return self.get_metrics()
+
+    @staticmethod
+    def cutoff(today: date) -> date:
+        """Записи раньше этой даты переносятся в холодное хранение (текущий год - никогда)"""
+        return min(today - timedelta(days=settings.BLOB_COLD_AFTER_DAYS), date(today.year, 1, 1))
+
+    @staticmethod
+    def pack_name(outgoing_date: date) -> str:
+        """Имя архива для записи: месяц или год даты записи"""
+        if settings.BLOB_COLD_PACK_PERIOD == "year":
+            return outgoing_date.strftime("%Y")
+        return outgoing_date.strftime("%Y-%m")
+
+    def _tier(self):
+        started = time.monotonic()
+        cutoff = self.cutoff(date.today())
+        db = SessionLocal()
+        try:
+            # 1. Файлы старых записей из BLOB столбцов - в хранилище
+            inline_ids = [
+                row.id for row in db.query(OutboxJournal.id).filter(
+                    OutboxJournal.outgoing_date < cutoff,
+                    or_(
+                        OutboxJournal.file_blob.isnot(None),
+                        OutboxJournal.sig_blob.isnot(None),
+                        OutboxJournal.attachments_blob.isnot(None)
+                    )
+                ).order_by(OutboxJournal.id).limit(settings.BLOB_TIERING_BATCH).all()
+            ]
+            for entry_id in inline_ids:
+                try:
+                    if self._move_entry(db, entry_id):
+                        self._metrics['inline_moved'] += 1
+                except Exception as e:
+                    db.rollback()
+                    print(f"[BlobTiering] Entry {entry_id}: could not move files out of the database: {e}")
+            db.rollback()
+
+            # 2. Хэши свежих записей - их файлы остаются горячими
+            hot = set()
+            for row in db.query(
+                OutboxJournal.file_sha256, OutboxJournal.sig_sha256, OutboxJournal.attachments
+            ).filter(OutboxJournal.outgoing_date >= cutoff):
+                hot.update(_entry_digests(row))
+
+            # 3. Файлы старых записей - в архив месяца (года) самой ранней ссылающейся записи
+            candidates: Dict[str, str] = {}
+            for row in db.query(
+                OutboxJournal.outgoing_date, OutboxJournal.file_sha256, OutboxJournal.sig_sha256, OutboxJournal.attachments
+            ).filter(
+                OutboxJournal.outgoing_date < cutoff,
+                or_(
+                    OutboxJournal.file_sha256.isnot(None),
+                    OutboxJournal.sig_sha256.isnot(None),
+                    OutboxJournal.attachments.isnot(None)
+                )
+            ).order_by(OutboxJournal.outgoing_date, OutboxJournal.id):
+                for digest in _entry_digests(row):
+                    if digest not in hot:
+                        candidates.setdefault(digest, self.pack_name(row.outgoing_date))
+
+            pending = self._hot_digests(db, list(candidates))[:settings.BLOB_TIERING_BATCH]
+            db.rollback()
+            for digest in pending:
+                try:
+                    if blob_service.archive(db, digest, candidates[digest]):
+                        self._metrics['archived'] += 1
+                except Exception as e:
+                    db.rollback()
+                    self._metrics['errors'] += 1
+                    print(f"[BlobTiering] Blob {digest[:12]}: could not archive: {e}")
+
+            if inline_ids or pending:
+                print(f"[BlobTiering] Before {cutoff}: {len(inline_ids)} entries moved out of the database, {len(pending)} blobs archived")
+        finally:
+            db.close()
+            self._metrics['runs'] += 1
+            self._metrics['last_run_at'] = datetime.now(timezone.utc).isoformat()
+            self._metrics['last_run_seconds'] = round(time.monotonic() - started, 3)
+            self._metrics['last_cutoff'] = cutoff.isoformat()
+
+    def _move_entry(self, db: Session, entry_id: int) -> bool:
+        """Перенести файлы записи из BLOB столбцов в хранилище (фиксирует транзакцию)"""
+        entry = db.query(OutboxJournal).options(
+            undefer(OutboxJournal.file_blob),
+            undefer(OutboxJournal.sig_blob),
+            undefer(OutboxJournal.attachments_blob)
+        ).filter(OutboxJournal.id == entry_id).with_for_update().first()
+        if entry is None:
+            db.rollback()
+            return False
+        move_inline_blobs(db, entry)
+        db.commit()
+        return True
+
+    @staticmethod
+    def _hot_digests(db: Session, digests: List[str]) -> List[str]:
+        """Из хэшей - те, чьи файлы ещё горячие"""
+        result = []
+        for start in range(0, len(digests), DIGEST_QUERY_CHUNK):
+            chunk = digests[start:start + DIGEST_QUERY_CHUNK]
+            result.extend(
+                row.sha256 for row in db.query(Blob.sha256).filter(
+                    Blob.sha256.in_(chunk),
+                    Blob.tier == "hot",
+                    Blob.refcount > 0
+                )
+            )
+        return result
+
+
+def move_inline_blobs(db: Session, entry: OutboxJournal) -> int:
+    """
+    Перенести файлы записи журнала из BLOB столбцов в хранилище по содержимому
+    (фиксируется вызывающим кодом). Архив приложений раскладывается по файлам
+
+    Args:
+        db: Сессия БД
+        entry: Запись журнала (с загруженными BLOB столбцами)
+
+    Returns:
+        Число освобождённых в БД байт
+    """
+    freed = 0
+    if entry.file_blob is not None and not entry.file_sha256:
+        entry.file_sha256 = blob_service.store(db, entry.file_blob)
+        freed += len(entry.file_blob)
+        entry.file_blob = None
+
+    if entry.sig_blob is not None and not entry.sig_sha256:
+        entry.sig_sha256 = blob_service.store(db, entry.sig_blob)
+        freed += len(entry.sig_blob)
+        entry.sig_blob = None
+
+    if entry.attachments_blob is not None and entry.attachments is None:
+        manifest = []
+        with zipfile.ZipFile(io.BytesIO(entry.attachments_blob)) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                data = zf.read(info)
+                manifest.append({
+                    'name': Path(info.filename).name,
+                    'sha256': blob_service.store(db, data),
+                    'size': len(data)
+                })
+        entry.attachments = manifest or None
+        freed += len(entry.attachments_blob)
+        entry.attachments_blob = None
+
+    return freed
+
+
+def _entry_digests(row) -> Iterable[str]:
+    """Хэши всех файлов записи журнала (PDF, подпись, приложения)"""
+    if row.file_sha256:
+        yield row.file_sha256
+    if row.sig_sha256:
+        yield row.sig_sha256
+    for item in row.attachments or []:
+        yield item['sha256']
+
+
+blob_tiering_service = BlobTieringService()
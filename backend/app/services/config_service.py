@@ -11,8 +11,10 @@ class ConfigService:
         self.config_dir = Path(__file__).parent.parent.parent / "config"
         self.executors_file = self.config_dir / "executors.json"
         self.numbering_rules_file = self.config_dir / "numbering_rules.json"
+        self.certificates_file = self.config_dir / "certificates.json"
         self._executors_cache = None
         self._numbering_rules_cache = None
+        self._certificates_cache = None
 
     def _load_json(self, file_path: Path) -> Dict:
         """Загрузить JSON файл"""
@@ -90,10 +92,29 @@ class ConfigService:
             'reset_yearly': False
         })
 
+    def get_certificate_for_user(self, username: str) -> Dict:
+        """
+        Получить данные сертификата пользователя для визуализации ЭЦП
+
+        Args:
+            username: Имя пользователя
+
+        Returns:
+            Данные сертификата {'serial', 'owner', 'valid_from', 'valid_to'}
+            или данные сертификата по умолчанию
+        """
+        if self._certificates_cache is None:
+            config = self._load_json(self.certificates_file)
+            self._certificates_cache = config.get('certificates', {})
+
+        certificates = self._certificates_cache
+        return certificates.get(username) or certificates.get('default', {})
+
     def reload_configs(self):
         """Перезагрузить конфигурации из файлов (для быстрых изменений)"""
         self._executors_cache = None
         self._numbering_rules_cache = None
+        self._certificates_cache = None
         print("Configuration files reloaded")
 
 
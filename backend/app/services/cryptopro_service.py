@@ -1,17 +1,34 @@
+import asyncio
 import subprocess
 import tempfile
+import time
 import os
-import base64
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 from datetime import datetime
+from app.core.config import settings
+
+
+# Алгоритмы хэширования ГОСТ Р 34.11-2012 (OID) для подписи по хэшу
+GOST_HASH_ALGORITHMS = {
+    'gost3411_2012_256': '1.2.643.7.1.1.2.2',
+    'gost3411_2012_512': '1.2.643.7.1.1.2.3',
+}
 
 
 class CryptoProService:
-    """Сервис для работы с электронной подписью через КриптоПро"""
+    """
+    Сервис для работы с электронной подписью через КриптоПро.
+
+    cryptcp запускается асинхронно (asyncio subprocess) и не блокирует
+    обработку запросов. Число одновременно работающих процессов cryptcp
+    ограничено, каждый запуск ограничен по времени. Несколько документов
+    подписываются/проверяются одним запуском cryptcp (пакетный режим),
+    файлы передаются через tmpfs (/dev/shm), если он доступен.
+    """
 
     def __init__(self):
-        self.cryptcp_path = self._find_cryptcp()
+        self.cryptcp_path = settings.CRYPTCP_PATH or self._find_cryptcp()
         self.use_mock = not self.cryptcp_path  # Если КриптоПро не установлен, используем mock
 
         # Директория для логов подписей
@@ -19,6 +36,17 @@ class CryptoProService:
         # Создаём директорию с правами на запись
         self.log_dir.mkdir(exist_ok=True, parents=True, mode=0o755)
 
+        self._semaphore = asyncio.Semaphore(settings.CRYPTCP_MAX_PROCESSES)
+        self._metrics = {
+            'processes': 0,        # Запущено процессов cryptcp
+            'documents': 0,        # Обработано документов
+            'failures': 0,         # Запусков с ошибкой
+            'timeouts': 0,         # Запусков, прерванных по таймауту
+            'running': 0,          # Процессов работает сейчас
+            'waiting': 0,          # Запусков ждут свободного слота
+            'total_seconds': 0.0,  # Суммарное время работы cryptcp
+        }
+
     def _find_cryptcp(self) -> Optional[str]:
         """Найти путь к утилите cryptcp из КриптоПро CSP"""
         possible_paths = [
@@ -41,7 +69,88 @@ class CryptoProService:
 
         return None
 
-    def sign_pdf(
+    def _temp_dir(self) -> tempfile.TemporaryDirectory:
+        """Временная директория для файлов cryptcp (в tmpfs, если доступен)"""
+        tmp_root = settings.CRYPTCP_TMP_DIR
+        if tmp_root and os.path.isdir(tmp_root) and os.access(tmp_root, os.W_OK):
+            return tempfile.TemporaryDirectory(prefix="cryptcp_", dir=tmp_root)
+        return tempfile.TemporaryDirectory(prefix="cryptcp_")
+
+    def _batches(self, items: List) -> List[List[Tuple[int, object]]]:
+        """Разбить элементы на пакеты с сохранением исходных индексов"""
+        size = max(1, settings.CRYPTCP_BATCH_SIZE)
+        indexed = list(enumerate(items))
+        return [indexed[start:start + size] for start in range(0, len(indexed), size)]
+
+    async def _run_cryptcp(self, args: List[str], documents: int) -> Tuple[int, str]:
+        """
+        Запустить cryptcp в пуле с ограничением параллельности и времени
+
+        Args:
+            args: Аргументы командной строки (без пути к cryptcp)
+            documents: Число документов в запуске (для метрик)
+
+        Returns:
+            Кортеж (код возврата, stdout + stderr)
+
+        Raises:
+            RuntimeError: Если cryptcp не завершился за CRYPTCP_TIMEOUT_SECONDS
+        """
+        self._metrics['waiting'] += 1
+        async with self._semaphore:
+            self._metrics['waiting'] -= 1
+            self._metrics['running'] += 1
+            started = time.monotonic()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    self.cryptcp_path,
+                    *args,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT
+                )
+                self._metrics['processes'] += 1
+                # Таймаут растёт с размером пакета
+                timeout = settings.CRYPTCP_TIMEOUT_SECONDS * max(1, documents)
+                try:
+                    output, _ = await asyncio.wait_for(process.communicate(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                    self._metrics['timeouts'] += 1
+                    raise RuntimeError(f"cryptcp timeout after {timeout} s")
+                except BaseException:
+                    # Ожидание отменено (остановка приложения, отменённый пакет) -
+                    # cryptcp не должен остаться работать без владельца
+                    if process.returncode is None:
+                        process.kill()
+                        await process.wait()
+                    raise
+
+                if process.returncode != 0:
+                    self._metrics['failures'] += 1
+                self._metrics['documents'] += documents
+                return process.returncode, output.decode('utf-8', errors='replace')
+            finally:
+                self._metrics['running'] -= 1
+                self._metrics['total_seconds'] += time.monotonic() - started
+
+    def get_metrics(self) -> Dict:
+        """
+        Получить метрики пула cryptcp
+
+        Returns:
+            Счётчики запусков, документов, ошибок, таймаутов и загрузки пула
+        """
+        metrics = dict(self._metrics)
+        metrics['max_processes'] = settings.CRYPTCP_MAX_PROCESSES
+        metrics['avg_seconds'] = (
+            round(metrics['total_seconds'] / metrics['processes'], 3) if metrics['processes'] else 0.0
+        )
+        metrics['total_seconds'] = round(metrics['total_seconds'], 3)
+        metrics['mock'] = self.use_mock
+        return metrics
+
+    async def sign_pdf(
         self,
         pdf_bytes: bytes,
         certificate_thumbprint: Optional[str] = None
@@ -59,68 +168,82 @@ class CryptoProService:
         if self.use_mock:
             return self._mock_sign_pdf(pdf_bytes)
 
-        # Реальная подпись через КриптоПро
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_dir_path = Path(temp_dir)
-
-            # Сохраняем PDF во временный файл
-            pdf_file = temp_dir_path / "document.pdf"
-            pdf_file.write_bytes(pdf_bytes)
-
-            # Файл для отсоединенной подписи (detached signature)
-            signature_file = temp_dir_path / "document.sig"
-
-            try:
-                # Команда для создания отсоединенной подписи в формате PKCS#7
-                cmd = [
-                    self.cryptcp_path,
-                    '-sign',
-                    '-detached',  # Отсоединенная подпись
-                    '-der',       # Формат DER (бинарный PKCS#7)
-                    str(pdf_file),
-                    str(signature_file)
-                ]
-
-                if certificate_thumbprint:
-                    cmd.extend(['-thumbprint', certificate_thumbprint])
-
-                result = subprocess.run(
-                    cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=30
-                )
+        result = (await self.sign_batch([pdf_bytes], certificate_thumbprint))[0]
+        if result['error']:
+            raise RuntimeError(f"Signing error: {result['error']}")
 
-                if result.returncode != 0:
-                    raise RuntimeError(f"CryptoPro signing failed: {result.stderr}")
+        print(f"[CryptoProService] Successfully signed PDF")
+        print(f"  PDF size: {len(pdf_bytes)} bytes")
+        print(f"  Signature size: {len(result['signature'])} bytes")
 
-                # Проверяем, что файл подписи создан
-                if not signature_file.exists():
-                    raise RuntimeError("Signature file was not created")
+        return result['signature'], result['certificate']
 
-                # Читаем байты подписи
-                signature_bytes = signature_file.read_bytes()
-
-                # Получаем информацию о сертификате
-                cert_info = self._get_certificate_info(certificate_thumbprint)
-
-                # Логируем информацию о подписи
-                self._log_signature_info(
-                    pdf_size=len(pdf_bytes),
-                    sig_size=len(signature_bytes),
-                    cert_info=cert_info
-                )
-
-                print(f"[CryptoProService] Successfully signed PDF")
-                print(f"  PDF size: {len(pdf_bytes)} bytes")
-                print(f"  Signature size: {len(signature_bytes)} bytes")
+    async def sign_batch(
+        self,
+        pdf_documents: List[bytes],
+        certificate_thumbprint: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Подписать несколько PDF (пакетами по CRYPTCP_BATCH_SIZE документов на запуск cryptcp)
 
-                return signature_bytes, cert_info
+        Args:
+            pdf_documents: Содержимое PDF файлов
+            certificate_thumbprint: Отпечаток сертификата (опционально)
 
-            except subprocess.TimeoutExpired:
-                raise RuntimeError("Signing timeout")
-            except Exception as e:
-                raise RuntimeError(f"Signing error: {str(e)}")
+        Returns:
+            Результаты в порядке документов: [{'signature': bytes | None, 'certificate': dict, 'error': str | None}]
+        """
+        if self.use_mock:
+            results = []
+            for pdf_bytes in pdf_documents:
+                signature, cert_info = self._mock_sign_pdf(pdf_bytes)
+                results.append({'signature': signature, 'certificate': cert_info, 'error': None})
+            return results
+
+        cert_info = self._get_certificate_info(certificate_thumbprint)
+        results: List[Optional[Dict]] = [None] * len(pdf_documents)
+
+        async def sign_chunk(chunk: List[Tuple[int, bytes]]):
+            with self._temp_dir() as temp_dir:
+                temp_dir_path = Path(temp_dir)
+                out_dir = temp_dir_path / "signed"
+                out_dir.mkdir()
+
+                files = []
+                for index, pdf_bytes in chunk:
+                    pdf_file = temp_dir_path / f"document_{index:05d}.pdf"
+                    pdf_file.write_bytes(pdf_bytes)
+                    files.append(pdf_file)
+
+                # Отсоединённые подписи DER (PKCS#7) создаются в out_dir как <имя файла>.sig
+                args = ['-sign', '-detached', '-der', '-dir', str(out_dir)]
+                if certificate_thumbprint:
+                    args.extend(['-thumbprint', certificate_thumbprint])
+                args.extend(str(pdf_file) for pdf_file in files)
+
+                try:
+                    returncode, output = await self._run_cryptcp(args, len(files))
+                except RuntimeError as e:
+                    for index, _ in chunk:
+                        results[index] = {'signature': None, 'certificate': cert_info, 'error': str(e)}
+                    return
+
+                for (index, pdf_bytes), pdf_file in zip(chunk, files):
+                    signature_file = out_dir / f"{pdf_file.name}.sig"
+                    if signature_file.exists():
+                        signature_bytes = signature_file.read_bytes()
+                        results[index] = {'signature': signature_bytes, 'certificate': cert_info, 'error': None}
+                        self._log_signature_info(
+                            pdf_size=len(pdf_bytes),
+                            sig_size=len(signature_bytes),
+                            cert_info=cert_info
+                        )
+                    else:
+                        error = f"CryptoPro signing failed (code {returncode}): {output.strip()}"
+                        results[index] = {'signature': None, 'certificate': cert_info, 'error': error}
+
+        await asyncio.gather(*(sign_chunk(chunk) for chunk in self._batches(pdf_documents)))
+        return results
 
     def _log_signature_info(self, pdf_size: int, sig_size: int, cert_info: Dict):
         """
@@ -209,7 +332,56 @@ class CryptoProService:
             "issuer": "Test CA"
         }
 
-    def verify_signature(self, pdf_bytes: bytes, signature_bytes: bytes) -> bool:
+    async def hash_document(self, pdf_bytes: bytes) -> Optional[Dict[str, str]]:
+        """
+        Вычислить хэши ГОСТ Р 34.11-2012 (256 и 512 бит) документа для подписи по хэшу
+
+        Args:
+            pdf_bytes: Содержимое PDF файла
+
+        Returns:
+            {'gost3411_2012_256': hex, 'gost3411_2012_512': hex}
+            или None, если КриптоПро не установлен или хэш не вычислен
+        """
+        if self.use_mock:
+            return None
+
+        with self._temp_dir() as temp_dir:
+            temp_dir_path = Path(temp_dir)
+            pdf_file = temp_dir_path / "document.pdf"
+            pdf_file.write_bytes(pdf_bytes)
+
+            async def hash_with(name: str, oid: str) -> Optional[str]:
+                out_dir = temp_dir_path / name
+                out_dir.mkdir()
+                try:
+                    returncode, output = await self._run_cryptcp(
+                        ['-hash', '-hashAlg', oid, '-dir', str(out_dir), str(pdf_file)], 1
+                    )
+                except RuntimeError as e:
+                    print(f"[CryptoProService] Hashing error ({name}): {e}")
+                    return None
+
+                hash_file = out_dir / f"{pdf_file.name}.hsh"
+                if returncode != 0 or not hash_file.exists():
+                    print(f"[CryptoProService] Hashing failed ({name}): {output.strip()}")
+                    return None
+
+                # cryptcp записывает хэш в hex; на случай двоичного формата кодируем сами
+                content = hash_file.read_bytes().strip()
+                try:
+                    return bytes.fromhex(content.decode('ascii')).hex()
+                except ValueError:
+                    return content.hex()
+
+            values = await asyncio.gather(*(
+                hash_with(name, oid) for name, oid in GOST_HASH_ALGORITHMS.items()
+            ))
+
+        digests = {name: value for name, value in zip(GOST_HASH_ALGORITHMS, values) if value}
+        return digests or None
+
+    async def verify_signature(self, pdf_bytes: bytes, signature_bytes: bytes) -> bool:
         """
         Проверить подпись PDF файла
 
@@ -220,13 +392,61 @@ class CryptoProService:
         Returns:
             True если подпись валидна, False иначе
         """
-        if self.use_mock:
-            return True  # В mock режиме всегда успех
+        result = (await self.verify_batch([(pdf_bytes, signature_bytes)]))[0]
+        return result['valid']
+
+    async def verify_batch(self, documents: List[Tuple[bytes, bytes]]) -> List[Dict]:
+        """
+        Проверить отсоединённые подписи нескольких PDF.
+
+        Пакет проверяется одним запуском cryptcp; если в пакете есть
+        невалидная подпись, документы пакета перепроверяются по одному,
+        чтобы определить, какие именно подписи не прошли проверку.
 
-        # TODO: Реализовать проверку подписи через КриптоПро
-        # Используя cryptcp -verify
+        Args:
+            documents: Пары (содержимое PDF, содержимое подписи .sig)
 
-        return True
+        Returns:
+            Результаты в порядке документов: [{'valid': bool, 'error': str | None}]
+        """
+        if self.use_mock:
+            return [{'valid': True, 'error': None} for _ in documents]  # В mock режиме всегда успех
+
+        results: List[Optional[Dict]] = [None] * len(documents)
+
+        async def verify_chunk(chunk: List[Tuple[int, Tuple[bytes, bytes]]]):
+            with self._temp_dir() as temp_dir:
+                temp_dir_path = Path(temp_dir)
+                sig_dir = temp_dir_path / "signatures"
+                sig_dir.mkdir()
+
+                files = []
+                for index, (pdf_bytes, signature_bytes) in chunk:
+                    pdf_file = temp_dir_path / f"document_{index:05d}.pdf"
+                    pdf_file.write_bytes(pdf_bytes)
+                    (sig_dir / f"{pdf_file.name}.sig").write_bytes(signature_bytes)
+                    files.append(pdf_file)
+
+                # Проверка отсоединённых подписей: подпись <имя файла>.sig ищется в sig_dir
+                args = ['-vsignf', '-dir', str(sig_dir)]
+                args.extend(str(pdf_file) for pdf_file in files)
+
+                try:
+                    returncode, output = await self._run_cryptcp(args, len(files))
+                except RuntimeError as e:
+                    returncode, output = None, str(e)
+
+            if returncode == 0:
+                for index, _ in chunk:
+                    results[index] = {'valid': True, 'error': None}
+            elif len(chunk) > 1 and returncode is not None:
+                await asyncio.gather(*(verify_chunk([item]) for item in chunk))
+            else:
+                for index, _ in chunk:
+                    results[index] = {'valid': False, 'error': output.strip() or f"cryptcp exit code {returncode}"}
+
+        await asyncio.gather(*(verify_chunk(chunk) for chunk in self._batches(documents)))
+        return results
 
 
 # Singleton instance
@@ -1,22 +1,14 @@
-import os
 import io
 import httpx
-from pathlib import Path
 from datetime import date
-from typing import Optional, Dict
-from docx import Document
-from docx.shared import Inches, Pt, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from app.core.config import settings
+from typing import Optional, Dict, Union
+from app.services.docx_template import DocxTemplate
+from app.services.stamp_service import stamp_service
 
 
 class DocxService:
     """Сервис для работы с DOCX документами"""
 
-    def __init__(self):
-        self.static_path = Path(__file__).parent.parent / "static"
-        self.stamp_image_path = self.static_path / "stamp.png"
-
     async def download_docx_from_url(self, url: str) -> bytes:
         """
         Скачать DOCX файл по URL
@@ -32,157 +24,84 @@ class DocxService:
             response.raise_for_status()
             return response.content
 
-    def check_has_placeholders(self, docx_bytes: bytes) -> bool:
+    def parse_template(self, docx_bytes: bytes) -> DocxTemplate:
         """
-        Проверить, есть ли в документе плейсхолдеры для заполнения
+        Разобрать DOCX шаблон один раз для проверки и замены плейсхолдеров
 
         Args:
             docx_bytes: Содержимое DOCX файла
 
+        Returns:
+            Разобранный шаблон
+        """
+        return DocxTemplate(docx_bytes)
+
+    def check_has_placeholders(self, docx: Union[bytes, DocxTemplate]) -> bool:
+        """
+        Проверить, есть ли в документе плейсхолдеры для заполнения
+        (в тексте, таблицах, вложенных таблицах и колонтитулах)
+
+        Args:
+            docx: Содержимое DOCX файла или уже разобранный шаблон
+
         Returns:
             True если найдены плейсхолдеры, False если нет
         """
         try:
-            doc = Document(io.BytesIO(docx_bytes))
-
-            # Проверяем плейсхолдеры в параграфах
-            for paragraph in doc.paragraphs:
-                if '{{outgoing_no}}' in paragraph.text or \
-                   '{{outgoing_date}}' in paragraph.text or \
-                   '{{stamp}}' in paragraph.text:
-                    return True
-
-            # Проверяем плейсхолдеры в таблицах
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        for paragraph in cell.paragraphs:
-                            if '{{outgoing_no}}' in paragraph.text or \
-                               '{{outgoing_date}}' in paragraph.text or \
-                               '{{stamp}}' in paragraph.text:
-                                return True
-
-            return False
+            template = docx if isinstance(docx, DocxTemplate) else self.parse_template(docx)
+            return template.has_placeholders()
         except Exception as e:
             print(f"Error checking placeholders: {e}")
             return False
 
     def replace_placeholders(
         self,
-        docx_bytes: bytes,
+        docx: Union[bytes, DocxTemplate],
         outgoing_no: str,
         outgoing_date: str,
-        certificate_data: Optional[Dict] = None
+        certificate_data: Optional[Dict] = None,
+        stamp: Optional[Dict] = None
     ) -> bytes:
         """
         Заменить плейсхолдеры в DOCX документе
 
         Args:
-            docx_bytes: Содержимое DOCX файла
+            docx: Содержимое DOCX файла или уже разобранный шаблон
             outgoing_no: Исходящий номер (например, "42-10")
             outgoing_date: Дата в формате ДД.ММ.ГГГГ (например, "20.01.2026")
             certificate_data: Данные сертификата для визуализации ЭЦП
+            stamp: Уже подготовленная визуализация ЭЦП (см. stamp_service.get_stamp)
 
         Returns:
             Измененный DOCX файл в виде байтов
         """
-        # Загружаем документ из байтов
-        doc = Document(io.BytesIO(docx_bytes))
-
-        # Заменяем текстовые плейсхолдеры в параграфах
-        for paragraph in doc.paragraphs:
-            if '{{outgoing_no}}' in paragraph.text:
-                paragraph.text = paragraph.text.replace('{{outgoing_no}}', outgoing_no)
-            if '{{outgoing_date}}' in paragraph.text:
-                paragraph.text = paragraph.text.replace('{{outgoing_date}}', outgoing_date)
-
-            # Заменяем {{stamp}} на изображение визуализации ЭЦП
-            if '{{stamp}}' in paragraph.text:
-                # Очищаем текст параграфа
-                paragraph.text = ''
-                # Вставляем визуализацию ЭЦП
-                self._insert_stamp_visualization(paragraph, certificate_data)
-
-        # Заменяем плейсхолдеры в таблицах
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        if '{{outgoing_no}}' in paragraph.text:
-                            paragraph.text = paragraph.text.replace('{{outgoing_no}}', outgoing_no)
-                        if '{{outgoing_date}}' in paragraph.text:
-                            paragraph.text = paragraph.text.replace('{{outgoing_date}}', outgoing_date)
-
-                        # Заменяем {{stamp}} в таблицах
-                        if '{{stamp}}' in paragraph.text:
-                            paragraph.text = ''
-                            self._insert_stamp_visualization(paragraph, certificate_data)
-
-        # Сохраняем измененный документ в байты
+        template = docx if isinstance(docx, DocxTemplate) else self.parse_template(docx)
+        return template.render(
+            {'outgoing_no': outgoing_no, 'outgoing_date': outgoing_date},
+            stamp=stamp or stamp_service.get_stamp(certificate_data)
+        )
+
+    def create_mock_docx(self) -> bytes:
+        """Создать mock DOCX файл с плейсхолдерами для тестирования"""
+        from docx import Document
+
+        doc = Document()
+        doc.add_heading('Исходящее письмо', 0)
+
+        doc.add_paragraph(f'Исх. № {{{{outgoing_no}}}} от {{{{outgoing_date}}}}')
+        doc.add_paragraph('')
+        doc.add_paragraph('Уважаемые коллеги,')
+        doc.add_paragraph('')
+        doc.add_paragraph('Направляем Вам информацию по запросу.')
+        doc.add_paragraph('')
+        doc.add_paragraph('С уважением,')
+        doc.add_paragraph('{{stamp}}')
+
         output = io.BytesIO()
         doc.save(output)
         output.seek(0)
         return output.read()
 
-    def _insert_stamp_visualization(self, paragraph, certificate_data: Optional[Dict] = None):
-        """
-        Вставить визуализацию электронной подписи в параграф
-
-        Args:
-            paragraph: Параграф документа
-            certificate_data: Данные сертификата
-        """
-        # Если есть готовое изображение штампа, используем его
-        if self.stamp_image_path.exists():
-            try:
-                run = paragraph.add_run()
-                run.add_picture(str(self.stamp_image_path), width=Inches(2.5))
-                return
-            except Exception as e:
-                print(f"Error adding stamp image: {e}")
-
-        # Если изображения нет, создаем текстовую визуализацию в рамке
-        # Используем данные из certificate_data или mock данные
-
-        USER_STAMP_DATA = {
-            'gabidulina': {
-                'serial': '11111111111111111',
-                'owner': 'Габидулина Рада Ришатовна',
-                'valid_from': '01.01.2026',
-                'valid_to': '31.12.2026',
-            },
-            'default': {
-                'serial': '5C6BE147FA657D807EF3A907DFB53553',
-                'owner': 'Левченко Вера Сергеевна',
-                'valid_from': '16.07.2025',
-                'valid_to': '09.10.2026',
-            }
-        }
-        username = certificate_data.get('username', 'default') if certificate_data else 'default'
-        stamp = USER_STAMP_DATA.get(username, USER_STAMP_DATA['default'])
-        cert_serial = certificate_data.get('serial', stamp['serial']) if certificate_data else stamp['serial']
-        cert_owner = certificate_data.get('owner', stamp['owner']) if certificate_data else stamp['owner']
-        cert_valid_from = certificate_data.get('valid_from', stamp['valid_from']) if certificate_data else stamp['valid_from']
-        cert_valid_to = certificate_data.get('valid_to', stamp['valid_to']) if certificate_data else stamp['valid_to']
-
-        # Добавляем текстовую визуализацию
-        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        # Заголовок
-        run = paragraph.add_run('ДОКУМЕНТ ПОДПИСАН ЭЛЕКТРОННОЙ ПОДПИСЬЮ\n')
-        run.bold = True
-        run.font.size = Pt(10)
-
-        # Данные сертификата
-        run = paragraph.add_run(f'Сертификат {cert_serial}\n')
-        run.font.size = Pt(8)
-
-        run = paragraph.add_run(f'Владелец {cert_owner}\n')
-        run.font.size = Pt(8)
-
-        run = paragraph.add_run(f'Действителен с {cert_valid_from} по {cert_valid_to}')
-        run.font.size = Pt(8)
-
     def format_date(self, date_obj: date) -> str:
         """
         Форматировать дату в формат ДД.ММ.ГГГГ
@@ -0,0 +1,387 @@
+import io
+import re
+import copy
+import struct
+import zipfile
+from collections import Counter
+from typing import Dict, List, Optional
+from lxml import etree
+
+
+# Пространства имён OOXML
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+WP_NS = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+A_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+PIC_NS = "http://schemas.openxmlformats.org/drawingml/2006/picture"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+IMAGE_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+
+W_P = f"{{{W_NS}}}p"
+W_R = f"{{{W_NS}}}r"
+W_T = f"{{{W_NS}}}t"
+W_RPR = f"{{{W_NS}}}rPr"
+
+# Плейсхолдеры шаблона исходящего письма
+PLACEHOLDER_RE = re.compile(r"\{\{(outgoing_no|outgoing_date|stamp)\}\}")
+
+# Части документа, в которых ищутся плейсхолдеры (основной текст, колонтитулы, сноски)
+PLACEHOLDER_PART_RE = re.compile(r"^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$")
+
+# Ширина изображения штампа (2.5 дюйма в EMU)
+STAMP_IMAGE_WIDTH_EMU = 2286000
+
+
+def png_size(png_bytes: bytes) -> tuple[int, int]:
+    """Размер PNG (ширина, высота) в пикселях из заголовка IHDR"""
+    if png_bytes[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("Stamp image is not a PNG file")
+    return struct.unpack(">II", png_bytes[16:24])
+
+
+def build_text_stamp_runs(lines: List[Dict]) -> List[etree._Element]:
+    """
+    Построить runs текстовой визуализации ЭЦП
+
+    Args:
+        lines: Строки штампа [{'text': str, 'bold': bool, 'size': pt}]
+
+    Returns:
+        Список элементов w:r
+    """
+    runs = []
+    for index, line in enumerate(lines):
+        run = etree.Element(W_R, nsmap={'w': W_NS})
+        rpr = etree.SubElement(run, W_RPR)
+        if line.get('bold'):
+            etree.SubElement(rpr, f"{{{W_NS}}}b")
+        size = etree.SubElement(rpr, f"{{{W_NS}}}sz")
+        size.set(f"{{{W_NS}}}val", str(int(line.get('size', 8) * 2)))
+        text = etree.SubElement(run, W_T)
+        text.text = line['text']
+        text.set(XML_SPACE, "preserve")
+        if index < len(lines) - 1:
+            etree.SubElement(run, f"{{{W_NS}}}br")
+        runs.append(run)
+    return runs
+
+
+def build_image_stamp_run(rel_id: str, width_emu: int, height_emu: int, shape_id: int) -> etree._Element:
+    """
+    Построить run с изображением штампа (inline drawing)
+
+    Args:
+        rel_id: ID связи с изображением в .rels части
+        width_emu: Ширина в EMU
+        height_emu: Высота в EMU
+        shape_id: Уникальный ID фигуры в документе
+
+    Returns:
+        Элемент w:r
+    """
+    xml = (
+        f'<w:r xmlns:w="{W_NS}" xmlns:wp="{WP_NS}" xmlns:a="{A_NS}" xmlns:pic="{PIC_NS}" xmlns:r="{R_NS}">'
+        f'<w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0">'
+        f'<wp:extent cx="{width_emu}" cy="{height_emu}"/>'
+        f'<wp:docPr id="{shape_id}" name="Stamp {shape_id}"/>'
+        f'<wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/></wp:cNvGraphicFramePr>'
+        f'<a:graphic><a:graphicData uri="{PIC_NS}"><pic:pic>'
+        f'<pic:nvPicPr><pic:cNvPr id="0" name="stamp.png"/><pic:cNvPicPr/></pic:nvPicPr>'
+        f'<pic:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+        f'<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{width_emu}" cy="{height_emu}"/></a:xfrm>'
+        f'<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr>'
+        f'</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r>'
+    )
+    return etree.fromstring(xml)
+
+
+class DocxTemplate:
+    """
+    Шаблон DOCX, разобранный напрямую на уровне XML внутри zip.
+
+    Части с текстом (document, header*, footer*, сноски) разбираются lxml
+    один раз; по этому же разбору определяется наличие плейсхолдеров и
+    выполняется их замена. Плейсхолдеры находятся и заменяются, даже если
+    разбиты на несколько runs, с сохранением форматирования run, в котором
+    начинается плейсхолдер. Остальные части zip копируются без изменений.
+    """
+
+    def __init__(self, docx_bytes: bytes):
+        self.docx_bytes = docx_bytes
+        self.placeholders: set[str] = set()
+        self.placeholder_counts: Counter = Counter()  # {имя: число вхождений}
+        # {имя части: (корень XML, индексы параграфов с плейсхолдерами)}
+        self._parts: Dict[str, tuple[etree._Element, List[int]]] = {}
+
+        with zipfile.ZipFile(io.BytesIO(docx_bytes)) as zin:
+            for name in zin.namelist():
+                if not PLACEHOLDER_PART_RE.match(name):
+                    continue
+                data = zin.read(name)
+                # Быстрый отсев частей без фигурных скобок
+                if b"{" not in data:
+                    continue
+                root = etree.fromstring(data)
+                indices = []
+                for index, paragraph in enumerate(root.iter(W_P)):
+                    text = "".join(t.text or "" for t in self._text_nodes(paragraph))
+                    found = [m.group(1) for m in PLACEHOLDER_RE.finditer(text)]
+                    if found:
+                        indices.append(index)
+                        self.placeholders.update(found)
+                        self.placeholder_counts.update(found)
+                if indices:
+                    self._parts[name] = (root, indices)
+
+    def has_placeholders(self) -> bool:
+        """Есть ли в шаблоне плейсхолдеры {{outgoing_no}}, {{outgoing_date}}, {{stamp}}"""
+        return bool(self.placeholders)
+
+    @staticmethod
+    def _text_nodes(paragraph: etree._Element) -> List[etree._Element]:
+        """Текстовые узлы w:t, принадлежащие параграфу (без вложенных параграфов надписей)"""
+        nodes = []
+        for node in paragraph.iter(W_T):
+            owner = next(node.iterancestors(W_P), None)
+            if owner is paragraph:
+                nodes.append(node)
+        return nodes
+
+    def _replace_in_paragraph(self, paragraph: etree._Element, values: Dict[str, str]) -> List[etree._Element]:
+        """
+        Заменить плейсхолдеры в параграфе
+
+        Returns:
+            Список runs, после которых нужно вставить штамп
+        """
+        nodes = self._text_nodes(paragraph)
+        texts = [node.text or "" for node in nodes]
+        offsets = []
+        position = 0
+        for text in texts:
+            offsets.append(position)
+            position += len(text)
+        full_text = "".join(texts)
+
+        lengths = [len(text) for text in texts]
+        stamp_anchors = []
+        # Идём с конца, чтобы смещения более ранних совпадений не менялись
+        for match in reversed(list(PLACEHOLDER_RE.finditer(full_text))):
+            name = match.group(1)
+            replacement = values.get(name, "" if name == "stamp" else match.group(0))
+            start, end = match.span()
+
+            # Узел, в котором начинается плейсхолдер, получает замену;
+            # из следующих узлов удаляется оставшаяся часть плейсхолдера
+            first = next(i for i in range(len(nodes)) if offsets[i] <= start < offsets[i] + lengths[i])
+            for i in range(first, len(nodes)):
+                if offsets[i] >= end:
+                    break
+                local_end = end - offsets[i]
+                if i == first:
+                    texts[i] = texts[i][:start - offsets[i]] + replacement + texts[i][local_end:]
+                else:
+                    texts[i] = texts[i][local_end:]
+
+            if name == "stamp":
+                # Запоминаем длину текста после плейсхолдера - она не меняется
+                # при замене более ранних плейсхолдеров
+                tail_length = len(texts[first]) - (start - offsets[first])
+                stamp_anchors.append((nodes[first], tail_length))
+
+        for node, text in zip(nodes, texts):
+            if node.text != text:
+                node.text = text
+                node.set(XML_SPACE, "preserve")
+
+        # Разрезаем run в месте {{stamp}}, чтобы штамп встал точно на место плейсхолдера
+        return [
+            self._split_run(node, len(node.text or "") - tail_length)
+            for node, tail_length in stamp_anchors
+        ]
+
+    @staticmethod
+    def _split_run(node: etree._Element, position: int) -> etree._Element:
+        """
+        Разрезать run по позиции в текстовом узле. Хвост переносится в копию run
+        (с тем же форматированием), которая вставляется сразу после исходного.
+
+        Returns:
+            Run, после которого нужно вставить штамп
+        """
+        run = node.getparent()
+        children = list(run)
+        index = children.index(node)
+        text = node.text or ""
+
+        has_tail = position < len(text) or any(child.tag != W_RPR for child in children[index + 1:])
+        if not has_tail:
+            return run
+
+        tail_run = copy.deepcopy(run)
+        tail_children = list(tail_run)
+        for child in tail_children[:index]:
+            if child.tag != W_RPR:
+                tail_run.remove(child)
+        tail_children[index].text = text[position:]
+        tail_children[index].set(XML_SPACE, "preserve")
+
+        node.text = text[:position]
+        for child in children[index + 1:]:
+            run.remove(child)
+
+        run.addnext(tail_run)
+        return run
+
+    def render(self, values: Dict[str, str], stamp: Optional[Dict] = None) -> bytes:
+        """
+        Сформировать DOCX с заменёнными плейсхолдерами. Шаблон не изменяется,
+        поэтому render можно вызывать повторно.
+
+        Args:
+            values: Значения плейсхолдеров {'outgoing_no': ..., 'outgoing_date': ...};
+                текст для {{stamp}} по умолчанию пустой
+            stamp: Визуализация ЭЦП для {{stamp}}:
+                {'image': bytes PNG} или {'lines': [{'text', 'bold', 'size'}]};
+                готовые штампы stamp_service дополнительно содержат
+                'image_extent' (размер в EMU) или 'runs' (собранные runs)
+
+        Returns:
+            Содержимое нового DOCX файла
+        """
+        rendered_parts: Dict[str, bytes] = {}
+        extra_members: Dict[str, bytes] = {}
+        stamp_image = stamp.get('image') if stamp else None
+        stamp_rel_ids: Dict[str, str] = {}
+        media_name = None
+
+        with zipfile.ZipFile(io.BytesIO(self.docx_bytes)) as zin:
+            existing_names = set(zin.namelist())
+
+            if stamp_image and "stamp" in self.placeholders:
+                media_name = self._unique_name(existing_names, "word/media/outbox_stamp", ".png")
+                extra_members[media_name] = stamp_image
+                if stamp.get('image_extent'):
+                    width_emu, height_emu = stamp['image_extent']
+                else:
+                    width, height = png_size(stamp_image)
+                    width_emu, height_emu = STAMP_IMAGE_WIDTH_EMU, int(STAMP_IMAGE_WIDTH_EMU * height / width)
+
+            shape_id = 7000
+            for part_name, (original_root, indices) in self._parts.items():
+                root = copy.deepcopy(original_root)
+                paragraphs = list(root.iter(W_P))
+
+                for index in indices:
+                    paragraph = paragraphs[index]
+                    for run in self._replace_in_paragraph(paragraph, values):
+                        if stamp_image and media_name:
+                            if part_name not in stamp_rel_ids:
+                                stamp_rel_ids[part_name] = self._add_image_relationship(
+                                    zin, existing_names, rendered_parts, part_name, media_name
+                                )
+                            shape_id += 1
+                            run.addnext(build_image_stamp_run(
+                                stamp_rel_ids[part_name], width_emu, height_emu, shape_id
+                            ))
+                        elif stamp and stamp.get('lines'):
+                            self._center_paragraph(paragraph)
+                            # Готовые runs из кэша штампов копируются, а не строятся заново
+                            stamp_runs = (
+                                [copy.deepcopy(stamp_run) for stamp_run in stamp['runs']]
+                                if stamp.get('runs') else build_text_stamp_runs(stamp['lines'])
+                            )
+                            for stamp_run in reversed(stamp_runs):
+                                run.addnext(stamp_run)
+
+                rendered_parts[part_name] = etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+            if media_name:
+                rendered_parts["[Content_Types].xml"] = self._ensure_png_content_type(
+                    rendered_parts.get("[Content_Types].xml") or zin.read("[Content_Types].xml")
+                )
+
+            output = io.BytesIO()
+            with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zout:
+                for info in zin.infolist():
+                    data = rendered_parts.get(info.filename)
+                    # Неизменённые части копируются байт в байт
+                    zout.writestr(info, data if data is not None else zin.read(info.filename))
+                for name in sorted(set(rendered_parts) - existing_names):
+                    zout.writestr(name, rendered_parts[name])
+                for name, data in extra_members.items():
+                    zout.writestr(name, data)
+
+        return output.getvalue()
+
+    @staticmethod
+    def _unique_name(existing_names: set, base: str, suffix: str) -> str:
+        """Имя части zip, не совпадающее с существующими"""
+        name = f"{base}{suffix}"
+        counter = 1
+        while name in existing_names:
+            name = f"{base}{counter}{suffix}"
+            counter += 1
+        return name
+
+    @staticmethod
+    def _center_paragraph(paragraph: etree._Element):
+        """Выровнять параграф по центру (w:pPr/w:jc)"""
+        ppr = paragraph.find(f"{{{W_NS}}}pPr")
+        if ppr is None:
+            ppr = etree.Element(f"{{{W_NS}}}pPr")
+            paragraph.insert(0, ppr)
+        jc = ppr.find(f"{{{W_NS}}}jc")
+        if jc is None:
+            jc = etree.SubElement(ppr, f"{{{W_NS}}}jc")
+        jc.set(f"{{{W_NS}}}val", "center")
+
+    @staticmethod
+    def _add_image_relationship(
+        zin: zipfile.ZipFile,
+        existing_names: set,
+        rendered_parts: Dict[str, bytes],
+        part_name: str,
+        media_name: str
+    ) -> str:
+        """
+        Добавить связь части документа с изображением штампа
+
+        Returns:
+            ID добавленной связи
+        """
+        folder, file_name = part_name.rsplit("/", 1)
+        rels_name = f"{folder}/_rels/{file_name}.rels"
+        if rels_name in existing_names:
+            rels_root = etree.fromstring(zin.read(rels_name))
+        else:
+            rels_root = etree.Element(f"{{{PKG_REL_NS}}}Relationships", nsmap={None: PKG_REL_NS})
+
+        used_ids = {rel.get("Id") for rel in rels_root}
+        rel_id = "rIdOutboxStamp"
+        counter = 1
+        while rel_id in used_ids:
+            rel_id = f"rIdOutboxStamp{counter}"
+            counter += 1
+
+        relationship = etree.SubElement(rels_root, f"{{{PKG_REL_NS}}}Relationship")
+        relationship.set("Id", rel_id)
+        relationship.set("Type", IMAGE_REL_TYPE)
+        relationship.set("Target", media_name[len(folder) + 1:])
+
+        rendered_parts[rels_name] = etree.tostring(rels_root, xml_declaration=True, encoding="UTF-8", standalone=True)
+        return rel_id
+
+    @staticmethod
+    def _ensure_png_content_type(content_types: bytes) -> bytes:
+        """Добавить тип содержимого PNG в [Content_Types].xml, если его нет"""
+        root = etree.fromstring(content_types)
+        for default in root.findall(f"{{{CT_NS}}}Default"):
+            if (default.get("Extension") or "").lower() == "png":
+                return content_types
+        default = etree.SubElement(root, f"{{{CT_NS}}}Default")
+        default.set("Extension", "png")
+        default.set("ContentType", "image/png")
+        return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
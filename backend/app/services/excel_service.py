@@ -1,126 +1,109 @@
 from io import BytesIO
-from typing import List
+from typing import BinaryIO, Iterable
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
-from app.models.outbox_journal import OutboxJournal
+
+
+# Заголовки и ширина колонок журнала
+JOURNAL_HEADERS = [
+    ("№ п/п", 8),
+    ("Исходящий номер", 15),
+    ("Дата", 12),
+    ("Кому", 40),
+    ("Краткое содержание", 50),
+    ("Исполнитель", 25),
+    ("Путь к файлам", 50),
+]
 
 
 class ExcelService:
     """Сервис для работы с Excel файлами"""
 
-    def generate_journal_xlsx(self, entries: List[OutboxJournal]) -> BytesIO:
+    def generate_journal_xlsx(self, entries: Iterable) -> BytesIO:
         """
         Генерирует XLSX файл с записями журнала
 
         Args:
-            entries: Список записей журнала
+            entries: Записи журнала - строки проекции без BLOB столбцов
+                (outgoing_no, formatted_number, outgoing_date, to_whom, content, executor, folder_path)
 
         Returns:
             BytesIO объект с Excel файлом
         """
-        # Создаем workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Журнал исходящих"
-
-        # Заголовок
-        headers = [
-            "№ п/п",
-            "Исходящий номер",
-            "Дата",
-            "Кому",
-            "Краткое содержание",
-            "Исполнитель",
-            "Путь к файлам"
-        ]
-
-        # Стили для заголовка
-        header_font = Font(bold=True, color="FFFFFF", size=12)
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center")
-
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-
-        # Записываем заголовки
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num)
-            cell.value = header
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = border
-
-        # Устанавливаем ширину колонок
-        ws.column_dimensions['A'].width = 8   # № п/п
-        ws.column_dimensions['B'].width = 15  # Исходящий номер
-        ws.column_dimensions['C'].width = 12  # Дата
-        ws.column_dimensions['D'].width = 40  # Кому
-        ws.column_dimensions['E'].width = 50  # Краткое содержание
-        ws.column_dimensions['F'].width = 25  # Исполнитель
-        ws.column_dimensions['G'].width = 50  # Путь
-
-        # Стили для данных
-        data_alignment = Alignment(vertical="top", wrap_text=True)
+        excel_buffer = BytesIO()
+        self.write_journal_xlsx(entries, excel_buffer)
+        excel_buffer.seek(0)
+        return excel_buffer
 
-        # Записываем данные
-        for row_num, entry in enumerate(entries, 2):
-            # № п/п — числовая часть исходящего номера (например, "179-11" → 179)
-            cell = ws.cell(row=row_num, column=1)
-            cell.value = entry.outgoing_no
-            cell.alignment = Alignment(horizontal="center")
-            cell.border = border
-
-            # Исходящий номер
-            cell = ws.cell(row=row_num, column=2)
-            cell.value = entry.formatted_number  # Форматированный номер (например, "178-01")
-            cell.alignment = Alignment(horizontal="center")
-            cell.border = border
-
-            # Дата
-            cell = ws.cell(row=row_num, column=3)
-            cell.value = entry.outgoing_date.strftime("%d.%m.%Y") if entry.outgoing_date else ""
-            cell.alignment = Alignment(horizontal="center")
-            cell.border = border
-
-            # Кому
-            cell = ws.cell(row=row_num, column=4)
-            cell.value = entry.to_whom or ""
-            cell.alignment = data_alignment
-            cell.border = border
-
-            # Краткое содержание
-            cell = ws.cell(row=row_num, column=5)
-            cell.value = entry.content or ""
-            cell.alignment = data_alignment
-            cell.border = border
-
-            # Исполнитель
-            cell = ws.cell(row=row_num, column=6)
-            cell.value = entry.executor or ""
-            cell.alignment = data_alignment
-            cell.border = border
-
-            # Путь
-            cell = ws.cell(row=row_num, column=7)
-            cell.value = entry.folder_path or ""
-            cell.alignment = data_alignment
-            cell.border = border
-
-        # Закрепляем первую строку
+    def write_journal_xlsx(self, entries: Iterable, output: BinaryIO):
+        """
+        Записать XLSX с записями журнала в файл
+
+        Книга создаётся в режиме write_only: строки сразу уходят во временный
+        файл openpyxl, а не копятся в памяти; оформление ячеек - общие
+        именованные стили книги, а не свой объект стиля на каждую ячейку
+
+        Args:
+            entries: Записи журнала (см. generate_journal_xlsx)
+            output: Файл (или поток) для записи
+        """
+        wb = Workbook(write_only=True)
+        self._add_journal_styles(wb)
+        ws = wb.create_sheet("Журнал исходящих")
+
+        # Ширина колонок и закрепление заголовка - до первой строки
+        for col_num, (_, width) in enumerate(JOURNAL_HEADERS, 1):
+            ws.column_dimensions[get_column_letter(col_num)].width = width
         ws.freeze_panes = "A2"
 
-        # Сохраняем в BytesIO
-        excel_buffer = BytesIO()
-        wb.save(excel_buffer)
-        excel_buffer.seek(0)
+        def cell(value, style: str) -> WriteOnlyCell:
+            result = WriteOnlyCell(ws, value=value)
+            result.style = style
+            return result
 
-        return excel_buffer
+        # Заголовки
+        ws.append([cell(header, "journal_header") for header, _ in JOURNAL_HEADERS])
+
+        # Записываем данные
+        for entry in entries:
+            ws.append([
+                # № п/п — числовая часть исходящего номера (например, "179-11" → 179)
+                cell(entry.outgoing_no, "journal_center"),
+                cell(entry.formatted_number, "journal_center"),  # Форматированный номер (например, "178-01")
+                cell(entry.outgoing_date.strftime("%d.%m.%Y") if entry.outgoing_date else "", "journal_center"),
+                cell(entry.to_whom or "", "journal_text"),
+                cell(entry.content or "", "journal_text"),
+                cell(entry.executor or "", "journal_text"),
+                cell(entry.folder_path or "", "journal_text"),
+            ])
+
+        wb.save(output)
+
+    @staticmethod
+    def _add_journal_styles(wb: Workbook):
+        """Именованные стили журнала: заголовок, ячейка по центру, текст с переносом"""
+        side = Side(style='thin')
+        border = Border(left=side, right=side, top=side, bottom=side)
+
+        wb.add_named_style(NamedStyle(
+            name="journal_header",
+            font=Font(bold=True, color="FFFFFF", size=12),
+            fill=PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid"),
+            alignment=Alignment(horizontal="center", vertical="center"),
+            border=border
+        ))
+        wb.add_named_style(NamedStyle(
+            name="journal_center",
+            alignment=Alignment(horizontal="center"),
+            border=border
+        ))
+        wb.add_named_style(NamedStyle(
+            name="journal_text",
+            alignment=Alignment(vertical="top", wrap_text=True),
+            border=border
+        ))
 
 
 # Singleton instance
@@ -0,0 +1,439 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.database import SessionLocal
+from app.models.registration_session import RegistrationSession
+from app.services.blob_service import blob_service
+from app.services.file_service import file_service
+from app.services.journal_count_service import journal_count_service
+from app.services.journal_export_service import journal_export_service
+from app.services.registration_session_service import registration_session_service
+from app.services.temp_files_service import TEMP_FILES_DIR
+
+
+class FinalizationError(Exception):
+    """Ошибка финализации, которую нельзя исправить повтором (например, нет прав на папку)"""
+    pass
+
+
+class FinalizationService:
+    """
+    Фоновая финализация подписанных документов.
+
+    Загрузка подписи только сохраняет и проверяет её, закрепляет номер и переводит
+    сессию регистрации в статус "signed" - ответ клиенту уходит сразу. Остальное
+    выполняет этот сервис по этапам:
+    1. attachments - приложения карточки скачиваются в хранилище по содержимому (blob_service);
+    2. folder - PDF, подпись и приложения ставятся в папку исходящих ссылками на хранилище;
+    3. journal - запись журнала, ссылки на файлы и статус "finalized" фиксируются одной транзакцией.
+
+    Каждый этап можно повторить: скачанные приложения запомнены в сессии, файлы
+    в папке заменяются, а запись журнала создаётся под блокировкой сессии
+    только из статуса "signed". Состояние хранится в БД, поэтому после падения
+    процесса документы в статусе "signed" подхватываются при следующем обходе.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending: Set[str] = set()  # В очереди или в работе - не ставим повторно
+        self._metrics = {
+            'enqueued': 0,
+            'finalized': 0,
+            'retries': 0,
+            'failed': 0,
+            'last_error': None
+        }
+
+    def get_metrics(self) -> Dict:
+        """Метрики фоновой финализации"""
+        return {
+            **self._metrics,
+            'queued': self._queue.qsize(),
+            'in_progress': len(self._pending) - self._queue.qsize()
+        }
+
+    def enqueue(self, file_id: str):
+        """Поставить подписанный документ в очередь финализации (только из цикла событий)"""
+        if file_id in self._pending:
+            return
+        self._pending.add(file_id)
+        self._metrics['enqueued'] += 1
+        self._queue.put_nowait(file_id)
+
+    async def run_forever(self):
+        """
+        Фоновая задача: воркеры очереди и периодический обход БД (FINALIZE_RESCAN_SECONDS),
+        который подхватывает документы, оставшиеся в статусе "signed" после перезапуска
+        или ожидающие повтора после ошибки
+        """
+        workers = [
+            asyncio.create_task(self._worker())
+            for _ in range(max(1, settings.FINALIZE_CONCURRENCY))
+        ]
+        print(f"[Finalize] Started {len(workers)} workers (rescan every {settings.FINALIZE_RESCAN_SECONDS}s)")
+        try:
+            while True:
+                try:
+                    # Обход БД - в потоке, постановка в очередь - в цикле событий (asyncio.Queue не потокобезопасна)
+                    for file_id in await asyncio.to_thread(self._get_due):
+                        self.enqueue(file_id)
+                except Exception as e:
+                    print(f"[Finalize] Rescan error: {e}")
+                await asyncio.sleep(settings.FINALIZE_RESCAN_SECONDS)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def _get_due(self) -> List[str]:
+        """ID документов "signed", срок повтора которых наступил"""
+        db = SessionLocal()
+        try:
+            return registration_session_service.get_signed_due(db, datetime.now(timezone.utc))
+        finally:
+            db.close()
+
+    async def _worker(self):
+        while True:
+            file_id = await self._queue.get()
+            try:
+                await self.finalize(file_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Finalize] Unexpected error for {file_id}: {e}")
+            finally:
+                self._pending.discard(file_id)
+                self._queue.task_done()
+
+    async def finalize(self, file_id: str) -> bool:
+        """
+        Выполнить этапы финализации документа.
+        Запросы к БД и работа с файлами идут в потоках (asyncio.to_thread), у каждого
+        шага своя сессия БД - цикл событий не ждёт ни БД, ни сетевую папку.
+        Ошибка записывается в сессию регистрации; повтор - через FINALIZE_RETRY_SECONDS
+        (с нарастанием), после FINALIZE_MAX_ATTEMPTS попыток документ получает статус "failed"
+
+        Args:
+            file_id: ID подготовленных файлов
+
+        Returns:
+            True если документ записан в журнал (сейчас или ранее)
+        """
+        session = await asyncio.to_thread(self._load_session, file_id)
+        if not session:
+            return False
+        if session.status != "signed":
+            return session.status == "finalized"
+
+        try:
+            pdf_bytes, sig_bytes = await asyncio.to_thread(self._read_documents, session)
+        except FileNotFoundError as e:
+            await asyncio.to_thread(self._record_error, file_id, f"Файл документа не найден: {e.filename}", True)
+            return False
+
+        try:
+            await asyncio.to_thread(self._set_stage, file_id, "attachments")
+            # На последней попытке недоступные приложения пропускаются - документ важнее
+            last_attempt = (session.finalize_attempts or 0) + 1 >= settings.FINALIZE_MAX_ATTEMPTS
+            attachments = await self.collect_attachments(session, allow_partial=last_attempt)
+
+            await asyncio.to_thread(self._set_stage, file_id, "folder")
+            outgoing_folder = await asyncio.to_thread(outgoing_folder_path, session.formatted_number)
+            await asyncio.to_thread(
+                self.save_to_outgoing_folder,
+                session,
+                outgoing_folder,
+                pdf_bytes,
+                sig_bytes,
+                attachments
+            )
+
+            await asyncio.to_thread(self._set_stage, file_id, "journal")
+            journal_entry_id = await asyncio.to_thread(
+                self._write_journal_entry, session, pdf_bytes, sig_bytes, attachments, outgoing_folder
+            )
+        except FinalizationError as e:
+            await asyncio.to_thread(self._record_error, file_id, str(e), True)
+            return False
+        except Exception as e:
+            await asyncio.to_thread(self._record_error, file_id, str(e), False)
+            return False
+
+        if journal_entry_id is None:
+            return True
+        journal_count_service.invalidate()
+        self._metrics['finalized'] += 1
+        print(f"[Finalize] {session.formatted_number}: journal entry ID={journal_entry_id}")
+        return True
+
+    @staticmethod
+    def _load_session(file_id: str) -> Optional[RegistrationSession]:
+        """Сессия регистрации (отсоединённая от сессии БД - только для чтения полей)"""
+        db = SessionLocal()
+        try:
+            return registration_session_service.get(db, file_id)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _read_documents(session: RegistrationSession) -> Tuple[bytes, bytes]:
+        """Подготовленный PDF и принятая подпись"""
+        return (TEMP_FILES_DIR / session.pdf_file).read_bytes(), Path(session.sig_path).read_bytes()
+
+    @staticmethod
+    def _set_stage(file_id: str, stage: str):
+        """Отметить начатый этап (виден в /status, помогает разбирать зависшие документы)"""
+        db = SessionLocal()
+        try:
+            db.query(RegistrationSession).filter(RegistrationSession.file_id == file_id).update(
+                {RegistrationSession.finalize_stage: stage}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _record_error(self, file_id: str, error: str, permanent: bool):
+        """Записать ошибку этапа и назначить повтор (или перевести документ в "failed")"""
+        db = SessionLocal()
+        try:
+            session = registration_session_service.get(db, file_id, for_update=True)
+            if not session or session.status != "signed":
+                db.rollback()
+                return
+            session.finalize_attempts = (session.finalize_attempts or 0) + 1
+            session.finalize_error = error
+            if permanent or session.finalize_attempts >= settings.FINALIZE_MAX_ATTEMPTS:
+                session.status = "failed"
+                self._metrics['failed'] += 1
+                print(f"[Finalize] {session.formatted_number} failed at {session.finalize_stage}: {error}")
+            else:
+                delay = settings.FINALIZE_RETRY_SECONDS * session.finalize_attempts
+                session.finalize_next_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+                self._metrics['retries'] += 1
+                print(f"[Finalize] {session.formatted_number} stage {session.finalize_stage} error, retry in {delay}s: {error}")
+            self._metrics['last_error'] = error
+            db.commit()
+        finally:
+            db.close()
+
+    async def collect_attachments(
+        self,
+        session: RegistrationSession,
+        allow_partial: bool = False
+    ) -> List[Dict]:
+        """
+        Этап "attachments": скачать приложения по снимку карточки из сессии
+        (все файлы карточки, кроме DOCX - основной документ уже в PDF) в хранилище
+        по содержимому. Список сохранённых приложений запоминается в сессии -
+        повтор финализации их не скачивает. Приложение, которое не удалось скачать, -
+        ошибка этапа (будет повтор), иначе в журнал попал бы неполный список
+
+        Args:
+            session: Сессия регистрации
+            allow_partial: Пропустить недоступные приложения вместо ошибки
+
+        Returns:
+            [{'name', 'sha256', 'size'}]
+        """
+        if session.attachment_blobs is not None and await asyncio.to_thread(
+            lambda: all(blob_service.backend.exists(item['sha256']) for item in session.attachment_blobs)
+        ):
+            return session.attachment_blobs
+
+        attachment_files = session.attachments or []
+        manifest = []
+        if attachment_files:
+            print(f"[Finalize] Downloading {len(attachment_files)} attachments for {session.formatted_number}")
+            downloaded = await asyncio.gather(
+                *[file_service.download_file(file_info['url']) for file_info in attachment_files],
+                return_exceptions=True
+            )
+            for file_info, file_bytes in zip(attachment_files, downloaded):
+                if isinstance(file_bytes, Exception):
+                    if not allow_partial:
+                        raise RuntimeError(f"Не удалось скачать приложение {file_info['name']}: {file_bytes}")
+                    print(f"  - Skipped {file_info['name']}: {file_bytes}")
+                    continue
+                digest = await asyncio.to_thread(blob_service.put, file_bytes)
+                manifest.append({'name': Path(file_info['name']).name, 'sha256': digest, 'size': len(file_bytes)})
+            print(f"[Finalize] Attachments stored: {len(manifest)}, {sum(item['size'] for item in manifest)} bytes")
+
+        await asyncio.to_thread(self._save_attachment_blobs, session.file_id, manifest)
+        session.attachment_blobs = manifest
+        return manifest
+
+    @staticmethod
+    def _save_attachment_blobs(file_id: str, manifest: List[Dict]):
+        """Запомнить в сессии регистрации приложения, сохранённые в хранилище"""
+        db = SessionLocal()
+        try:
+            db.query(RegistrationSession).filter(RegistrationSession.file_id == file_id).update(
+                {RegistrationSession.attachment_blobs: manifest}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def save_to_outgoing_folder(
+        self,
+        session: RegistrationSession,
+        outgoing_folder: Path,
+        pdf_bytes: bytes,
+        sig_bytes: bytes,
+        attachments: List[Dict]
+    ):
+        """
+        Этап "folder": сохранить PDF и подпись в хранилище и поставить их и приложения
+        в папку документа жёсткими ссылками на хранилище (или копиями, если ссылки
+        невозможны). Файлы заменяются - этап можно повторять
+
+        Args:
+            session: Сессия регистрации
+            outgoing_folder: Папка документа (outgoing_folder_path)
+            pdf_bytes: Содержимое PDF
+            sig_bytes: Подпись
+            attachments: Приложения в хранилище (collect_attachments)
+        """
+        pdf_save_path = outgoing_folder / outgoing_pdf_name(session)
+        blob_service.link_or_copy(blob_service.put(pdf_bytes), pdf_save_path, pdf_bytes)
+        print(f"[Finalize] Saved PDF: {pdf_save_path}")
+
+        # Подпись из потоковой загрузки уже лежит в папке - заменяется ссылкой на тот же файл
+        sig_save_path = outgoing_folder / outgoing_sig_name(session)
+        blob_service.link_or_copy(blob_service.put(sig_bytes), sig_save_path, sig_bytes)
+        print(f"[Finalize] Saved SIG: {sig_save_path}")
+
+        for item in attachments:
+            blob_service.link_or_copy(item['sha256'], outgoing_folder / item['name'])
+            print(f"  - Saved: {item['name']}")
+
+        print(f"[Finalize] All files saved to: {outgoing_folder}")
+
+    def add_journal_entry(
+        self,
+        db: Session,
+        session: RegistrationSession,
+        pdf_bytes: bytes,
+        sig_bytes: bytes,
+        attachments: List[Dict],
+        outgoing_folder: Path
+    ):
+        """
+        Этап "journal": добавить запись в журнал со ссылками на файлы хранилища
+        и закрыть сессию регистрации (без commit). Номер закреплён ещё при приёме подписи
+
+        Args:
+            db: Сессия БД
+            session: Сессия регистрации (номер, дата, "Кому", исполнитель, краткое содержание)
+            pdf_bytes: Подписанный PDF
+            sig_bytes: Подпись
+            attachments: Приложения в хранилище (collect_attachments)
+            outgoing_folder: Папка с файлами документа
+
+        Returns:
+            Запись журнала (OutboxJournal) или None, если документ уже записан
+            (повтор после падения или параллельный воркер)
+
+        Raises:
+            BlobMissingError: Приложение удалено из хранилища - повтор скачает его заново
+        """
+        from app.models.outbox_journal import OutboxJournal
+
+        # Блокируем сессию: повтор этапа или второй воркер не создадут дубль
+        locked = registration_session_service.get(db, session.file_id, for_update=True)
+        if not locked or locked.status != "signed":
+            return None
+
+        # Ссылки на файлы - в той же транзакции, что и запись журнала
+        file_sha256 = blob_service.store(db, pdf_bytes)
+        sig_sha256 = blob_service.store(db, sig_bytes)
+        for item in attachments:
+            blob_service.add_ref(db, item['sha256'], item['size'])
+
+        print(f"[Finalize] Creating journal entry {session.formatted_number}...")
+        content = session.content
+        journal_entry = OutboxJournal(
+            outgoing_no=session.outgoing_no,  # Числовая часть (например, 178)
+            formatted_number=session.formatted_number,  # Полный форматированный номер (например, "178-01")
+            outgoing_date=session.outgoing_date,
+            to_whom=session.to_whom,
+            executor=session.executor,
+            content=content[:500] if content else None,  # Ограничиваем длину
+            kaiten_card_url=f"https://outbox.kaiten.ru/space/397084/card/{session.card_id}",
+            file_sha256=file_sha256,
+            sig_sha256=sig_sha256,
+            attachments=attachments or None,
+            sig_status=session.sig_status,
+            sig_checked_at=session.signed_at,
+            folder_path=str(outgoing_folder)  # Путь к папке с файлами
+        )
+        db.add(journal_entry)
+        db.flush()
+        journal_export_service.bump_version(db)
+
+        registration_session_service.mark_finalized(
+            db, locked, journal_entry.id, str(outgoing_folder / outgoing_sig_name(session))
+        )
+        return journal_entry
+
+    def _write_journal_entry(
+        self,
+        session: RegistrationSession,
+        pdf_bytes: bytes,
+        sig_bytes: bytes,
+        attachments: List[Dict],
+        outgoing_folder: Path
+    ) -> Optional[int]:
+        """
+        Этап "journal" в своей сессии БД с commit (выполняется в потоке)
+
+        Returns:
+            ID записи журнала или None, если документ уже записан
+        """
+        db = SessionLocal()
+        try:
+            journal_entry = self.add_journal_entry(db, session, pdf_bytes, sig_bytes, attachments, outgoing_folder)
+            journal_entry_id = journal_entry.id if journal_entry else None
+            db.commit()
+            return journal_entry_id
+        finally:
+            db.close()
+
+
+def outgoing_folder_path(formatted_number: str) -> Path:
+    """
+    Создать (если нужно) папку документа /mnt/doc/Исходящие/{номер}
+
+    Raises:
+        FinalizationError: Нет прав на создание папки
+    """
+    outgoing_folder = Path(settings.OUTGOING_FILES_PATH) / formatted_number
+
+    print(f"[Finalize] Creating folder: {outgoing_folder}")
+    try:
+        outgoing_folder.mkdir(parents=True, exist_ok=True)
+    except PermissionError:
+        print(f"[Finalize] ERROR: Permission denied creating folder: {outgoing_folder}")
+        print(f"[Finalize] Please run: sudo mkdir -p {Path(settings.OUTGOING_FILES_PATH)} && sudo chown -R $USER:$USER {Path(settings.OUTGOING_FILES_PATH)}")
+        raise FinalizationError(
+            f"Нет прав на создание папки {outgoing_folder}. Создайте папку вручную и настройте права: "
+            f"sudo mkdir -p {Path(settings.OUTGOING_FILES_PATH)} && sudo chown -R $USER:$USER {Path(settings.OUTGOING_FILES_PATH)}"
+        )
+    return outgoing_folder
+
+
+def outgoing_pdf_name(session: RegistrationSession) -> str:
+    """Имя PDF в папке исходящих (без префикса file_id)"""
+    return session.pdf_file.replace(f"{session.file_id}_", "")
+
+
+def outgoing_sig_name(session: RegistrationSession) -> str:
+    """Имя подписи в папке исходящих"""
+    return outgoing_pdf_name(session).replace('.pdf', '.pdf.sig')
+
+
+finalization_service = FinalizationService()
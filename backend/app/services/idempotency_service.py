@@ -0,0 +1,172 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.database import AsyncSessionLocal
+from app.models.idempotency_key import IdempotencyKey
+
+
+class IdempotencyError(Exception):
+    """Повтор запроса с Idempotency-Key нельзя выполнить (ключ занят или параметры другие)"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class IdempotencyService:
+    """
+    Хранилище ответов для заголовка Idempotency-Key.
+
+    Первый запрос с ключом занимает его (запись "in_progress"), выполняется
+    и сохраняет ответ. Повтор с тем же ключом и теми же параметрами получает
+    сохранённый ответ - без повторной конвертации PDF, резерва номера или
+    скачивания приложений. Пока первый запрос выполняется, повтор получает 409;
+    ключ, брошенный упавшим запросом, освобождается через IDEMPOTENCY_LOCK_SECONDS.
+
+    Записи ведутся в собственных сессиях БД: откат транзакции эндпоинта
+    не должен откатывать занятие ключа, а ошибка ключа - работу эндпоинта.
+    """
+
+    @staticmethod
+    def fingerprint(payload: Dict[str, Any]) -> str:
+        """SHA-256 параметров запроса (ключ с другими параметрами - ошибка клиента)"""
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+        ).hexdigest()
+
+    async def begin(self, key: str, username: str, endpoint: str, request_hash: str) -> Optional[Dict]:
+        """
+        Занять ключ или получить сохранённый ответ
+
+        Args:
+            key: Значение заголовка Idempotency-Key
+            username: Пользователь
+            endpoint: Имя эндпоинта
+            request_hash: fingerprint() параметров запроса
+
+        Returns:
+            Сохранённый ответ (повтор) или None - ключ занят, запрос нужно выполнить
+
+        Raises:
+            IdempotencyError: 409 - запрос с этим ключом ещё выполняется,
+                422 - ключ использован с другими параметрами
+        """
+        now = datetime.now(timezone.utc)
+        db = AsyncSessionLocal()
+        try:
+            try:
+                db.add(IdempotencyKey(
+                    key=key,
+                    username=username,
+                    endpoint=endpoint,
+                    request_hash=request_hash,
+                    status="in_progress",
+                    expires_at=now + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)
+                ))
+                await db.commit()
+                return None
+            except IntegrityError:
+                await db.rollback()
+
+            record = await self._get(db, key, username, endpoint, for_update=True)
+            if record is None:
+                # Запись удалили между вставкой и чтением - ключ свободен
+                await db.rollback()
+                return await self.begin(key, username, endpoint, request_hash)
+
+            expired = _aware(record.expires_at) <= now
+            abandoned = (
+                record.status == "in_progress"
+                and _aware(record.created_at) <= now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+            )
+            if expired or abandoned:
+                # Ключ истёк или брошен упавшим запросом - занимаем заново
+                record.request_hash = request_hash
+                record.status = "in_progress"
+                record.status_code = None
+                record.response = None
+                record.created_at = now
+                record.expires_at = now + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)
+                await db.commit()
+                return None
+
+            if record.request_hash != request_hash:
+                raise IdempotencyError(422, "Idempotency-Key уже использован для запроса с другими параметрами")
+            if record.status == "in_progress":
+                raise IdempotencyError(409, "Запрос с этим Idempotency-Key ещё выполняется, повторите позже")
+
+            print(f"[Idempotency] Replaying {endpoint} for key {key}")
+            return record.response
+        finally:
+            await db.rollback()
+            await db.close()
+
+    async def complete(self, key: str, username: str, endpoint: str, response: Dict, status_code: int = 200):
+        """Сохранить ответ выполненного запроса"""
+        db = AsyncSessionLocal()
+        try:
+            record = await self._get(db, key, username, endpoint, for_update=True)
+            if record is not None:
+                record.status = "completed"
+                record.status_code = status_code
+                record.response = response
+                await db.commit()
+        except Exception as e:
+            await db.rollback()
+            print(f"[Idempotency] Warning: Could not store response for key {key}: {e}")
+        finally:
+            await db.close()
+
+    async def abandon(self, key: str, username: str, endpoint: str):
+        """Освободить ключ запроса, завершившегося ошибкой (повтор выполнит его заново)"""
+        db = AsyncSessionLocal()
+        try:
+            await db.execute(delete(IdempotencyKey).where(
+                IdempotencyKey.key == key,
+                IdempotencyKey.username == username,
+                IdempotencyKey.endpoint == endpoint,
+                IdempotencyKey.status == "in_progress"
+            ))
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            print(f"[Idempotency] Warning: Could not release key {key}: {e}")
+        finally:
+            await db.close()
+
+    def purge_expired(self, db: Session) -> int:
+        """
+        Удалить истёкшие ключи (фиксируется вызывающим кодом)
+
+        Returns:
+            Число удалённых записей
+        """
+        return db.query(IdempotencyKey).filter(
+            IdempotencyKey.expires_at < datetime.now(timezone.utc)
+        ).delete(synchronize_session=False)
+
+    async def _get(self, db: AsyncSession, key: str, username: str, endpoint: str, for_update: bool = False) -> Optional[IdempotencyKey]:
+        query = select(IdempotencyKey).where(
+            IdempotencyKey.key == key,
+            IdempotencyKey.username == username,
+            IdempotencyKey.endpoint == endpoint
+        )
+        if for_update:
+            query = query.with_for_update()
+        return await db.scalar(query)
+
+
+def _aware(value: datetime) -> datetime:
+    """Дата из БД с часовым поясом (без пояса считается UTC)"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+idempotency_service = IdempotencyService()
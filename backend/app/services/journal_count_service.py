@@ -0,0 +1,73 @@
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from app.core.config import settings
+
+
+# Максимальное число закэшированных счётчиков (сочетаний фильтров)
+MAX_CACHED_COUNTS = 256
+
+
+class JournalCountService:
+    """
+    Кэш числа записей журнала по фильтрам.
+
+    Точный COUNT(*) по журналу растёт вместе с ним, а списку он нужен
+    только для подписи "из N". Число кэшируется на JOURNAL_COUNT_CACHE_SECONDS
+    и сбрасывается при каждом изменении журнала в этом процессе (invalidate);
+    изменения из других процессов видны не позже, чем через TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache: Dict[Hashable, Tuple[int, float]] = {}
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0
+        }
+
+    def get_metrics(self) -> Dict:
+        """Метрики кэша (попадания, промахи, сбросы)"""
+        return {**self._metrics, 'cached': len(self._cache)}
+
+    async def get(self, key: Hashable, count: Callable[[], Awaitable[int]]) -> int:
+        """
+        Число записей по фильтрам: из кэша или посчитанное count()
+
+        Args:
+            key: Ключ фильтров (например, (year, month, sig_status))
+            count: Корутинная функция точного подсчёта
+        """
+        cached = self._get_cached(key)
+        if cached is not None:
+            self._metrics['hits'] += 1
+            return cached
+
+        self._metrics['misses'] += 1
+        value = await count()
+        with self._lock:
+            if len(self._cache) >= MAX_CACHED_COUNTS:
+                self._cache.clear()
+            self._cache[key] = (value, time.monotonic() + settings.JOURNAL_COUNT_CACHE_SECONDS)
+        return value
+
+    def invalidate(self):
+        """Сбросить кэш (запись журнала добавлена, изменена или удалена)"""
+        with self._lock:
+            self._cache.clear()
+        self._metrics['invalidations'] += 1
+
+    def _get_cached(self, key: Hashable) -> Optional[int]:
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is None:
+                return None
+            value, expires_at = cached
+            if expires_at <= time.monotonic():
+                del self._cache[key]
+                return None
+            return value
+
+
+journal_count_service = JournalCountService()
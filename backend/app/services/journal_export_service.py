@@ -0,0 +1,183 @@
+import asyncio
+import os
+import re
+import tempfile
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Optional, Set
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.models.journal_version import JournalVersion
+
+
+# Директория кэша готовых экспортов журнала
+EXPORT_CACHE_DIR = Path(__file__).parent.parent.parent / "export_cache"
+EXPORT_CACHE_DIR.mkdir(exist_ok=True)
+
+# Имя файла кэша: journal_<год|all>_<месяц|all>_v<версия журнала>.<формат>
+EXPORT_NAME_PATTERN = re.compile(r"^journal_(\d{4}|all)_(\d{2}|all)_v(\d+)\.([a-z]+)$")
+
+# Сколько задач экспорта помнится (старые завершённые забываются)
+MAX_EXPORT_JOBS = 100
+
+
+class JournalExportService:
+    """
+    Кэш экспортов журнала по версии журнала.
+
+    Версия журнала (таблица journal_version) увеличивается в транзакции каждого
+    создания, изменения и удаления записи. Готовый файл экспорта хранится
+    в EXPORT_CACHE_DIR под именем из фильтров, формата и версии: пока журнал
+    не менялся, повторный экспорт отдаётся с диска, а имя файла служит ETag.
+    Файл новой версии заменяет файлы прежних версий с теми же фильтрами.
+
+    Версия читается до чтения записей, поэтому файл может оказаться новее своей
+    версии (тогда он будет пересобран при следующем экспорте), но не старее.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict] = {}  # {ID задачи экспорта: состояние}
+        self._tasks: Set[asyncio.Task] = set()  # Выполняющиеся задачи (цикл событий держит на них только слабые ссылки)
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'stored': 0
+        }
+
+    def get_metrics(self) -> Dict:
+        """Метрики кэша экспортов"""
+        files = list(EXPORT_CACHE_DIR.glob("journal_*"))
+        return {
+            **self._metrics,
+            'files': len(files),
+            'bytes': sum(path.stat().st_size for path in files if path.exists())
+        }
+
+    def bump_version(self, db: Session):
+        """Увеличить версию журнала (в транзакции изменения, фиксируется вызывающим кодом)"""
+        db.execute(
+            insert(JournalVersion).values(id=1, version=1).on_conflict_do_update(
+                index_elements=[JournalVersion.id],
+                set_={'version': JournalVersion.version + 1, 'updated_at': func.now()}
+            )
+        )
+
+    def get_version(self, db: Session) -> int:
+        """Текущая версия журнала"""
+        return db.query(JournalVersion.version).filter(JournalVersion.id == 1).scalar() or 0
+
+    @staticmethod
+    def cache_name(fmt: str, year: Optional[int], month: Optional[int], version: int) -> str:
+        """Имя файла кэша для фильтров, формата и версии журнала"""
+        year_part = str(year) if year else "all"
+        month_part = f"{month:02d}" if month else "all"
+        return f"journal_{year_part}_{month_part}_v{version}.{fmt}"
+
+    @staticmethod
+    def etag(name: str) -> str:
+        return f'"{name}"'
+
+    def get_cached(self, name: str) -> Optional[Path]:
+        """Путь к готовому файлу экспорта (None - файла нет или имя недопустимо)"""
+        if not EXPORT_NAME_PATTERN.match(name):
+            return None
+        path = EXPORT_CACHE_DIR / name
+        if path.is_file():
+            self._metrics['hits'] += 1
+            return path
+        self._metrics['misses'] += 1
+        return None
+
+    def build(self, name: str, write: Callable[[BinaryIO], None]) -> Path:
+        """
+        Собрать файл экспорта в кэш (во временный файл, затем переименованием)
+
+        Args:
+            name: Имя файла кэша (см. cache_name)
+            write: Функция, записывающая экспорт в файл
+
+        Returns:
+            Путь к файлу в кэше
+        """
+        fd, temp_path = tempfile.mkstemp(dir=EXPORT_CACHE_DIR, prefix=".build_")
+        try:
+            with os.fdopen(fd, "wb") as output:
+                write(output)
+            return self._store(name, temp_path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+    def _store(self, name: str, temp_path: str) -> Path:
+        """Поставить собранный файл на место и удалить файлы прежних версий с теми же фильтрами"""
+        path = EXPORT_CACHE_DIR / name
+        os.replace(temp_path, path)
+        self._metrics['stored'] += 1
+
+        year_part, month_part, version, fmt = EXPORT_NAME_PATTERN.match(name).groups()
+        for old in EXPORT_CACHE_DIR.glob(f"journal_{year_part}_{month_part}_v*.{fmt}"):
+            match = EXPORT_NAME_PATTERN.match(old.name)
+            if match and int(match.group(3)) < int(version):
+                old.unlink(missing_ok=True)
+        return path
+
+    def start_job(self, name: str, write: Callable[[BinaryIO], None]) -> Dict:
+        """
+        Запустить фоновую сборку экспорта (файл уже в кэше - задача сразу завершена)
+
+        Args:
+            name: Имя файла кэша (см. cache_name)
+            write: Функция, записывающая экспорт в файл (выполняется в отдельном потоке)
+
+        Returns:
+            Состояние задачи
+        """
+        for job in self._jobs.values():
+            if job['name'] == name and job['status'] == 'running':
+                return job
+
+        job = {
+            'job_id': str(uuid.uuid4()),
+            'name': name,
+            'status': 'running',
+            'started_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'error': None
+        }
+        self._jobs[job['job_id']] = job
+        self._forget_old_jobs()
+
+        if (EXPORT_CACHE_DIR / name).is_file():
+            job['status'] = 'done'
+            job['finished_at'] = job['started_at']
+        else:
+            task = asyncio.create_task(self._run_job(job, write))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Получить состояние задачи экспорта"""
+        return self._jobs.get(job_id)
+
+    async def _run_job(self, job: Dict, write: Callable[[BinaryIO], None]):
+        try:
+            await asyncio.to_thread(self.build, job['name'], write)
+            job['status'] = 'done'
+            print(f"[JournalExport] {job['name']} built")
+        except Exception as e:
+            job['status'] = 'error'
+            job['error'] = str(e)
+            print(f"[JournalExport] {job['name']} failed: {e}")
+        finally:
+            job['finished_at'] = datetime.now().isoformat()
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] != 'running']
+        for job_id in finished[:max(0, len(self._jobs) - MAX_EXPORT_JOBS)]:
+            del self._jobs[job_id]
+
+
+journal_export_service = JournalExportService()
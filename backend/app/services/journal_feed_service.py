@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from typing import Iterable, Iterator, Tuple
+
+
+# Поля выгрузки (и порядок колонок CSV)
+FEED_FIELDS = [
+    "id",
+    "outgoing_no",
+    "formatted_number",
+    "outgoing_date",
+    "to_whom",
+    "content",
+    "executor",
+    "folder_path",
+    "sig_status",
+    "created_at",
+]
+
+# Выгрузка отдаётся частями не меньше такого размера
+FEED_CHUNK_SIZE = 64 * 1024
+
+
+class JournalFeedService:
+    """
+    Выгрузка журнала для внешних систем (архив, бухгалтерия): CSV и NDJSON.
+
+    Строки сериализуются по мере чтения и отдаются частями по FEED_CHUNK_SIZE,
+    память не зависит от размера выгрузки. Инкрементальная выгрузка идёт по
+    отметке (created_at, id) последней полученной записи: система передаёт
+    её в since и получает только новые записи.
+    """
+
+    def iter_csv(self, rows: Iterable) -> Iterator[bytes]:
+        """
+        Записи журнала в CSV (UTF-8, разделитель запятая, первая строка - заголовки)
+
+        Args:
+            rows: Строки с полями FEED_FIELDS
+
+        Returns:
+            Итератор частей CSV
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\r\n")
+        writer.writerow(FEED_FIELDS)
+        for row in rows:
+            writer.writerow(["" if value is None else value for value in self._values(row)])
+            if buffer.tell() >= FEED_CHUNK_SIZE:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+
+    def iter_ndjson(self, rows: Iterable) -> Iterator[bytes]:
+        """
+        Записи журнала в NDJSON (объект JSON на строку)
+
+        Args:
+            rows: Строки с полями FEED_FIELDS
+
+        Returns:
+            Итератор частей NDJSON
+        """
+        chunk = []
+        size = 0
+        for row in rows:
+            line = json.dumps(dict(zip(FEED_FIELDS, self._values(row))), ensure_ascii=False) + "\n"
+            chunk.append(line)
+            size += len(line)
+            if size >= FEED_CHUNK_SIZE:
+                yield "".join(chunk).encode("utf-8")
+                chunk = []
+                size = 0
+        if chunk:
+            yield "".join(chunk).encode("utf-8")
+
+    @staticmethod
+    def gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Сжимать части на лету в поток gzip (Content-Encoding: gzip)"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    @staticmethod
+    def encode_watermark(created_at: datetime, entry_id: int) -> str:
+        """Отметка выгрузки - запись в виде <created_at ISO 8601>_<id>"""
+        return f"{created_at.isoformat()}_{entry_id}"
+
+    @staticmethod
+    def decode_watermark(since: str) -> Tuple[datetime, int]:
+        """
+        Разобрать отметку выгрузки: <created_at>_<id> или только время
+        (тогда выгружаются записи, созданные позже него)
+
+        Raises:
+            ValueError: Отметка испорчена
+        """
+        created_at, _, entry_id = since.partition("_")
+        return datetime.fromisoformat(created_at), int(entry_id) if entry_id else 2 ** 31 - 1
+
+    @staticmethod
+    def _values(row) -> list:
+        values = []
+        for field in FEED_FIELDS:
+            value = getattr(row, field)
+            if isinstance(value, (date, datetime)):
+                value = value.isoformat()
+            values.append(value)
+        return values
+
+
+journal_feed_service = JournalFeedService()
@@ -1,6 +1,6 @@
 import asyncio
 import httpx
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Callable, Awaitable
 from datetime import datetime
 from app.core.config import settings
 
@@ -360,13 +360,19 @@ class KaitenService:
         print(f"[Kaiten API] No executor (type=2) found for card {card_id}")
         return None
 
-    async def poll_cards(self, column_name: str, interval: int = None):
+    async def poll_cards(
+        self,
+        column_name: str,
+        interval: int = None,
+        on_cards: Optional[Callable[[List[Dict]], Awaitable[None]]] = None
+    ):
         """
         Polling карточек из колонки
 
         Args:
             column_name: Название колонки для polling
             interval: Интервал опроса в секундах (по умолчанию из настроек)
+            on_cards: Обработчик полученных карточек (например, предпроверка шаблонов)
         """
         if interval is None:
             interval = settings.KAITEN_POLL_INTERVAL
@@ -374,6 +380,11 @@ class KaitenService:
         while True:
             cards = await self.get_cards_from_column(column_name)
             print(f"[Polling] Found {len(cards)} cards in '{column_name}'")
+            if on_cards:
+                try:
+                    await on_cards(cards)
+                except Exception as e:
+                    print(f"[Polling] Error processing cards from '{column_name}': {e}")
             # TODO: Отправить карточки через WebSocket или другой механизм
             await asyncio.sleep(interval)
 
@@ -0,0 +1,277 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Optional
+from sqlalchemy import func, or_, and_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.outbox_journal import OutboxJournal
+from app.models.outgoing_number import OutgoingNumberCounter, NumberReservation
+
+
+# Область сквозной (не сбрасываемой ежегодно) нумерации
+ALL_SCOPE = "all"
+
+
+class NumberReservationError(RuntimeError):
+    """Резерв номера недействителен (истёк и номер передан другому документу)"""
+
+
+class NumberingService:
+    """
+    Сервис выдачи исходящих номеров.
+
+    Номер берётся из строки-счётчика под блокировкой (SELECT ... FOR UPDATE),
+    поэтому параллельные регистрации не получают одинаковый номер, а выдача
+    не зависит от размера журнала. Выданный номер резервируется на время
+    подписания; брошенные (истёкшие или освобождённые) резервы выдаются
+    повторно, чтобы в нумерации не было пропусков.
+    """
+
+    def __init__(self):
+        self.reservation_ttl = timedelta(minutes=settings.NUMBER_RESERVATION_TTL_MINUTES)
+
+    def format_number(self, numbering_rule: Dict, number: int) -> str:
+        """
+        Отформатировать номер согласно правилу нумерации (например, 42-10)
+
+        Args:
+            numbering_rule: Правило нумерации исполнителя
+            number: Числовая часть номера
+
+        Returns:
+            Форматированный номер
+        """
+        executor_code = numbering_rule.get('executor_code', '00')
+        number_format = numbering_rule.get('format', '{number}-{executor_code}')
+        return number_format.format(number=number, executor_code=executor_code)
+
+    def _year_range(self, year: int) -> tuple[date, date]:
+        """Полуоткрытый интервал дат [1 января, 1 января следующего года)"""
+        return date(year, 1, 1), date(year + 1, 1, 1)
+
+    def _journal_max(self, db: Session, scope: str) -> Optional[int]:
+        """Максимальный номер в журнале для области нумерации (только для инициализации счётчика)"""
+        query = db.query(func.max(OutboxJournal.outgoing_no))
+        if scope != ALL_SCOPE:
+            start, end = self._year_range(int(scope))
+            query = query.filter(
+                OutboxJournal.outgoing_date >= start,
+                OutboxJournal.outgoing_date < end
+            )
+        return query.scalar()
+
+    def _lock_counters(self, db: Session, year: int, start_number: int) -> Dict[str, OutgoingNumberCounter]:
+        """
+        Заблокировать счётчики года и сквозной нумерации, создав их при необходимости
+
+        Args:
+            db: Сессия БД
+            year: Текущий год
+            start_number: Начальный номер из правила нумерации
+
+        Returns:
+            Словарь {scope: счётчик}
+        """
+        scopes = sorted([str(year), ALL_SCOPE])
+
+        # Создаём недостающие счётчики, начиная с текущего максимума журнала
+        existing = {
+            row.scope for row in
+            db.query(OutgoingNumberCounter.scope).filter(OutgoingNumberCounter.scope.in_(scopes))
+        }
+        for scope in scopes:
+            if scope not in existing:
+                seed = self._journal_max(db, scope) or (start_number - 1)
+                db.execute(
+                    insert(OutgoingNumberCounter)
+                    .values(scope=scope, last_number=seed)
+                    .on_conflict_do_nothing(index_elements=['scope'])
+                )
+
+        # Блокируем строки в постоянном порядке, чтобы избежать взаимоблокировок
+        counters = db.query(OutgoingNumberCounter).filter(
+            OutgoingNumberCounter.scope.in_(scopes)
+        ).order_by(OutgoingNumberCounter.scope).with_for_update().all()
+
+        return {counter.scope: counter for counter in counters}
+
+    def _reusable_filter(self, year: int):
+        """Условие для резервов, номер которых можно выдать повторно"""
+        return and_(
+            NumberReservation.year == year,
+            or_(
+                NumberReservation.status == "released",
+                and_(
+                    NumberReservation.status == "reserved",
+                    NumberReservation.expires_at < func.now()
+                )
+            )
+        )
+
+    def reserve_number(
+        self,
+        db: Session,
+        numbering_rule: Dict,
+        file_id: str,
+        card_id: Optional[int] = None
+    ) -> NumberReservation:
+        """
+        Выдать и зарезервировать следующий исходящий номер.
+        Резерв фиксируется вызывающим кодом через db.commit().
+
+        Args:
+            db: Сессия БД
+            numbering_rule: Правило нумерации исполнителя
+            file_id: ID подготовленных файлов, к которым привязан номер
+            card_id: ID карточки Kaiten
+
+        Returns:
+            Резерв номера
+        """
+        year = date.today().year
+        expires_at = datetime.now(timezone.utc) + self.reservation_ttl
+
+        # 1. Сначала повторно выдаём самый младший брошенный номер
+        reservation = db.query(NumberReservation).filter(
+            self._reusable_filter(year)
+        ).order_by(NumberReservation.outgoing_no).with_for_update(skip_locked=True).first()
+
+        if reservation:
+            print(f"[Numbering] Reusing abandoned number {reservation.outgoing_no} (year {year})")
+            reservation.formatted_number = self.format_number(numbering_rule, reservation.outgoing_no)
+            reservation.file_id = file_id
+            reservation.card_id = card_id
+            reservation.status = "reserved"
+            reservation.expires_at = expires_at
+            db.flush()
+            return reservation
+
+        # 2. Иначе берём следующий номер из счётчика
+        start_number = numbering_rule.get('start_number', 1)
+        counters = self._lock_counters(db, year, start_number)
+        year_counter = counters[str(year)]
+        all_counter = counters[ALL_SCOPE]
+
+        if numbering_rule.get('reset_yearly', False):
+            next_number = year_counter.last_number + 1
+        else:
+            next_number = all_counter.last_number + 1
+
+        year_counter.last_number = max(year_counter.last_number, next_number)
+        all_counter.last_number = max(all_counter.last_number, next_number)
+
+        reservation = NumberReservation(
+            year=year,
+            outgoing_no=next_number,
+            formatted_number=self.format_number(numbering_rule, next_number),
+            file_id=file_id,
+            card_id=card_id,
+            status="reserved",
+            expires_at=expires_at
+        )
+        db.add(reservation)
+        db.flush()
+
+        print(f"[Numbering] Reserved number {reservation.formatted_number} until {expires_at.isoformat()}")
+        return reservation
+
+    def peek_next_number(self, db: Session, numbering_rule: Dict) -> int:
+        """
+        Узнать номер, который будет выдан следующим (без резервирования)
+
+        Args:
+            db: Сессия БД
+            numbering_rule: Правило нумерации исполнителя
+
+        Returns:
+            Числовая часть следующего номера
+        """
+        year = date.today().year
+
+        reusable_no = db.query(func.min(NumberReservation.outgoing_no)).filter(
+            self._reusable_filter(year)
+        ).scalar()
+        if reusable_no is not None:
+            return reusable_no
+
+        scope = str(year) if numbering_rule.get('reset_yearly', False) else ALL_SCOPE
+        counter = db.query(OutgoingNumberCounter).filter(OutgoingNumberCounter.scope == scope).first()
+        if counter:
+            return counter.last_number + 1
+
+        start_number = numbering_rule.get('start_number', 1)
+        return (self._journal_max(db, scope) or (start_number - 1)) + 1
+
+    def commit_reservation(self, db: Session, file_id: str, outgoing_no: int) -> NumberReservation:
+        """
+        Закрепить зарезервированный номер за документом (при записи в журнал).
+        Изменения фиксируются вызывающим кодом вместе с записью журнала.
+
+        Args:
+            db: Сессия БД
+            file_id: ID подготовленных файлов
+            outgoing_no: Номер, с которым был подготовлен документ
+
+        Returns:
+            Закреплённый резерв
+
+        Raises:
+            NumberReservationError: Если резерв истёк и номер уже выдан другому документу
+        """
+        reservation = db.query(NumberReservation).filter(
+            NumberReservation.file_id == file_id
+        ).with_for_update().first()
+
+        if not reservation or reservation.outgoing_no != outgoing_no or reservation.status == "released":
+            raise NumberReservationError(
+                f"Резерв номера {outgoing_no} истёк и номер передан другому документу. "
+                f"Подготовьте регистрацию заново."
+            )
+
+        reservation.status = "committed"
+        db.flush()
+        return reservation
+
+    def release_reservation(self, db: Session, file_id: str) -> bool:
+        """
+        Освободить номер, если подписание отменено.
+        Освобождение фиксируется вызывающим кодом через db.commit().
+
+        Args:
+            db: Сессия БД
+            file_id: ID подготовленных файлов
+
+        Returns:
+            True если резерв освобождён, False если активного резерва нет
+        """
+        reservation = db.query(NumberReservation).filter(
+            NumberReservation.file_id == file_id,
+            NumberReservation.status == "reserved"
+        ).with_for_update().first()
+
+        if not reservation:
+            return False
+
+        reservation.status = "released"
+        db.flush()
+        print(f"[Numbering] Released number {reservation.formatted_number}")
+        return True
+
+    def sync_counters(self, db: Session, outgoing_no: int, outgoing_date: date):
+        """
+        Подтянуть счётчики после ручного добавления или изменения записи журнала,
+        чтобы следующий выданный номер не совпал с внесённым вручную
+
+        Args:
+            db: Сессия БД
+            outgoing_no: Числовая часть номера
+            outgoing_date: Дата записи
+        """
+        db.query(OutgoingNumberCounter).filter(
+            OutgoingNumberCounter.scope.in_([str(outgoing_date.year), ALL_SCOPE]),
+            OutgoingNumberCounter.last_number < outgoing_no
+        ).update({OutgoingNumberCounter.last_number: outgoing_no}, synchronize_session=False)
+
+
+# Singleton instance
+numbering_service = NumberingService()
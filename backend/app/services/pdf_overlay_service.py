@@ -0,0 +1,292 @@
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from app.services.docx_template import DocxTemplate
+from app.services.pdf_service import pdf_service
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+
+# Маркеры, которые подставляются вместо плейсхолдеров при однократной конвертации шаблона.
+# Маркеры шире типичных значений, чтобы номер и дата поместились на их место
+MARKERS = {
+    'outgoing_no': "XQNOQX",
+    'outgoing_date': "XQDATEQQQX",
+    'stamp': "XQSTAMPQX",
+}
+
+# Максимальное число закэшированных макетов шаблонов и штампов
+MAX_CACHED_LAYOUTS = 32
+
+
+class PdfOverlayService:
+    """
+    Быстрая подготовка PDF без LibreOffice при каждой регистрации.
+
+    Шаблон конвертируется в PDF один раз с маркерами вместо плейсхолдеров,
+    положение маркеров запоминается. При регистрации номер, дата и штамп
+    рисуются поверх закэшированного PDF. Если маркеры не удалось надёжно
+    найти или значение не помещается на место маркера, возвращается None
+    и вызывающий код выполняет полную конвертацию.
+    """
+
+    def __init__(self):
+        self.available = fitz is not None
+        if not self.available:
+            print("[PdfOverlayService] WARNING: PyMuPDF not installed, overlay mode disabled")
+        self._layouts: OrderedDict[str, Optional[Dict]] = OrderedDict()  # {sha256 шаблона: макет}
+        self._stamps: OrderedDict[str, Optional[Dict]] = OrderedDict()  # {ключ штампа: PDF штампа}
+        self._lock = threading.Lock()
+
+    def _cache_get(self, cache: OrderedDict, key: str):
+        with self._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return True, cache[key]
+        return False, None
+
+    def _cache_put(self, cache: OrderedDict, key: str, value):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > MAX_CACHED_LAYOUTS:
+                cache.popitem(last=False)
+
+    def _find_markers(self, pdf_bytes: bytes) -> Dict[str, List[Dict]]:
+        """
+        Найти маркеры в PDF по символам (rawdict), вместе со шрифтом и базовой линией
+
+        Returns:
+            {имя плейсхолдера: [{'page', 'rect', 'origin', 'size', 'font', 'flags', 'color'}]}
+        """
+        found: Dict[str, List[Dict]] = {name: [] for name in MARKERS}
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            for page_index, page in enumerate(doc):
+                for block in page.get_text("rawdict")["blocks"]:
+                    for line in block.get("lines", []):
+                        for span in line["spans"]:
+                            chars = span["chars"]
+                            text = "".join(char["c"] for char in chars)
+                            for name, marker in MARKERS.items():
+                                start = text.find(marker)
+                                while start != -1:
+                                    marker_chars = chars[start:start + len(marker)]
+                                    rect = fitz.Rect(marker_chars[0]["bbox"])
+                                    for char in marker_chars[1:]:
+                                        rect |= fitz.Rect(char["bbox"])
+                                    found[name].append({
+                                        'page': page_index,
+                                        'rect': tuple(rect),
+                                        'origin': tuple(marker_chars[0]["origin"]),
+                                        'size': span["size"],
+                                        'font': span["font"],
+                                        'flags': span["flags"],
+                                        'color': span["color"],
+                                    })
+                                    start = text.find(marker, start + len(marker))
+        return found
+
+    def prepare_layout(self, template: DocxTemplate, stamp: Optional[Dict] = None) -> Optional[Dict]:
+        """
+        Один раз сконвертировать шаблон с маркерами и запомнить их положение
+
+        Args:
+            template: Разобранный шаблон DOCX
+            stamp: Визуализация ЭЦП (нужна, чтобы разместить маркер штампа так же, как штамп)
+
+        Returns:
+            Макет {'pdf': bytes, 'markers': {...}} или None, если маркеры не найдены надёжно
+        """
+        if not self.available:
+            return None
+
+        image_stamp = bool(stamp and stamp.get('image'))
+        key = hashlib.sha256(template.docx_bytes + (b"image" if image_stamp else b"lines")).hexdigest()
+        cached, layout = self._cache_get(self._layouts, key)
+        if cached:
+            return layout
+
+        layout = None
+        try:
+            values = {'outgoing_no': MARKERS['outgoing_no'], 'outgoing_date': MARKERS['outgoing_date']}
+            if image_stamp:
+                # Изображение штампа вставляется без выравнивания - маркер на месте плейсхолдера
+                values['stamp'] = MARKERS['stamp']
+                marker_docx = template.render(values)
+            else:
+                # Текстовый штамп центрируется - маркер ставится так же
+                marker_docx = template.render(values, stamp={'lines': [{'text': MARKERS['stamp'], 'size': 10}]})
+
+            pdf_bytes = pdf_service.convert_docx_to_pdf(marker_docx)
+            markers = self._find_markers(pdf_bytes)
+
+            # Каждый плейсхолдер шаблона должен найтись ровно столько раз, сколько он встречается
+            reliable = all(
+                len(markers[name]) == template.placeholder_counts.get(name, 0)
+                for name in MARKERS
+            )
+            if reliable:
+                layout = {'pdf': pdf_bytes, 'markers': markers, 'image_stamp': image_stamp}
+            else:
+                counts = {name: len(found) for name, found in markers.items()}
+                print(f"[PdfOverlayService] Markers not located reliably: {counts}, expected {dict(template.placeholder_counts)}")
+        except Exception as e:
+            print(f"[PdfOverlayService] Error preparing layout: {e}")
+
+        self._cache_put(self._layouts, key, layout)
+        return layout
+
+    def _stamp_pdf(self, stamp: Dict) -> Optional[Dict]:
+        """
+        Сконвертировать штамп в отдельный PDF один раз и обрезать по содержимому
+
+        Returns:
+            {'pdf': bytes, 'clip': (x0, y0, x1, y1)} или None
+        """
+        if stamp.get('key'):
+            # Штамп из кэша stamp_service уже идентифицирован сертификатом
+            key = "stamp:" + stamp['key']
+        elif stamp.get('image'):
+            key = "image:" + hashlib.sha256(stamp['image']).hexdigest()
+        else:
+            key = "lines:" + "\n".join(line['text'] for line in stamp.get('lines', []))
+
+        cached, stamp_pdf = self._cache_get(self._stamps, key)
+        if cached:
+            return stamp_pdf
+
+        stamp_pdf = None
+        try:
+            from docx import Document
+
+            doc = Document()
+            doc.add_paragraph('{{stamp}}')
+            output = io.BytesIO()
+            doc.save(output)
+
+            stamp_docx = DocxTemplate(output.getvalue()).render({}, stamp=stamp)
+            pdf_bytes = pdf_service.convert_docx_to_pdf(stamp_docx)
+
+            with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf:
+                page = pdf[0]
+                clip = None
+                for block in page.get_text("dict")["blocks"]:
+                    rect = fitz.Rect(block["bbox"])
+                    clip = rect if clip is None else clip | rect
+            if clip is not None and not clip.is_empty:
+                stamp_pdf = {'pdf': pdf_bytes, 'clip': tuple(clip)}
+        except Exception as e:
+            print(f"[PdfOverlayService] Error rendering stamp: {e}")
+
+        self._cache_put(self._stamps, key, stamp_pdf)
+        return stamp_pdf
+
+    @staticmethod
+    def _base14_font(span_font: str, flags: int) -> str:
+        """Подобрать стандартный шрифт PDF, близкий к шрифту маркера"""
+        name = span_font.lower()
+        bold = bool(flags & 16)
+        if "courier" in name or "mono" in name:
+            return "cobo" if bold else "cour"
+        if "times" in name or ("serif" in name and "sans" not in name):
+            return "tibo" if bold else "tiro"
+        return "hebo" if bold else "helv"
+
+    def render(
+        self,
+        template: DocxTemplate,
+        outgoing_no: str,
+        outgoing_date: str,
+        stamp: Optional[Dict] = None
+    ) -> Optional[bytes]:
+        """
+        Подготовить PDF регистрации наложением номера, даты и штампа на закэшированный макет
+
+        Args:
+            template: Разобранный шаблон DOCX
+            outgoing_no: Исходящий номер (например, "42-10")
+            outgoing_date: Дата в формате ДД.ММ.ГГГГ
+            stamp: Визуализация ЭЦП
+
+        Returns:
+            Содержимое PDF или None, если нужна полная конвертация
+        """
+        layout = self.prepare_layout(template, stamp)
+        if not layout:
+            return None
+
+        values = {'outgoing_no': outgoing_no, 'outgoing_date': outgoing_date}
+        # Стандартные шрифты PDF поддерживают только Latin-1
+        if any(ord(char) > 255 for value in values.values() for char in value):
+            return None
+
+        stamp_pdf = None
+        if layout['markers']['stamp']:
+            if not stamp:
+                return None
+            stamp_pdf = self._stamp_pdf(stamp)
+            if not stamp_pdf:
+                return None
+
+        try:
+            with fitz.open(stream=layout['pdf'], filetype="pdf") as doc:
+                # 1. Стираем все маркеры
+                for name, occurrences in layout['markers'].items():
+                    for marker in occurrences:
+                        page = doc[marker['page']]
+                        page.add_redact_annot(fitz.Rect(marker['rect']), fill=(1, 1, 1))
+                for page in doc:
+                    page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE)
+
+                # 2. Пишем номер и дату на место маркеров
+                for name, value in values.items():
+                    for marker in layout['markers'][name]:
+                        rect = fitz.Rect(marker['rect'])
+                        font = self._base14_font(marker['font'], marker['flags'])
+                        if fitz.get_text_length(value, fontname=font, fontsize=marker['size']) > rect.width:
+                            print(f"[PdfOverlayService] Value '{value}' does not fit marker of '{name}'")
+                            return None
+                        color = marker['color']
+                        doc[marker['page']].insert_text(
+                            marker['origin'],
+                            value,
+                            fontname=font,
+                            fontsize=marker['size'],
+                            color=((color >> 16 & 255) / 255, (color >> 8 & 255) / 255, (color & 255) / 255)
+                        )
+
+                # 3. Накладываем штамп, если под ним свободное место
+                if stamp_pdf:
+                    with fitz.open(stream=stamp_pdf['pdf'], filetype="pdf") as stamp_doc:
+                        clip = fitz.Rect(stamp_pdf['clip'])
+                        for marker in layout['markers']['stamp']:
+                            page = doc[marker['page']]
+                            rect = fitz.Rect(marker['rect'])
+                            if layout['image_stamp']:
+                                x0 = rect.x0
+                            else:
+                                x0 = (rect.x0 + rect.x1 - clip.width) / 2
+                            target = fitz.Rect(x0, rect.y0, x0 + clip.width, rect.y0 + clip.height)
+                            if not page.rect.contains(target):
+                                return None
+                            # Допуск 1pt на соприкосновение с соседними строками
+                            inner = fitz.Rect(target.x0 + 1, target.y0 + 1, target.x1 - 1, target.y1 - 1)
+                            for word in page.get_text("words"):
+                                if fitz.Rect(word[:4]).intersects(inner):
+                                    print("[PdfOverlayService] Stamp area is not free, falling back")
+                                    return None
+                            page.show_pdf_page(target, stamp_doc, 0, clip=clip)
+
+                return doc.tobytes(garbage=3, deflate=True)
+        except Exception as e:
+            print(f"[PdfOverlayService] Overlay error, falling back to full conversion: {e}")
+            return None
+
+
+# Singleton instance
+pdf_overlay_service = PdfOverlayService()
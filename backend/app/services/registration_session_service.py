@@ -0,0 +1,161 @@
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from app.models.registration_session import RegistrationSession
+
+
+class RegistrationSessionService:
+    """
+    Сервис сессий регистрации.
+
+    Сессия создаётся при подготовке документа и ищется по первичному ключу
+    (file_id) на каждом следующем шаге - без перебора temp_files и без повторного
+    запроса карточки Kaiten. Данные журнала (номер, "Кому", исполнитель) берутся
+    из сессии, а не из запроса клиента.
+    """
+
+    def create(self, db: Session, **fields) -> RegistrationSession:
+        """
+        Создать сессию подготовленного документа (фиксируется вызывающим кодом)
+
+        Args:
+            db: Сессия БД
+            **fields: Поля RegistrationSession
+
+        Returns:
+            Созданная сессия
+        """
+        session = RegistrationSession(status="prepared", **fields)
+        db.add(session)
+        db.flush()
+        return session
+
+    def get(self, db: Session, file_id: str, for_update: bool = False) -> Optional[RegistrationSession]:
+        """
+        Получить сессию по file_id
+
+        Args:
+            db: Сессия БД
+            file_id: ID подготовленных файлов
+            for_update: Заблокировать строку до конца транзакции (финализация);
+                уже загруженная сессия перечитывается - статус проверяется по строке под блокировкой
+
+        Returns:
+            Сессия или None
+        """
+        query = db.query(RegistrationSession).filter(RegistrationSession.file_id == file_id)
+        if for_update:
+            query = query.with_for_update().populate_existing()
+        return query.first()
+
+    def get_batch(self, db: Session, batch_id: str) -> List[RegistrationSession]:
+        """Сессии документов пакета подписания"""
+        return db.query(RegistrationSession).filter(
+            RegistrationSession.batch_id == batch_id
+        ).order_by(RegistrationSession.created_at).all()
+
+    def get_many(self, db: Session, file_ids: Iterable[str]) -> List[RegistrationSession]:
+        """Сессии по списку file_id (для обхода temp_files)"""
+        file_ids = list(file_ids)
+        if not file_ids:
+            return []
+        return db.query(RegistrationSession).filter(RegistrationSession.file_id.in_(file_ids)).all()
+
+    def get_stale(self, db: Session, created_before: datetime) -> List[RegistrationSession]:
+        """
+        Неподписанные сессии, созданные раньше указанного момента (без блокировки:
+        перед истечением сессия перечитывается через get(for_update=True))
+        """
+        return db.query(RegistrationSession).filter(
+            RegistrationSession.status == "prepared",
+            RegistrationSession.created_at < created_before
+        ).all()
+
+    def mark_expired(self, db: Session, session: RegistrationSession):
+        """Отметить неподписанную сессию истёкшей (фиксируется вызывающим кодом)"""
+        session.status = "expired"
+        db.flush()
+
+    def get_signed_due(self, db: Session, now: datetime) -> List[str]:
+        """file_id подписанных документов, ожидающих фоновой финализации (без отложенных повторов)"""
+        rows = db.query(RegistrationSession.file_id).filter(
+            RegistrationSession.status == "signed",
+            or_(RegistrationSession.finalize_next_at.is_(None), RegistrationSession.finalize_next_at <= now)
+        ).order_by(RegistrationSession.signed_at).all()
+        return [row.file_id for row in rows]
+
+    def mark_signed(
+        self,
+        db: Session,
+        session: RegistrationSession,
+        sig_path: str,
+        sig_status: str,
+        cn: str,
+        thumbprint: str
+    ):
+        """
+        Отметить подпись принятой: дальше документ финализируется в фоне
+        (фиксируется вызывающим кодом вместе с закреплением номера)
+
+        Args:
+            db: Сессия БД
+            session: Сессия регистрации в статусе "prepared"
+            sig_path: Где сохранена подпись
+            sig_status: Результат проверки подписи
+            cn: Common Name владельца сертификата
+            thumbprint: Отпечаток сертификата
+        """
+        session.status = "signed"
+        session.sig_path = sig_path
+        session.sig_status = sig_status
+        session.signer_cn = cn
+        session.signer_thumbprint = thumbprint
+        session.signed_at = datetime.now(timezone.utc)
+        session.finalize_stage = None
+        session.finalize_attempts = 0
+        session.finalize_error = None
+        session.finalize_next_at = None
+        db.flush()
+
+    def mark_retry(self, db: Session, file_id: str) -> Optional[RegistrationSession]:
+        """
+        Вернуть документ со статусом "failed" в очередь финализации (счётчик попыток сбрасывается)
+
+        Returns:
+            Сессия или None, если документ не в статусе "failed"
+        """
+        session = self.get(db, file_id, for_update=True)
+        if not session or session.status != "failed":
+            return None
+        session.status = "signed"
+        session.finalize_attempts = 0
+        session.finalize_next_at = None
+        db.flush()
+        return session
+
+    def mark_finalized(self, db: Session, session: RegistrationSession, journal_entry_id: int, sig_path: str):
+        """Отметить документ записанным в журнал (фиксируется вместе с записью журнала)"""
+        session.status = "finalized"
+        session.finalize_error = None
+        session.finalize_next_at = None
+        session.journal_entry_id = journal_entry_id
+        session.sig_path = sig_path
+        db.flush()
+
+    def mark_released(self, db: Session, file_id: str) -> bool:
+        """
+        Отметить подготовку отменённой (номер освобождён)
+
+        Returns:
+            True если сессия была в статусе "prepared"
+        """
+        session = self.get(db, file_id, for_update=True)
+        if not session or session.status != "prepared":
+            return False
+        session.status = "released"
+        db.flush()
+        return True
+
+
+registration_session_service = RegistrationSessionService()
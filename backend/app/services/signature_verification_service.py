@@ -0,0 +1,371 @@
+import asyncio
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.database import AsyncSessionLocal
+from app.models.outbox_journal import OutboxJournal
+from app.models.signature_verification import SignatureVerification
+from app.services.blob_service import blob_service
+from app.services.cryptopro_service import cryptopro_service
+
+try:
+    from asn1crypto import cms
+except ImportError:
+    cms = None
+
+
+# Максимальное число результатов проверки в памяти
+MAX_CACHED_RESULTS = 4096
+
+# Записей журнала на одну порцию массовой проверки
+VERIFY_CHUNK_SIZE = 50
+
+
+class SignatureVerificationService:
+    """
+    Проверка отсоединённых подписей CAdES-BES (.sig) документов журнала.
+
+    Подпись сначала разбирается как CMS SignedData: структура, подписант и
+    хэш документа в подписанных атрибутах (если алгоритм хэширования
+    поддерживается hashlib). Затем, если установлен КриптоПро, подпись
+    полностью проверяется через cryptcp. Результат кэшируется по паре
+    (SHA-256 PDF, SHA-256 подписи) в памяти и в таблице
+    signature_verifications, поэтому повторная проверка того же файла
+    не запускает cryptcp.
+
+    Статусы: valid - подпись верна; invalid - подпись не соответствует
+    документу или повреждена; unverified - структура и хэш верны, но
+    криптографическая проверка недоступна (КриптоПро не установлен);
+    error - проверку не удалось выполнить (например, таймаут cryptcp).
+    """
+
+    def __init__(self):
+        self._cache: OrderedDict[Tuple[str, str], Dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict] = {}  # {ID задачи массовой проверки: состояние}
+        self._tasks: Set[asyncio.Task] = set()  # Выполняющиеся задачи (цикл событий держит на них только слабые ссылки)
+        if cms is None:
+            print("[SignatureVerification] WARNING: asn1crypto not installed, CMS structure checks disabled")
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        """SHA-256 содержимого (ключ кэша)"""
+        return hashlib.sha256(data).hexdigest()
+
+    def _remember(self, key: Tuple[str, str], result: Dict):
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > MAX_CACHED_RESULTS:
+                self._cache.popitem(last=False)
+
+    def _check_structure(self, pdf_bytes: bytes, sig_bytes: bytes, known_digests: Optional[Dict[str, str]] = None) -> Dict:
+        """
+        Разобрать подпись как CMS SignedData и сверить хэш документа
+
+        Args:
+            pdf_bytes: Содержимое PDF
+            sig_bytes: Содержимое подписи .sig
+            known_digests: Заранее вычисленные хэши документа {OID алгоритма: hex}
+                (ГОСТ Р 34.11-2012, которого нет в hashlib)
+
+        Returns:
+            {'status': 'valid' | 'invalid' | 'unverified', 'signer', 'error'};
+            'valid' означает, что хэш документа совпал и подпись можно проверять cryptcp
+        """
+        if cms is None:
+            return {'status': 'unverified', 'signer': None, 'error': "asn1crypto не установлен"}
+
+        try:
+            content_info = cms.ContentInfo.load(sig_bytes)
+            if content_info['content_type'].native != 'signed_data':
+                return {'status': 'invalid', 'signer': None, 'error': "Файл не является подписью CMS SignedData"}
+
+            signed_data = content_info['content']
+            if signed_data['encap_content_info']['content'].native is not None:
+                return {'status': 'invalid', 'signer': None, 'error': "Подпись не отсоединённая"}
+
+            signer_infos = signed_data['signer_infos']
+            if not len(signer_infos):
+                return {'status': 'invalid', 'signer': None, 'error': "В подписи нет подписантов"}
+
+            certificates = {}
+            for certificate in signed_data['certificates'] or []:
+                if certificate.name == 'certificate':
+                    tbs = certificate.chosen['tbs_certificate']
+                    certificates[(tbs['issuer'].dump(), tbs['serial_number'].native)] = certificate.chosen
+
+            signer = None
+            digest_checked = False
+            for signer_info in signer_infos:
+                sid = signer_info['sid']
+                if sid.name == 'issuer_and_serial_number':
+                    certificate = certificates.get((sid.chosen['issuer'].dump(), sid.chosen['serial_number'].native))
+                    if certificate is not None and signer is None:
+                        signer = certificate.subject.native.get('common_name')
+
+                signed_attrs = signer_info['signed_attrs']
+                if not signed_attrs:
+                    continue
+                message_digest = None
+                for attribute in signed_attrs:
+                    if attribute['type'].native == 'message_digest':
+                        message_digest = attribute['values'][0].native
+                if message_digest is None:
+                    return {'status': 'invalid', 'signer': signer, 'error': "Нет атрибута messageDigest"}
+
+                # ГОСТ Р 34.11-2012 в hashlib отсутствует - сверяем с заранее вычисленным хэшем,
+                # иначе такой хэш проверяет только cryptcp
+                algorithm_id = signer_info['digest_algorithm']['algorithm']
+                known_digest = (known_digests or {}).get(algorithm_id.dotted)
+                algorithm = algorithm_id.native
+                if known_digest:
+                    if bytes.fromhex(known_digest) != message_digest:
+                        return {'status': 'invalid', 'signer': signer, 'error': "Хэш документа не совпадает с подписью"}
+                    digest_checked = True
+                elif algorithm in hashlib.algorithms_available:
+                    if hashlib.new(algorithm, pdf_bytes).digest() != message_digest:
+                        return {'status': 'invalid', 'signer': signer, 'error': "Хэш документа не совпадает с подписью"}
+                    digest_checked = True
+
+            return {
+                'status': 'valid' if digest_checked else 'unverified',
+                'signer': signer,
+                'error': None if digest_checked else "Хэш документа проверяется только КриптоПро"
+            }
+        except Exception as e:
+            return {'status': 'invalid', 'signer': None, 'error': f"Повреждённая подпись: {e}"}
+
+    async def verify_many(
+        self,
+        db: AsyncSession,
+        documents: List[Tuple[bytes, bytes]],
+        force: bool = False,
+        known_digests: Optional[List[Optional[Dict[str, str]]]] = None
+    ) -> List[Dict]:
+        """
+        Проверить подписи нескольких документов (с кэшем и пакетным cryptcp)
+
+        Args:
+            db: Асинхронная сессия БД (кэш результатов сохраняется вызывающим кодом через db.commit())
+            documents: Пары (содержимое PDF, содержимое подписи .sig)
+            force: Проверить заново, игнорируя кэш
+            known_digests: Заранее вычисленные хэши ГОСТ документов {OID: hex} (в порядке документов)
+
+        Returns:
+            Результаты в порядке документов: [{'status', 'method', 'signer', 'error', 'checked_at'}]
+        """
+        keys = await asyncio.to_thread(
+            lambda: [(self.digest(pdf_bytes), self.digest(sig_bytes)) for pdf_bytes, sig_bytes in documents]
+        )
+        results: List[Optional[Dict]] = [None] * len(documents)
+
+        # 1. Кэш в памяти и в БД
+        if not force:
+            with self._lock:
+                for index, key in enumerate(keys):
+                    if key in self._cache:
+                        results[index] = self._cache[key]
+
+            missing = list({key for index, key in enumerate(keys) if results[index] is None})
+            if missing:
+                rows = (await db.scalars(select(SignatureVerification).where(
+                    tuple_(SignatureVerification.pdf_sha256, SignatureVerification.sig_sha256).in_(missing)
+                ))).all()
+                stored = {
+                    (row.pdf_sha256, row.sig_sha256): {
+                        'status': row.status,
+                        'method': row.method,
+                        'signer': row.signer,
+                        'error': row.error,
+                        'checked_at': row.checked_at.isoformat() if row.checked_at else None
+                    }
+                    for row in rows
+                }
+                for index, key in enumerate(keys):
+                    if results[index] is None and key in stored:
+                        results[index] = stored[key]
+                        self._remember(key, stored[key])
+
+        pending = [index for index, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        # 2. Разбор CMS и сверка хэша
+        checks = await asyncio.to_thread(
+            lambda: {
+                index: self._check_structure(*documents[index], known_digests[index] if known_digests else None)
+                for index in pending
+            }
+        )
+
+        # 3. Полная проверка cryptcp для подписей с корректной структурой
+        to_cryptcp = [index for index in pending if checks[index]['status'] != 'invalid']
+        if to_cryptcp and not cryptopro_service.use_mock:
+            verified = await cryptopro_service.verify_batch([documents[index] for index in to_cryptcp])
+            for index, outcome in zip(to_cryptcp, verified):
+                check = checks[index]
+                check['method'] = 'cryptcp'
+                if outcome['valid']:
+                    check.update({'status': 'valid', 'error': None})
+                elif 'timeout' in (outcome['error'] or ''):
+                    check.update({'status': 'error', 'error': outcome['error']})
+                else:
+                    check.update({'status': 'invalid', 'error': outcome['error']})
+
+        checked_at = datetime.now(timezone.utc)
+        for index in pending:
+            check = checks[index]
+            if check.get('method') != 'cryptcp' and check['status'] == 'valid':
+                # Хэш совпал, но сама подпись без КриптоПро не проверена
+                check.update({'status': 'unverified', 'error': "Проверены только структура подписи и хэш документа"})
+            result = {
+                'status': check['status'],
+                'method': check.get('method', 'structure'),
+                'signer': check['signer'],
+                'error': (check['error'] or '')[:500] or None,
+                'checked_at': checked_at.isoformat()
+            }
+            results[index] = result
+            if result['status'] == 'error':
+                continue  # Временные ошибки не кэшируются
+            self._remember(keys[index], result)
+            values = dict(
+                pdf_sha256=keys[index][0],
+                sig_sha256=keys[index][1],
+                status=result['status'],
+                method=result['method'],
+                signer=result['signer'],
+                error=result['error'],
+                checked_at=checked_at
+            )
+            await db.execute(
+                insert(SignatureVerification).values(**values).on_conflict_do_update(
+                    index_elements=['pdf_sha256', 'sig_sha256'],
+                    set_={name: value for name, value in values.items() if name not in ('pdf_sha256', 'sig_sha256')}
+                )
+            )
+
+        return results
+
+    async def verify(
+        self,
+        db: AsyncSession,
+        pdf_bytes: bytes,
+        sig_bytes: bytes,
+        force: bool = False,
+        known_digests: Optional[Dict[str, str]] = None
+    ) -> Dict:
+        """
+        Проверить подпись одного документа
+
+        Args:
+            db: Асинхронная сессия БД
+            pdf_bytes: Содержимое PDF
+            sig_bytes: Содержимое подписи .sig
+            force: Проверить заново, игнорируя кэш
+            known_digests: Заранее вычисленные хэши ГОСТ документа {OID: hex}
+
+        Returns:
+            Результат {'status', 'method', 'signer', 'error', 'checked_at'}
+        """
+        return (await self.verify_many(db, [(pdf_bytes, sig_bytes)], force, [known_digests]))[0]
+
+    def start_year_job(self, year: int, force: bool = False) -> Dict:
+        """
+        Запустить фоновую проверку подписей всех записей журнала за год
+
+        Args:
+            year: Год
+            force: Перепроверить и уже проверенные записи
+
+        Returns:
+            Состояние задачи
+        """
+        for job in self._jobs.values():
+            if job['year'] == year and job['status'] == 'running':
+                return job
+
+        job = {
+            'job_id': str(uuid.uuid4()),
+            'year': year,
+            'status': 'running',
+            'total': 0,
+            'processed': 0,
+            'counts': {},
+            'started_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'error': None
+        }
+        self._jobs[job['job_id']] = job
+        task = asyncio.create_task(self._run_year_job(job, force))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Получить состояние задачи массовой проверки"""
+        return self._jobs.get(job_id)
+
+    async def _run_year_job(self, job: Dict, force: bool):
+        """Проверить подписи записей журнала за год порциями, сохраняя статус в sig_status"""
+        db = AsyncSessionLocal()
+        try:
+            query = select(OutboxJournal.id).where(
+                OutboxJournal.outgoing_date >= date(job['year'], 1, 1),
+                OutboxJournal.outgoing_date < date(job['year'] + 1, 1, 1),
+                or_(OutboxJournal.sig_sha256.isnot(None), OutboxJournal.sig_blob.isnot(None))
+            )
+            if not force:
+                # Повторяем только непроверенные и проверки, завершившиеся ошибкой
+                query = query.where(or_(OutboxJournal.sig_status.is_(None), OutboxJournal.sig_status == 'error'))
+            entry_ids = (await db.scalars(query.order_by(OutboxJournal.id))).all()
+            job['total'] = len(entry_ids)
+            print(f"[SignatureVerification] Verifying {len(entry_ids)} journal entries for {job['year']}")
+
+            for start in range(0, len(entry_ids), VERIFY_CHUNK_SIZE):
+                chunk_ids = entry_ids[start:start + VERIFY_CHUNK_SIZE]
+                rows = (await db.execute(select(
+                    OutboxJournal.id,
+                    OutboxJournal.file_sha256,
+                    OutboxJournal.sig_sha256,
+                    OutboxJournal.file_blob,
+                    OutboxJournal.sig_blob
+                ).where(OutboxJournal.id.in_(chunk_ids)))).all()
+
+                documents = await asyncio.to_thread(lambda: [
+                    (
+                        blob_service.resolve(row.file_sha256, row.file_blob) or b"",
+                        blob_service.resolve(row.sig_sha256, row.sig_blob)
+                    )
+                    for row in rows
+                ])
+                results = await self.verify_many(db, documents, force)
+                for row, result in zip(rows, results):
+                    await db.execute(update(OutboxJournal).where(OutboxJournal.id == row.id).values(
+                        sig_status=result['status'],
+                        sig_checked_at=datetime.now(timezone.utc)
+                    ))
+                    job['counts'][result['status']] = job['counts'].get(result['status'], 0) + 1
+                await db.commit()
+                job['processed'] += len(rows)
+
+            job['status'] = 'done'
+        except Exception as e:
+            await db.rollback()
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            print(f"[SignatureVerification] Year {job['year']} verification failed: {e}")
+        finally:
+            await db.close()
+            job['finished_at'] = datetime.now().isoformat()
+
+
+# Singleton instance
+signature_verification_service = SignatureVerificationService()
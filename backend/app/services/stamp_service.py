@@ -0,0 +1,137 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+from app.services.config_service import config_service
+from app.services.docx_template import STAMP_IMAGE_WIDTH_EMU, build_text_stamp_runs, png_size
+
+
+# Максимальное число закэшированных штампов (по одному на сертификат)
+MAX_CACHED_STAMPS = 64
+
+
+class StampService:
+    """
+    Реестр готовых визуализаций ЭЦП для {{stamp}}.
+
+    Штамп каждого сертификата строится один раз: изображение читается с
+    диска и его размер в EMU вычисляется заранее, runs текстового блока
+    собираются заранее. Кэш хранится по серийному номеру и сроку действия
+    сертификата, поэтому при смене сертификата (или его данных в
+    certificates.json) штамп строится заново. Изображения штампов:
+    static/stamps/<серийный номер>.png, иначе общее static/stamp.png.
+    """
+
+    def __init__(self):
+        self.static_path = Path(__file__).parent.parent / "static"
+        self.stamp_image_path = self.static_path / "stamp.png"
+        self.stamps_dir = self.static_path / "stamps"
+        self._stamps: OrderedDict[str, Dict] = OrderedDict()  # {ключ сертификата: штамп}
+        self._lock = threading.Lock()
+
+    def _certificate_data(self, certificate_data: Optional[Dict]) -> Dict:
+        """Дополнить данные сертификата данными из конфигурации пользователя"""
+        certificate_data = certificate_data or {}
+        configured = config_service.get_certificate_for_user(certificate_data.get('username', 'default'))
+        return {
+            field: certificate_data.get(field) or configured.get(field, '')
+            for field in ('serial', 'owner', 'valid_from', 'valid_to')
+        }
+
+    @staticmethod
+    def _stamp_key(certificate: Dict) -> str:
+        """Ключ кэша: серийный номер, владелец и срок действия сертификата"""
+        return "|".join(certificate[field] for field in ('serial', 'owner', 'valid_from', 'valid_to'))
+
+    def _read_image(self, serial: str) -> Optional[bytes]:
+        """Прочитать изображение штампа сертификата (или общее изображение)"""
+        for path in (self.stamps_dir / f"{serial}.png", self.stamp_image_path):
+            try:
+                if path.is_file():
+                    return path.read_bytes()
+            except Exception as e:
+                print(f"[StampService] Error reading stamp image {path}: {e}")
+        return None
+
+    def _build_stamp(self, certificate: Dict, key: str) -> Dict:
+        """
+        Построить штамп сертификата
+
+        Returns:
+            {'key', 'image', 'image_extent'} для изображения
+            или {'key', 'lines', 'runs'} для текстового штампа
+        """
+        image = self._read_image(certificate['serial'])
+        if image:
+            try:
+                width, height = png_size(image)
+                return {
+                    'key': hashlib.sha256(key.encode() + image).hexdigest(),
+                    'image': image,
+                    'image_extent': (STAMP_IMAGE_WIDTH_EMU, int(STAMP_IMAGE_WIDTH_EMU * height / width))
+                }
+            except Exception as e:
+                print(f"[StampService] Invalid stamp image for {certificate['serial']}: {e}")
+
+        lines = [
+            # Заголовок
+            {'text': 'ДОКУМЕНТ ПОДПИСАН ЭЛЕКТРОННОЙ ПОДПИСЬЮ', 'bold': True, 'size': 10},
+            # Данные сертификата
+            {'text': f"Сертификат {certificate['serial']}", 'size': 8},
+            {'text': f"Владелец {certificate['owner']}", 'size': 8},
+            {'text': f"Действителен с {certificate['valid_from']} по {certificate['valid_to']}", 'size': 8},
+        ]
+        return {
+            'key': hashlib.sha256(key.encode()).hexdigest(),
+            'lines': lines,
+            'runs': build_text_stamp_runs(lines)
+        }
+
+    def get_stamp(self, certificate_data: Optional[Dict] = None) -> Dict:
+        """
+        Получить визуализацию ЭЦП для сертификата (из кэша или построить)
+
+        Args:
+            certificate_data: Данные сертификата ('username', 'serial', 'owner',
+                'valid_from', 'valid_to'); недостающие поля берутся из certificates.json
+
+        Returns:
+            Штамп для DocxTemplate.render. Штамп общий для всех документов
+            и не должен изменяться вызывающим кодом
+        """
+        certificate = self._certificate_data(certificate_data)
+        key = self._stamp_key(certificate)
+
+        with self._lock:
+            stamp = self._stamps.get(key)
+            if stamp is not None:
+                self._stamps.move_to_end(key)
+                return stamp
+
+        stamp = self._build_stamp(certificate, key)
+        print(f"[StampService] Built stamp for certificate {certificate['serial']}")
+
+        with self._lock:
+            self._stamps[key] = stamp
+            while len(self._stamps) > MAX_CACHED_STAMPS:
+                self._stamps.popitem(last=False)
+        return stamp
+
+    def invalidate(self, serial: Optional[str] = None):
+        """
+        Сбросить закэшированные штампы (например, после замены изображения штампа)
+
+        Args:
+            serial: Серийный номер сертификата; None - сбросить все штампы
+        """
+        with self._lock:
+            if serial is None:
+                self._stamps.clear()
+            else:
+                for key in [key for key in self._stamps if key.split("|", 1)[0] == serial]:
+                    del self._stamps[key]
+
+
+# Singleton instance
+stamp_service = StampService()
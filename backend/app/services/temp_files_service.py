@@ -0,0 +1,233 @@
+import asyncio
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional
+from app.core.config import settings
+from app.models.database import SessionLocal
+from app.services.numbering_service import numbering_service
+from app.services.idempotency_service import idempotency_service
+from app.services.blob_service import blob_service
+from app.services.registration_session_service import registration_session_service
+
+
+# Директория для временных зарегистрированных файлов
+TEMP_FILES_DIR = Path(__file__).parent.parent.parent / "temp_files"
+TEMP_FILES_DIR.mkdir(exist_ok=True)
+
+# Файлы подготовленного документа начинаются с его file_id (uuid4)
+FILE_ID_PATTERN = re.compile(r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})_")
+
+# Служебные файлы, которые уборка не трогает
+KEEP_FILES = {"signatures.log"}
+
+
+class TempFilesJanitor:
+    """
+    Уборка temp_files.
+
+    Периодически (TEMP_FILES_CLEANUP_INTERVAL_SECONDS):
+    - неподписанные сессии старше TEMP_SESSION_TTL_HOURS истекают: номер
+      освобождается, файлы удаляются;
+    - файлы отменённых и истёкших сессий удаляются сразу, записанных в журнал - через
+      TEMP_FILES_KEEP_FINALIZED_MINUTES (они уже лежат в папке исходящих и в БД);
+      файлы документов, ожидающих фоновой финализации ("signed", "failed"), не трогаются;
+    - файлы без сессии (старые подготовки, обрывки) удаляются через TTL сессии;
+    - при превышении TEMP_FILES_QUOTA_MB удаляются самые старые документы;
+    - удаляются истёкшие ответы Idempotency-Key;
+    - из хранилища файлов журнала удаляются файлы без ссылок.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._metrics = {
+            'runs': 0,
+            'last_run_at': None,
+            'last_run_seconds': 0.0,
+            'dir_bytes': 0,
+            'dir_files': 0,
+            'expired_sessions': 0,
+            'removed_files': 0,
+            'removed_bytes': 0,
+            'quota_evictions': 0,
+            'errors': 0
+        }
+
+    def get_metrics(self) -> Dict:
+        """Метрики уборки и текущий размер temp_files"""
+        return {
+            **self._metrics,
+            'quota_bytes': settings.TEMP_FILES_QUOTA_MB * 1024 * 1024
+        }
+
+    async def run_forever(self):
+        """Фоновая задача: уборка с интервалом TEMP_FILES_CLEANUP_INTERVAL_SECONDS"""
+        print(f"[TempFiles] Janitor started (every {settings.TEMP_FILES_CLEANUP_INTERVAL_SECONDS}s)")
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._metrics['errors'] += 1
+                print(f"[TempFiles] Cleanup error: {e}")
+            await asyncio.sleep(settings.TEMP_FILES_CLEANUP_INTERVAL_SECONDS)
+
+    async def run_once(self) -> Dict:
+        """
+        Выполнить одну уборку (в отдельном потоке - работа с диском и БД блокирующая)
+
+        Returns:
+            Метрики после уборки
+        """
+        async with self._lock:
+            await asyncio.to_thread(self._cleanup)
+        return self.get_metrics()
+
+    def _scan(self) -> Dict[str, Dict]:
+        """
+        Сгруппировать файлы temp_files по документам
+
+        Returns:
+            {ключ: {'files': [(путь, размер)], 'size', 'mtime'}} - ключ это file_id
+            или имя файла, не относящегося к подготовленному документу
+        """
+        groups: Dict[str, Dict] = {}
+        with os.scandir(TEMP_FILES_DIR) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name in KEEP_FILES:
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                match = FILE_ID_PATTERN.match(entry.name)
+                key = match.group(1) if match else entry.name
+                group = groups.setdefault(key, {'files': [], 'size': 0, 'mtime': 0.0, 'file_id': bool(match)})
+                group['files'].append((Path(entry.path), stat.st_size))
+                group['size'] += stat.st_size
+                group['mtime'] = max(group['mtime'], stat.st_mtime)
+        return groups
+
+    def _remove(self, group: Dict) -> int:
+        """Удалить файлы документа, вернуть число освобождённых байт"""
+        removed = 0
+        for path, size in group['files']:
+            try:
+                path.unlink()
+                removed += size
+                self._metrics['removed_files'] += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[TempFiles] Could not remove {path.name}: {e}")
+        self._metrics['removed_bytes'] += removed
+        return removed
+
+    def _expire(self, db, file_id: str) -> bool:
+        """
+        Истечь неподписанную сессию и освободить её номер. Сессия перечитывается
+        под блокировкой строки: подпись, принятая после выборки сессий уборкой,
+        не затирается статусом "expired"
+
+        Returns:
+            True если сессия истекла, False если её уже подписали или отменили
+        """
+        session = registration_session_service.get(db, file_id, for_update=True)
+        if not session or session.status != "prepared":
+            db.rollback()
+            return False
+        registration_session_service.mark_expired(db, session)
+        numbering_service.release_reservation(db, file_id)
+        db.commit()
+        self._metrics['expired_sessions'] += 1
+        print(f"[TempFiles] Session {session.formatted_number} expired, number released")
+        return True
+
+    def _cleanup(self):
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        session_ttl = timedelta(hours=settings.TEMP_SESSION_TTL_HOURS)
+        keep_finalized = timedelta(minutes=settings.TEMP_FILES_KEEP_FINALIZED_MINUTES)
+
+        db = SessionLocal()
+        try:
+            # 1. Истекаем брошенные неподписанные сессии (даже если их файлов уже нет)
+            stale = [session.file_id for session in registration_session_service.get_stale(db, now - session_ttl)]
+            for file_id in stale:
+                self._expire(db, file_id)
+
+            # 2. Удаляем файлы завершённых сессий и файлы без сессии
+            groups = self._scan()
+            file_ids = [key for key, group in groups.items() if group['file_id']]
+            sessions = {
+                session.file_id: session
+                for session in registration_session_service.get_many(db, file_ids)
+            }
+
+            for key, group in list(groups.items()):
+                session = sessions.get(key)
+                modified = datetime.fromtimestamp(group['mtime'], timezone.utc)
+                if session is None:
+                    remove = now - modified > session_ttl
+                elif session.status in ("prepared", "signed", "failed"):
+                    remove = False
+                elif session.status in ("expired", "released"):
+                    remove = True
+                else:
+                    updated = _aware(session.updated_at or session.created_at) or modified
+                    remove = now - updated > keep_finalized
+                if remove:
+                    self._remove(group)
+                    del groups[key]
+
+            # 3. Квота: удаляем самые старые документы, пока не уложимся
+            quota = settings.TEMP_FILES_QUOTA_MB * 1024 * 1024
+            total = sum(group['size'] for group in groups.values())
+            if total > quota:
+                for key, group in sorted(groups.items(), key=lambda item: item[1]['mtime']):
+                    if total <= quota:
+                        break
+                    session = sessions.get(key)
+                    if session is not None and session.status in ("signed", "failed"):
+                        continue  # Подписанный документ ещё не записан в журнал
+                    if session is not None and session.status == "prepared" and not self._expire(db, key):
+                        continue  # Документ подписан после обхода
+                    total -= self._remove(group)
+                    del groups[key]
+                    self._metrics['quota_evictions'] += 1
+                print(f"[TempFiles] Quota enforced: {total} / {quota} bytes")
+
+            # 4. Истёкшие ответы Idempotency-Key
+            purged = idempotency_service.purge_expired(db)
+            db.commit()
+            if purged:
+                print(f"[TempFiles] Purged {purged} expired idempotency keys")
+
+            # 5. Файлы хранилища без ссылок (старше BLOB_GC_GRACE_HOURS)
+            collected = blob_service.collect_garbage(db)
+            if collected:
+                print(f"[TempFiles] Removed {collected} unreferenced blobs")
+
+            self._metrics['dir_bytes'] = sum(group['size'] for group in groups.values())
+            self._metrics['dir_files'] = sum(len(group['files']) for group in groups.values())
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+            self._metrics['runs'] += 1
+            self._metrics['last_run_at'] = now.isoformat()
+            self._metrics['last_run_seconds'] = round(time.monotonic() - started, 3)
+
+
+def _aware(value: Optional[datetime]) -> Optional[datetime]:
+    """Дата из БД с часовым поясом (без пояса считается UTC)"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+temp_files_janitor = TempFilesJanitor()
@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional
+from app.services.docx_service import docx_service
+from app.services.docx_template import DocxTemplate
+from app.services.file_service import file_service
+from app.services.pdf_overlay_service import pdf_overlay_service
+from app.services.stamp_service import stamp_service
+from app.core.config import settings
+
+
+class TemplateCheckService:
+    """
+    Сервис предварительной проверки шаблонов исходящих писем.
+
+    Фоновый polling колонки "На подпись" передаёт сюда новые карточки:
+    главный DOCX (исх_*.docx) скачивается и проверяется на наличие
+    плейсхолдеров заранее. Вердикт и разобранный шаблон кэшируются по
+    ID и версии файла Kaiten, поэтому регистрация начинается с уже
+    скачанного и проверенного шаблона. Ошибка проверки (недоступен Kaiten,
+    сбой сети) не кэшируется: файл проверяется снова при следующем опросе.
+    """
+
+    # Максимальное число одновременных скачиваний шаблонов
+    MAX_CONCURRENT_DOWNLOADS = 4
+
+    def __init__(self):
+        self._verdicts: Dict[str, Dict] = {}  # {ключ файла: вердикт}
+        self._templates: Dict[str, DocxTemplate] = {}  # {ключ файла: проверенный шаблон}
+        self._errors: Dict[str, Dict] = {}  # {ключ файла: последняя ошибка проверки} (до повторной проверки)
+        self._semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_DOWNLOADS)
+
+    def _file_key(self, file_info: Dict) -> str:
+        """Ключ кэша: ID файла Kaiten и его версия (дата изменения или размер)"""
+        file_id = file_info.get('id') or file_info.get('url') or file_info.get('path') or file_info.get('name')
+        version = file_info.get('updated') or file_info.get('version') or file_info.get('size') or ''
+        return f"{file_id}:{version}"
+
+    def find_template_file(self, card: Dict) -> Optional[Dict]:
+        """
+        Найти главный DOCX шаблон карточки (имя начинается с "исх_")
+
+        Args:
+            card: Данные карточки Kaiten
+
+        Returns:
+            Данные файла или None
+        """
+        for file_info in card.get('files', []) or []:
+            file_name = file_info.get('name', '')
+            if file_name.startswith("исх_") and file_name.lower().endswith(".docx"):
+                return file_info
+        return None
+
+    async def _check_file(self, file_info: Dict) -> Dict:
+        """Скачать и проверить шаблон, сохранив вердикт в кэш (ошибку - до следующей проверки)"""
+        key = self._file_key(file_info)
+        file_name = file_info.get('name', '')
+
+        async with self._semaphore:
+            # Файл мог быть проверен, пока задача ждала своей очереди
+            if key in self._verdicts:
+                return self._verdicts[key]
+
+            try:
+                if file_service.use_mock:
+                    docx_bytes = docx_service.create_mock_docx()
+                else:
+                    docx_url = file_info.get('url') or file_info.get('path')
+                    if not docx_url:
+                        raise ValueError("URL файла не найден")
+                    docx_bytes = await docx_service.download_docx_from_url(docx_url)
+
+                template = docx_service.parse_template(docx_bytes)
+                if template.has_placeholders():
+                    verdict = {'ready': True, 'message': "Готово к регистрации"}
+                    self._templates[key] = template
+                    # Заранее конвертируем шаблон для быстрого наложения номера и штампа
+                    if settings.PDF_OVERLAY_ENABLED:
+                        await asyncio.to_thread(
+                            pdf_overlay_service.prepare_layout,
+                            template,
+                            stamp_service.get_stamp()
+                        )
+                else:
+                    verdict = {
+                        'ready': False,
+                        'message': "Шаблон не содержит полей {{outgoing_no}}, {{outgoing_date}}, {{stamp}}"
+                    }
+            except Exception as e:
+                print(f"[TemplateCheck] Error checking '{file_name}': {e}")
+                verdict = {'ready': False, 'message': f"Не удалось проверить шаблон: {str(e)}"}
+                failed = True
+            else:
+                failed = False
+
+        verdict.update({
+            'file_name': file_name,
+            'checked_at': datetime.now().isoformat()
+        })
+        if failed:
+            # Ошибка может быть временной - вердикт не кэшируется, следующий опрос проверит файл снова
+            self._errors[key] = verdict
+        else:
+            self._verdicts[key] = verdict
+            self._errors.pop(key, None)
+        print(f"[TemplateCheck] '{file_name}': {verdict['message']}")
+        return verdict
+
+    async def validate_cards(self, cards: List[Dict]):
+        """
+        Проверить шаблоны карточек, которые ещё не проверялись в текущей версии
+        (или проверка которых завершилась ошибкой)
+
+        Args:
+            cards: Карточки колонки "На подпись"
+        """
+        active_keys = set()
+        pending: Dict[str, Dict] = {}
+
+        for card in cards:
+            file_info = self.find_template_file(card)
+            if not file_info:
+                continue
+            key = self._file_key(file_info)
+            active_keys.add(key)
+            if key not in self._verdicts:
+                pending[key] = file_info
+
+        if pending:
+            await asyncio.gather(*(self._check_file(file_info) for file_info in pending.values()))
+
+        # Убираем из кэша карточки, ушедшие из колонки, и старые версии файлов
+        for key in set(self._verdicts) | set(self._errors):
+            if key not in active_keys:
+                self._verdicts.pop(key, None)
+                self._errors.pop(key, None)
+                self._templates.pop(key, None)
+
+    def get_verdict(self, card: Dict) -> Optional[Dict]:
+        """
+        Получить результат проверки шаблона карточки
+
+        Args:
+            card: Данные карточки Kaiten
+
+        Returns:
+            Вердикт {'ready', 'message', 'file_name', 'checked_at'}, None если ещё не проверялась,
+            либо вердикт об отсутствии шаблона
+        """
+        file_info = self.find_template_file(card)
+        if not file_info:
+            return {'ready': False, 'message': "В карточке нет шаблона исх_*.docx", 'file_name': None}
+        key = self._file_key(file_info)
+        return self._verdicts.get(key) or self._errors.get(key)
+
+    def get_template(self, file_info: Dict) -> Optional[DocxTemplate]:
+        """
+        Получить заранее скачанный и проверенный шаблон
+
+        Args:
+            file_info: Данные файла из карточки Kaiten
+
+        Returns:
+            Шаблон или None, если файл (в этой версии) не проверялся
+        """
+        return self._templates.get(self._file_key(file_info))
+
+
+# Singleton instance
+template_check_service = TemplateCheckService()
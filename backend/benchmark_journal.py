@@ -0,0 +1,220 @@
+"""
+Нагрузочная проверка запросов журнала на PostgreSQL
+В отдельной схеме journal_benchmark создаётся копия outbox_journal с
+синтетическими записями (по умолчанию 120 000 за 10 лет), и запросы списка,
+счётчика и экспорта выполняются дважды: с индексами до миграции 0009 и
+с индексами миграций 0008-0009. Для каждого запроса печатается план
+(EXPLAIN ANALYZE) и медиана времени. Поиск сравнивается без индексов и
+с индексами миграции 0010. Рабочие таблицы не затрагиваются
+Запуск: python benchmark_journal.py [--rows 120000] [--runs 5] [--keep]
+"""
+import argparse
+import statistics
+import time
+from datetime import date
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.orm import Session
+from app.models.database import engine
+from app.models.outbox_journal import OutboxJournal
+from app.api.journal import JOURNAL_LIST_COLUMNS, JOURNAL_EXPORT_COLUMNS, JournalSearch, journal_date_filters
+
+
+SCHEMA = "journal_benchmark"
+YEARS = 10
+PAGE_SIZE = 100
+
+# Индексы, которые были у журнала до миграций 0008-0009
+BASELINE_INDEXES = [
+    "CREATE INDEX ix_outbox_journal_outgoing_no ON outbox_journal (outgoing_no)",
+    "CREATE INDEX ix_outbox_journal_sig_status ON outbox_journal (sig_status)",
+]
+
+# Индексы миграций 0008-0010
+NEW_INDEXES = [
+    "CREATE INDEX ix_outbox_journal_outgoing_no_id ON outbox_journal (outgoing_no, id)",
+    "CREATE INDEX ix_outbox_journal_date_no ON outbox_journal (outgoing_date, outgoing_no) "
+    "INCLUDE (id, sig_status)",
+    "CREATE INDEX ix_outbox_journal_search_vector ON outbox_journal USING gin (search_vector)",
+    "CREATE INDEX ix_outbox_journal_search_trgm ON outbox_journal USING gin (search_text gin_trgm_ops)",
+]
+
+# Темы содержания синтетических записей (для поиска)
+CONTENT_TOPICS = [
+    "О направлении информации по запросу",
+    "Ответ на письмо о благоустройстве территории",
+    "О согласовании проекта планировки",
+    "Счёт на оплату услуг связи",
+    "О предоставлении земельного участка",
+    "Уведомление о проведении проверки",
+    "О рассмотрении обращения граждан",
+]
+
+
+def create_table(conn, rows: int):
+    """Копия outbox_journal в схеме SCHEMA с синтетическими записями"""
+    conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+    conn.execute(text("CREATE TABLE outbox_journal (LIKE public.outbox_journal INCLUDING DEFAULTS INCLUDING GENERATED)"))
+    conn.execute(text("ALTER TABLE outbox_journal ADD PRIMARY KEY (id)"))
+    conn.execute(text("CREATE SEQUENCE outbox_journal_id_seq OWNED BY outbox_journal.id"))
+    conn.execute(text("ALTER TABLE outbox_journal ALTER COLUMN id SET DEFAULT nextval('outbox_journal_id_seq')"))
+
+    per_year = rows // YEARS
+    first_year = date.today().year - YEARS + 1
+    # Номер с начала каждого года, дата растёт вместе с номером; хэши файлов как у записей хранилища
+    conn.execute(text("""
+        INSERT INTO outbox_journal (
+            outgoing_no, formatted_number, outgoing_date, to_whom, executor, content,
+            folder_path, file_sha256, sig_sha256, sig_status, created_at
+        )
+        SELECT
+            no,
+            no || '-' || year,
+            make_date(year, 1, 1) + ((no - 1) * 364 / :per_year)::int,
+            'Адресат ' || (i % 700),
+            'Исполнитель ' || (i % 40),
+            (:topics)[1 + i % 7] || ' № ' || (i % 997),
+            '/mnt/doc/Исходящие/' || no || '-' || year,
+            md5(i::text) || md5((i + 1)::text),
+            md5((-i)::text) || md5((-i - 1)::text),
+            (ARRAY['valid', 'valid', 'valid', 'invalid', 'unverified'])[1 + i % 5],
+            now()
+        FROM (
+            SELECT i, :first_year + (i - 1) / :per_year AS year, (i - 1) % :per_year + 1 AS no
+            FROM generate_series(1, :rows) AS i
+        ) AS s
+    """), {"per_year": per_year, "first_year": first_year, "rows": per_year * YEARS, "topics": CONTENT_TOPICS})
+    for statement in BASELINE_INDEXES:
+        conn.execute(text(statement))
+    conn.execute(text("ANALYZE outbox_journal"))
+    conn.commit()
+
+
+def build_queries(db: Session, year: int, month: int) -> dict:
+    """Запросы API журнала: старый фильтр extract() и новый интервал дат"""
+    def extract_filters(month_filter):
+        filters = [func.extract('year', OutboxJournal.outgoing_date) == year]
+        if month_filter:
+            filters.append(func.extract('month', OutboxJournal.outgoing_date) == month_filter)
+        return filters
+
+    def page(filters):
+        return db.query(*JOURNAL_LIST_COLUMNS).filter(*filters).order_by(
+            OutboxJournal.outgoing_no.desc(), OutboxJournal.id.desc()
+        ).limit(PAGE_SIZE + 1)
+
+    def count(filters):
+        return db.query(func.count(OutboxJournal.id)).filter(*filters)
+
+    valid = [OutboxJournal.sig_status == "valid"]
+    deep_row = db.query(OutboxJournal.outgoing_no, OutboxJournal.id).order_by(
+        OutboxJournal.outgoing_no.desc(), OutboxJournal.id.desc()
+    ).offset(50000).first()
+    unfiltered = db.query(*JOURNAL_LIST_COLUMNS).order_by(
+        OutboxJournal.outgoing_no.desc(), OutboxJournal.id.desc()
+    )
+
+    def search(q):
+        found = JournalSearch(q)
+        return db.query(*JOURNAL_LIST_COLUMNS, found.rank).filter(found.condition).order_by(
+            found.rank.desc(), OutboxJournal.outgoing_no.desc(), OutboxJournal.id.desc()
+        ).limit(PAGE_SIZE + 1)
+
+    return {
+        "page year (extract)": page(extract_filters(None)),
+        "page year (range)": page(journal_date_filters(year, None)),
+        "page month (extract)": page(extract_filters(month)),
+        "page month (range)": page(journal_date_filters(year, month)),
+        "count year (extract)": count(extract_filters(None)),
+        "count year (range)": count(journal_date_filters(year, None)),
+        "count year+valid (extract)": count(extract_filters(None) + valid),
+        "count year+valid (range)": count(journal_date_filters(year, None) + valid),
+        "page 500 (offset)": unfiltered.offset(50000).limit(PAGE_SIZE + 1),
+        "page 500 (cursor)": unfiltered.filter(
+            tuple_(OutboxJournal.outgoing_no, OutboxJournal.id) < tuple(deep_row)
+        ).limit(PAGE_SIZE + 1),
+        "export year (extract)": db.query(*JOURNAL_EXPORT_COLUMNS).filter(*extract_filters(None)).order_by(
+            OutboxJournal.outgoing_no.desc()
+        ),
+        "export year (range)": db.query(*JOURNAL_EXPORT_COLUMNS).filter(*journal_date_filters(year, None)).order_by(
+            OutboxJournal.outgoing_no.desc()
+        ),
+        "search word (morphology)": search("земельных участков"),
+        "search number part": search("4711"),
+        "search typo": search("благоустроиство"),
+    }
+
+
+def measure(conn, queries: dict, runs: int) -> dict:
+    """План и медиана времени каждого запроса"""
+    results = {}
+    for name, query in queries.items():
+        # SQL уходит в драйвер как есть: знак % уже экранирован компилятором, text() экранировал бы его повторно
+        sql = str(query.statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+        plan = [row[0] for row in conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {sql}")]
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            conn.exec_driver_sql(sql).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = {"ms": statistics.median(timings), "plan": plan}
+    return results
+
+
+def print_plans(title: str, results: dict):
+    print(f"\n{'=' * 30} {title} {'=' * 30}")
+    for name, result in results.items():
+        print(f"\n--- {name}: {result['ms']:.2f} ms")
+        for line in result['plan']:
+            if "Planning" in line or "Execution" in line or "->" in line or not line.startswith(" "):
+                print(f"    {line}")
+
+
+def run_benchmark(rows: int, runs: int, keep: bool):
+    """Сравнить запросы журнала до и после новых индексов"""
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("Benchmark needs PostgreSQL (DATABASE_URL)")
+
+    year = date.today().year - 1
+    month = 6
+    with engine.connect() as conn:
+        print(f"Creating {SCHEMA}.outbox_journal with {rows} rows...")
+        started = time.perf_counter()
+        create_table(conn, rows)
+        conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+        print(f"Created in {time.perf_counter() - started:.1f}s")
+
+        try:
+            db = Session(bind=conn)
+            db.execute(JournalSearch("").threshold)
+            queries = build_queries(db, year, month)
+            before = measure(conn, queries, runs)
+            print_plans("before (baseline indexes)", before)
+
+            conn.rollback()
+            for statement in NEW_INDEXES:
+                conn.execute(text(statement))
+            conn.commit()
+            # VACUUM обновляет карту видимости - без неё index-only scan всё равно читает таблицу
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM ANALYZE outbox_journal"))
+            after = measure(conn, queries, runs)
+            print_plans("after (migrations 0008-0010)", after)
+
+            print(f"\n{'query':<32}{'before, ms':>12}{'after, ms':>12}")
+            for name in queries:
+                print(f"{name:<32}{before[name]['ms']:>12.2f}{after[name]['ms']:>12.2f}")
+        finally:
+            conn.rollback()
+            if not keep:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+                conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark journal queries on PostgreSQL")
+    parser.add_argument("--rows", type=int, default=120000, help="Synthetic journal entries")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per query (median is reported)")
+    parser.add_argument("--keep", action="store_true", help=f"Keep the {SCHEMA} schema")
+    args = parser.parse_args()
+    run_benchmark(args.rows, args.runs, args.keep)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Имитация утилиты cryptcp КриптоПро для проверки пула подписи без КриптоПро CSP.
+
+Использование: CRYPTCP_PATH=/путь/к/backend/fake_cryptcp.py в .env
+
+Поддерживаемые команды (в том же виде, как их вызывает CryptoProService):
+    fake_cryptcp.py -sign -detached -der -dir <out_dir> [-thumbprint <thumbprint>] file1 [file2 ...]
+    fake_cryptcp.py -vsignf -dir <sig_dir> file1 [file2 ...]
+    fake_cryptcp.py -hash -hashAlg <oid> -dir <out_dir> file1 [file2 ...]
+
+Подпись - строка "FAKESIG:" + SHA-256 документа, поэтому проверка находит
+подделку или подмену документа. Вместо хэша ГОСТ Р 34.11-2012 записывается
+SHA-256 (256 бит) или SHA-512 (512 бит). Переменные окружения:
+    FAKE_CRYPTCP_DELAY - задержка каждого запуска в секундах (проверка таймаутов и параллельности)
+    FAKE_CRYPTCP_FAIL  - код возврата для имитации сбоя cryptcp
+"""
+import hashlib
+import os
+import sys
+import time
+from pathlib import Path
+
+
+def fake_signature(path: Path) -> bytes:
+    return b"FAKESIG:" + hashlib.sha256(path.read_bytes()).hexdigest().encode()
+
+
+def main(argv) -> int:
+    time.sleep(float(os.environ.get("FAKE_CRYPTCP_DELAY", "0")))
+    if os.environ.get("FAKE_CRYPTCP_FAIL"):
+        print("fake cryptcp: simulated failure")
+        return int(os.environ["FAKE_CRYPTCP_FAIL"])
+
+    command = argv[0] if argv else ""
+    directory = None
+    hash_alg = None
+    files = []
+    args = iter(argv[1:])
+    for arg in args:
+        if arg in ("-dir", "-thumbprint", "-hashAlg"):
+            value = next(args, None)
+            if arg == "-dir":
+                directory = Path(value)
+            elif arg == "-hashAlg":
+                hash_alg = value
+        elif not arg.startswith("-"):
+            files.append(Path(arg))
+
+    if directory is None or not files:
+        print("fake cryptcp: -dir and at least one file are required")
+        return 2
+
+    if command == "-sign":
+        for path in files:
+            (directory / f"{path.name}.sig").write_bytes(fake_signature(path))
+            print(f"Signed: {path.name}")
+        return 0
+
+    if command == "-hash":
+        algorithm = hashlib.sha512 if hash_alg == "1.2.643.7.1.1.2.3" else hashlib.sha256
+        for path in files:
+            (directory / f"{path.name}.hsh").write_text(algorithm(path.read_bytes()).hexdigest().upper())
+            print(f"Hashed: {path.name}")
+        return 0
+
+    if command == "-vsignf":
+        failed = 0
+        for path in files:
+            signature_file = directory / f"{path.name}.sig"
+            if signature_file.exists() and signature_file.read_bytes() == fake_signature(path):
+                print(f"Signature verified: {path.name}")
+            else:
+                print(f"Signature is invalid: {path.name}")
+                failed += 1
+        return 1 if failed else 0
+
+    print(f"fake cryptcp: unsupported command {command}")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
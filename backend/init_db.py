@@ -2,17 +2,36 @@
 Скрипт для инициализации базы данных
 Создает все таблицы в БД
 """
+from pathlib import Path
+from sqlalchemy import text
+from alembic import command
+from alembic.config import Config
 from app.models.database import Base, engine
 from app.models.user import User
 from app.models.outbox_journal import OutboxJournal
+from app.models.outgoing_number import OutgoingNumberCounter, NumberReservation
+from app.models.signature_verification import SignatureVerification
+from app.models.registration_session import RegistrationSession
+from app.models.idempotency_key import IdempotencyKey
+from app.models.blob import Blob
+from app.models.journal_version import JournalVersion
 
 
 def init_db():
     """Создать все таблицы в базе данных"""
     print("Creating database tables...")
+    # Индекс поиска по журналу использует триграммы pg_trgm
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
     Base.metadata.create_all(bind=engine)
     print("Database tables created successfully!")
 
+    # Дополняем существующие таблицы (новые столбцы и индексы).
+    # Миграции идемпотентны, поэтому безопасны и для только что созданной схемы
+    alembic_config = Config(str(Path(__file__).parent / "alembic.ini"))
+    command.upgrade(alembic_config, "head")
+    print("Database migrations applied successfully!")
+
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,57 @@
+"""
+Скрипт для переноса файлов журнала из БД в хранилище по содержимому
+PDF, подпись и приложения (архив раскладывается по файлам) записей,
+созданных до хранилища, переносятся в BLOB_STORE_PATH, BLOB столбцы очищаются.
+Каждая запись переносится своей транзакцией - скрипт можно прервать и запустить снова
+Запуск: python migrate_journal_blobs.py
+"""
+from sqlalchemy import or_
+from sqlalchemy.orm import undefer
+from app.models.database import SessionLocal
+from app.models.outbox_journal import OutboxJournal
+from app.services.blob_tiering_service import move_inline_blobs
+
+
+def migrate_journal_blobs():
+    """Перенести файлы всех записей журнала в хранилище"""
+    db = SessionLocal()
+
+    try:
+        entry_ids = [
+            row.id for row in db.query(OutboxJournal.id).filter(or_(
+                OutboxJournal.file_blob.isnot(None),
+                OutboxJournal.sig_blob.isnot(None),
+                OutboxJournal.attachments_blob.isnot(None)
+            )).order_by(OutboxJournal.id).all()
+        ]
+        print(f"Found {len(entry_ids)} journal entries with files in the database")
+
+        migrated = 0
+        freed = 0
+        for entry_id in entry_ids:
+            entry = db.query(OutboxJournal).options(
+                undefer(OutboxJournal.file_blob),
+                undefer(OutboxJournal.sig_blob),
+                undefer(OutboxJournal.attachments_blob)
+            ).filter(OutboxJournal.id == entry_id).with_for_update().first()
+            if entry is None:
+                db.rollback()
+                continue
+            try:
+                freed += move_inline_blobs(db, entry)
+                db.commit()
+                migrated += 1
+                print(f"  - {entry.formatted_number}: moved to blob store")
+            except Exception as e:
+                db.rollback()
+                print(f"  - Entry {entry_id}: failed: {e}")
+
+        print(f"\nMigrated {migrated} of {len(entry_ids)} entries, {freed} bytes moved out of the database")
+        print("Run VACUUM FULL outbox_journal to return the space to the filesystem")
+
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    migrate_journal_blobs()
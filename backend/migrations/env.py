@@ -0,0 +1,45 @@
+"""
+Окружение alembic: подключение к БД приложения и метаданные моделей
+"""
+from logging.config import fileConfig
+from alembic import context
+from app.core.config import settings
+from app.models.database import Base, engine
+from app.models.user import User  # noqa: F401 - модели регистрируются в Base.metadata
+from app.models.outbox_journal import OutboxJournal  # noqa: F401
+from app.models.outgoing_number import OutgoingNumberCounter, NumberReservation  # noqa: F401
+from app.models.signature_verification import SignatureVerification  # noqa: F401
+from app.models.registration_session import RegistrationSession  # noqa: F401
+from app.models.idempotency_key import IdempotencyKey  # noqa: F401
+from app.models.blob import Blob  # noqa: F401
+from app.models.journal_version import JournalVersion  # noqa: F401
+
+if context.config.config_file_name is not None:
+    fileConfig(context.config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """Сформировать SQL миграций без подключения к БД (alembic upgrade head --sql)"""
+    context.configure(
+        url=settings.DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    """Применить миграции к БД"""
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
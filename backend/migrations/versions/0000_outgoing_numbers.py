@@ -0,0 +1,49 @@
+"""Счётчики и резервы исходящих номеров
+
+Revision ID: 0000
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0000'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS - таблицы могли быть созданы init_db.py (create_all) до миграции
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS outgoing_number_counters (
+            scope VARCHAR NOT NULL PRIMARY KEY,
+            last_number INTEGER NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )
+    """)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS outgoing_number_reservations (
+            id SERIAL PRIMARY KEY,
+            year INTEGER NOT NULL,
+            outgoing_no INTEGER NOT NULL,
+            formatted_number VARCHAR NOT NULL,
+            file_id VARCHAR,
+            card_id INTEGER,
+            status VARCHAR NOT NULL,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            CONSTRAINT uq_number_reservation_year_no UNIQUE (year, outgoing_no)
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_outgoing_number_reservations_id ON outgoing_number_reservations (id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_outgoing_number_reservations_file_id ON outgoing_number_reservations (file_id)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_number_reservation_year_status_no "
+        "ON outgoing_number_reservations (year, status, outgoing_no)"
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS outgoing_number_reservations")
+    op.execute("DROP TABLE IF EXISTS outgoing_number_counters")
@@ -0,0 +1,39 @@
+"""Результаты проверки подписей: кэш по хэшам и статус в журнале
+
+Revision ID: 0001
+Revises: 0000
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0001'
+down_revision = '0000'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS - схема могла быть создана init_db.py до появления миграций
+    op.execute("ALTER TABLE outbox_journal ADD COLUMN IF NOT EXISTS sig_status VARCHAR")
+    op.execute("ALTER TABLE outbox_journal ADD COLUMN IF NOT EXISTS sig_checked_at TIMESTAMP WITH TIME ZONE")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_outbox_journal_sig_status ON outbox_journal (sig_status)")
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS signature_verifications (
+            pdf_sha256 VARCHAR(64) NOT NULL,
+            sig_sha256 VARCHAR(64) NOT NULL,
+            status VARCHAR NOT NULL,
+            method VARCHAR NOT NULL,
+            signer VARCHAR,
+            error VARCHAR,
+            checked_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            PRIMARY KEY (pdf_sha256, sig_sha256)
+        )
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS signature_verifications")
+    op.execute("DROP INDEX IF EXISTS ix_outbox_journal_sig_status")
+    op.execute("ALTER TABLE outbox_journal DROP COLUMN IF EXISTS sig_checked_at")
+    op.execute("ALTER TABLE outbox_journal DROP COLUMN IF EXISTS sig_status")
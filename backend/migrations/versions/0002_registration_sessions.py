@@ -0,0 +1,50 @@
+"""Сессии регистрации документов (замена поиска файлов в temp_files)
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS - таблица могла быть создана init_db.py (create_all) до миграции
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS registration_sessions (
+            file_id VARCHAR NOT NULL PRIMARY KEY,
+            batch_id VARCHAR,
+            status VARCHAR NOT NULL,
+            username VARCHAR,
+            outgoing_no INTEGER NOT NULL,
+            formatted_number VARCHAR NOT NULL,
+            outgoing_date DATE NOT NULL,
+            executor VARCHAR,
+            executor_id INTEGER,
+            card_id INTEGER NOT NULL,
+            to_whom VARCHAR,
+            content TEXT,
+            attachments JSON,
+            selected_file_name VARCHAR NOT NULL,
+            docx_file VARCHAR,
+            pdf_file VARCHAR NOT NULL,
+            pdf_size INTEGER,
+            document_digests JSON,
+            sig_path VARCHAR,
+            journal_entry_id INTEGER,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_registration_sessions_batch_id ON registration_sessions (batch_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_registration_sessions_status ON registration_sessions (status)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_registration_sessions_card_id ON registration_sessions (card_id)")
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS registration_sessions")
@@ -0,0 +1,36 @@
+"""Фоновая финализация подписанных документов: состояние в сессиях регистрации
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = [
+    ("sig_status", "VARCHAR"),
+    ("signer_cn", "VARCHAR"),
+    ("signer_thumbprint", "VARCHAR"),
+    ("signed_at", "TIMESTAMP WITH TIME ZONE"),
+    ("finalize_stage", "VARCHAR"),
+    ("finalize_attempts", "INTEGER NOT NULL DEFAULT 0"),
+    ("finalize_error", "TEXT"),
+    ("finalize_next_at", "TIMESTAMP WITH TIME ZONE"),
+]
+
+
+def upgrade():
+    # IF NOT EXISTS - столбцы могли быть созданы init_db.py (create_all) до миграции
+    for name, column_type in COLUMNS:
+        op.execute(f"ALTER TABLE registration_sessions ADD COLUMN IF NOT EXISTS {name} {column_type}")
+
+
+def downgrade():
+    for name, _ in reversed(COLUMNS):
+        op.execute(f"ALTER TABLE registration_sessions DROP COLUMN IF EXISTS {name}")
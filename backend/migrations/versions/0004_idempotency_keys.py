@@ -0,0 +1,38 @@
+"""Ключи идемпотентности (Idempotency-Key) регистрации и загрузки подписи
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS - таблица могла быть создана init_db.py (create_all) до миграции
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            id SERIAL PRIMARY KEY,
+            key VARCHAR NOT NULL,
+            username VARCHAR NOT NULL,
+            endpoint VARCHAR NOT NULL,
+            request_hash VARCHAR(64) NOT NULL,
+            status VARCHAR NOT NULL,
+            status_code INTEGER,
+            response JSON,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            CONSTRAINT uq_idempotency_keys_user_endpoint_key UNIQUE (username, endpoint, key)
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_idempotency_keys_id ON idempotency_keys (id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at)")
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS idempotency_keys")
@@ -0,0 +1,29 @@
+"""BLOB столбцы журнала без сжатия TOAST (чтение файла частями без распаковки целиком)
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+BLOB_COLUMNS = ("file_blob", "sig_blob", "attachments_blob")
+
+
+def upgrade():
+    # PDF и ZIP уже сжаты. EXTERNAL хранит их в TOAST без сжатия, и substr()
+    # (скачивание файла записи частями) читает только нужный кусок.
+    # Действует для новых значений; повторное выполнение безопасно
+    for column in BLOB_COLUMNS:
+        op.execute(f"ALTER TABLE outbox_journal ALTER COLUMN {column} SET STORAGE EXTERNAL")
+
+
+def downgrade():
+    for column in BLOB_COLUMNS:
+        op.execute(f"ALTER TABLE outbox_journal ALTER COLUMN {column} SET STORAGE EXTENDED")
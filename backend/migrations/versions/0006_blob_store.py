@@ -0,0 +1,40 @@
+"""Хранилище файлов журнала по содержимому (SHA-256) со счётчиком ссылок
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS - таблица и столбцы могли быть созданы init_db.py (create_all) до миграции
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 VARCHAR(64) NOT NULL PRIMARY KEY,
+            size BIGINT NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_blobs_updated_at ON blobs (updated_at)")
+
+    op.execute("ALTER TABLE outbox_journal ADD COLUMN IF NOT EXISTS file_sha256 VARCHAR(64)")
+    op.execute("ALTER TABLE outbox_journal ADD COLUMN IF NOT EXISTS sig_sha256 VARCHAR(64)")
+    op.execute("ALTER TABLE outbox_journal ADD COLUMN IF NOT EXISTS attachments JSON")
+    op.execute("ALTER TABLE registration_sessions ADD COLUMN IF NOT EXISTS attachment_blobs JSON")
+
+
+def downgrade():
+    op.execute("ALTER TABLE registration_sessions DROP COLUMN IF EXISTS attachment_blobs")
+    op.execute("ALTER TABLE outbox_journal DROP COLUMN IF EXISTS attachments")
+    op.execute("ALTER TABLE outbox_journal DROP COLUMN IF EXISTS sig_sha256")
+    op.execute("ALTER TABLE outbox_journal DROP COLUMN IF EXISTS file_sha256")
+    op.execute("DROP TABLE IF EXISTS blobs")
@@ -0,0 +1,27 @@
+"""Холодное хранение файлов журнала: сжатые архивы и смещения в них
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE blobs ADD COLUMN IF NOT EXISTS tier VARCHAR NOT NULL DEFAULT 'hot'")
+    op.execute("ALTER TABLE blobs ADD COLUMN IF NOT EXISTS pack VARCHAR")
+    op.execute("ALTER TABLE blobs ADD COLUMN IF NOT EXISTS pack_offset BIGINT")
+    op.execute("ALTER TABLE blobs ADD COLUMN IF NOT EXISTS pack_length BIGINT")
+
+
+def downgrade():
+    op.execute("ALTER TABLE blobs DROP COLUMN IF EXISTS pack_length")
+    op.execute("ALTER TABLE blobs DROP COLUMN IF EXISTS pack_offset")
+    op.execute("ALTER TABLE blobs DROP COLUMN IF EXISTS pack")
+    op.execute("ALTER TABLE blobs DROP COLUMN IF EXISTS tier")
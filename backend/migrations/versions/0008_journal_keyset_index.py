@@ -0,0 +1,21 @@
+"""Индекс списка журнала по (outgoing_no, id) для постраничного вывода курсором
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE INDEX IF NOT EXISTS ix_outbox_journal_outgoing_no_id ON outbox_journal (outgoing_no, id)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_outbox_journal_outgoing_no_id")
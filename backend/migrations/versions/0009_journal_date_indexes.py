@@ -0,0 +1,27 @@
+"""Индекс журнала по (outgoing_date, outgoing_no) для фильтра интервалом дат,
+с id и sig_status для счётчиков сканированием только индекса
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS ix_outbox_journal_date_no
+        ON outbox_journal (outgoing_date, outgoing_no) INCLUDE (id, sig_status)
+    """)
+    # Статистика для планировщика с новым индексом
+    op.execute("ANALYZE outbox_journal")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_outbox_journal_date_no")
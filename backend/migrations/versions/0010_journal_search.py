@@ -0,0 +1,48 @@
+"""Поиск по журналу: поисковый вектор (русская морфология) и триграммы pg_trgm
+
+Расширение pg_trgm создаётся миграцией; если у пользователя БД нет прав на
+CREATE EXTENSION, его нужно один раз создать суперпользователем:
+    CREATE EXTENSION pg_trgm;
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # Выражения совпадают с SEARCH_TEXT_SQL и SEARCH_VECTOR_SQL модели OutboxJournal
+    op.execute("""
+        ALTER TABLE outbox_journal ADD COLUMN IF NOT EXISTS search_text TEXT
+        GENERATED ALWAYS AS (
+            coalesce(formatted_number, '') || ' ' || coalesce(to_whom, '') || ' ' ||
+            coalesce(executor, '') || ' ' || coalesce(content, '')
+        ) STORED
+    """)
+    op.execute("""
+        ALTER TABLE outbox_journal ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', coalesce(formatted_number, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(to_whom, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(content, '')), 'B') ||
+            setweight(to_tsvector('russian', coalesce(executor, '')), 'C')
+        ) STORED
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_outbox_journal_search_vector ON outbox_journal USING gin (search_vector)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_outbox_journal_search_trgm ON outbox_journal USING gin (search_text gin_trgm_ops)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_outbox_journal_search_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_outbox_journal_search_vector")
+    op.execute("ALTER TABLE outbox_journal DROP COLUMN IF EXISTS search_vector")
+    op.execute("ALTER TABLE outbox_journal DROP COLUMN IF EXISTS search_text")
@@ -0,0 +1,29 @@
+"""Версия журнала - ключ кэша экспортов
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS - таблица могла быть создана init_db.py (create_all) до миграции
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS journal_version (
+            id INTEGER NOT NULL PRIMARY KEY,
+            version BIGINT NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )
+    """)
+    op.execute("INSERT INTO journal_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING")
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS journal_version")
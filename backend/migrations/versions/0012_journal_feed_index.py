@@ -0,0 +1,21 @@
+"""Индекс журнала по (created_at, id) для инкрементальной выгрузки CSV/NDJSON
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE INDEX IF NOT EXISTS ix_outbox_journal_created_at_id ON outbox_journal (created_at, id)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_outbox_journal_created_at_id")
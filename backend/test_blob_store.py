@@ -0,0 +1,55 @@
+"""
+Проверка хранилища файлов журнала: файл, перенесённый в холодное хранение,
+читается через read/resolve/link_or_copy (распаковкой из архива).
+Нужны БД и zstandard; проверочный файл и его архив удаляются после проверки
+Запуск: python test_blob_store.py
+"""
+import os
+import tempfile
+import uuid
+from pathlib import Path
+from app.models.blob import Blob
+from app.models.database import SessionLocal
+from app.services.blob_service import blob_service
+
+
+def test_blob_store():
+    """Сохранить файл, перенести его в архив и прочитать обратно"""
+    data = f"blob store check {uuid.uuid4()}".encode() * 100
+    pack = f"check-{uuid.uuid4().hex}"
+    db = SessionLocal()
+    digest = None
+
+    try:
+        print("1. Storing blob...")
+        digest = blob_service.store(db, data)
+        db.commit()
+        print(f"   {digest}")
+
+        print("2. Archiving blob...")
+        assert blob_service.archive(db, digest, pack), "archive() не перенёс файл"
+        assert not blob_service.backend.exists(digest), "горячая копия не удалена"
+
+        print("3. Reading archived blob...")
+        assert blob_service.read(digest) == data, "read() вернул другое содержимое"
+        assert blob_service.resolve(digest, None) == data, "resolve() вернул другое содержимое"
+        with tempfile.TemporaryDirectory() as tmp:
+            target = Path(tmp) / "document.pdf"
+            blob_service.link_or_copy(digest, target)
+            assert target.read_bytes() == data, "link_or_copy() записал другое содержимое"
+
+        print("\nBlob store check passed")
+    finally:
+        if digest is not None:
+            db.rollback()
+            db.query(Blob).filter(Blob.sha256 == digest).delete()
+            db.commit()
+            blob_service.backend.delete(digest)
+        pack_path = blob_service._pack_path(pack)
+        if pack_path.exists():
+            os.remove(pack_path)
+        db.close()
+
+
+if __name__ == "__main__":
+    test_blob_store()
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import IncomingFiles from './components/IncomingFiles';
 import OutgoingFiles from './components/OutgoingFiles';
 import Journal from './components/Journal';
+import BatchSigningModal from './components/BatchSigningModal';
 import Login from './components/Login';
 import { kaitenApi, authApi } from './services/api';
 import './App.css';
@@ -13,6 +14,8 @@ function App() {
   const [cards, setCards] = useState([]);
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [showBatchSigning, setShowBatchSigning] = useState(false);
+  const [batchSigned, setBatchSigned] = useState(false);
 
   // Проверяем наличие сохраненного пользователя при монтировании
   useEffect(() => {
@@ -67,6 +70,11 @@ function App() {
     setSubTab('outgoing');
   };
 
+  // Карточки с проверенным шаблоном исх_*.docx - их можно подписать пакетом
+  const batchItems = cards
+    .filter(card => card.template_check?.ready && card.template_check.file_name)
+    .map(card => ({ card_id: card.id, selected_file_name: card.template_check.file_name }));
+
   // Пока загружаемся
   if (loading) {
     return (
@@ -102,8 +110,13 @@ function App() {
                 onChange={(e) => setCardId(Number(e.target.value))}
               >
                 {cards.map((card) => (
-                  <option key={card.id} value={card.id}>
+                  <option
+                    key={card.id}
+                    value={card.id}
+                    title={card.template_check?.message || ''}
+                  >
                     {card.properties?.id_228499 || card.id} - {card.title}
+                    {card.template_check && (card.template_check.ready ? ' ✓ Готово к регистрации' : ` ⚠ ${card.template_check.message}`)}
                   </option>
                 ))}
               </select>
@@ -111,6 +124,23 @@ function App() {
               <span>Нет карточек</span>
             )}
           </div>
+          {user.role === 'director' && batchItems.length > 1 && (
+            <button
+              onClick={() => setShowBatchSigning(true)}
+              style={{
+                padding: '8px 16px',
+                background: 'rgba(255, 255, 255, 0.2)',
+                color: 'white',
+                border: '1px solid rgba(255, 255, 255, 0.3)',
+                borderRadius: '6px',
+                cursor: 'pointer',
+                fontSize: '14px',
+                fontWeight: '500'
+              }}
+            >
+              🔏 Подписать готовые ({batchItems.length})
+            </button>
+          )}
         </div>
         <div style={{ display: 'flex', alignItems: 'center', gap: '15px' }}>
           <div style={{ textAlign: 'right' }}>
@@ -184,6 +214,20 @@ function App() {
         {mainTab === 'cards' && subTab === 'outgoing' && <OutgoingFiles cardId={cardId} onCardsUpdate={loadCards} userRole={user?.role} />}
         {mainTab === 'journal' && <Journal />}
       </div>
+
+      <BatchSigningModal
+        isOpen={showBatchSigning}
+        items={batchItems}
+        onSuccess={() => setBatchSigned(true)}
+        onClose={() => {
+          setShowBatchSigning(false);
+          // Подписанные карточки ушли в "Отправка" - обновляем список
+          if (batchSigned) {
+            setBatchSigned(false);
+            loadCards();
+          }
+        }}
+      />
     </div>
   );
 }
@@ -0,0 +1,435 @@
+import React, { useState, useEffect } from 'react';
+import { outboxApi, kaitenApi } from '../services/api';
+
+const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
+// Пакетное подписание: сертификат выбирается один раз, все документы пакета
+// подписываются подряд и загружаются на сервер одним запросом
+const BatchSigningModal = ({ isOpen, onClose, items, onSuccess }) => {
+  const [certificates, setCertificates] = useState([]);
+  const [selectedCert, setSelectedCert] = useState(null);
+  const [loading, setLoading] = useState(false);
+  const [status, setStatus] = useState('');
+  const [error, setError] = useState('');
+  const [results, setResults] = useState([]);
+
+  useEffect(() => {
+    if (isOpen) {
+      setResults([]);
+      setError('');
+      initPlugin();
+    }
+  }, [isOpen]);
+
+  const initPlugin = async () => {
+    setStatus('Инициализация плагина КриптоПро...');
+    setLoading(true);
+
+    try {
+      if (typeof cadesplugin === 'undefined') {
+        throw new Error('Плагин КриптоПро не найден. Установите с https://www.cryptopro.ru/products/cades/plugin');
+      }
+
+      // Ожидание инициализации плагина
+      let attempts = 0;
+      const maxAttempts = 30;
+      while (true) {
+        try {
+          attempts++;
+          await cadesplugin.CreateObjectAsync("CAdESCOM.About");
+          break;
+        } catch (err) {
+          if (attempts >= maxAttempts) {
+            throw new Error('Не удалось инициализировать плагин за 30 секунд');
+          }
+          await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+      }
+
+      setStatus('Плагин активен. Загрузка сертификатов...');
+      await loadCertificates();
+    } catch (err) {
+      setError(err.message);
+      setLoading(false);
+    }
+  };
+
+  const openStore = async () => {
+    const store = await cadesplugin.CreateObjectAsync("CAdESCOM.Store");
+    await store.Open(
+      cadesplugin.CAPICOM_CURRENT_USER_STORE,
+      cadesplugin.CAPICOM_MY_STORE,
+      cadesplugin.CAPICOM_STORE_OPEN_MAXIMUM_ALLOWED
+    );
+    return store;
+  };
+
+  const loadCertificates = async () => {
+    try {
+      const store = await openStore();
+      const certs = await store.Certificates;
+      const count = await certs.Count;
+      const certList = [];
+
+      for (let i = 1; i <= count; i++) {
+        try {
+          const cert = await certs.Item(i);
+          const subjectName = await cert.SubjectName;
+          const validTo = await cert.ValidToDate;
+          const thumbprint = await cert.Thumbprint;
+          const hasPrivateKey = await cert.HasPrivateKey();
+          const isValid = await cert.IsValid();
+          const isValidResult = await isValid.Result;
+
+          const cnMatch = subjectName.match(/CN=([^,]+)/);
+          const cn = cnMatch ? cnMatch[1] : subjectName.substring(0, 50);
+
+          if (hasPrivateKey && isValidResult) {
+            certList.push({ thumbprint, cn, validTo: new Date(validTo) });
+          }
+        } catch (certErr) {
+          console.error(`Ошибка при обработке сертификата ${i}:`, certErr);
+        }
+      }
+
+      await store.Close();
+
+      if (certList.length === 0) {
+        setError('Нет действительных сертификатов с закрытыми ключами');
+        setLoading(false);
+        return;
+      }
+
+      setCertificates(certList);
+      setStatus(`Документов в пакете: ${items.length}. Выберите сертификат для подписания`);
+      setLoading(false);
+    } catch (err) {
+      setError('Ошибка загрузки сертификатов: ' + err.message);
+      setLoading(false);
+    }
+  };
+
+  const handleSignBatch = async () => {
+    if (!selectedCert) {
+      setError('Выберите сертификат');
+      return;
+    }
+
+    setLoading(true);
+    setError('');
+
+    try {
+      // 1. Сервер параллельно готовит все документы пакета
+      setStatus(`Подготовка ${items.length} документов...`);
+      const prepareResponse = await outboxApi.batchPrepare(items);
+      const manifest = prepareResponse.data;
+      const itemResults = manifest.items
+        .filter(item => item.status !== 'ready')
+        .map(item => ({ title: item.selected_file_name, status: 'error', error: item.error }));
+      const ready = manifest.items.filter(item => item.status === 'ready');
+
+      // 2. Сертификат находим один раз на весь пакет
+      const store = await openStore();
+      const certs = await store.Certificates;
+      const foundCerts = await certs.Find(
+        cadesplugin.CAPICOM_CERTIFICATE_FIND_SHA1_HASH,
+        selectedCert.thumbprint
+      );
+      if (await foundCerts.Count === 0) {
+        throw new Error('Сертификат не найден по отпечатку');
+      }
+      const cert = await foundCerts.Item(1);
+      await store.Close();
+
+      const signer = await cadesplugin.CreateObjectAsync("CAdESCOM.CPSigner");
+      await signer.propset_Certificate(cert);
+      await signer.propset_CheckCertificate(true);
+      const hashAlgorithm = await getHashAlgorithm(cert);
+
+      // 3. Подписываем документы по очереди (PIN запрашивается один раз)
+      const formData = new FormData();
+      formData.append('thumbprint', selectedCert.thumbprint);
+      formData.append('cn', selectedCert.cn);
+      const checksums = {};
+      let signedCount = 0;
+
+      for (const item of ready) {
+        const registration = item.registration;
+        setStatus(`Подписание ${signedCount + 1} из ${ready.length}: № ${registration.formatted_number}...`);
+        try {
+          const signature = await signDocument(signer, hashAlgorithm, registration);
+          const signatureBlob = base64ToBlob(signature);
+          checksums[registration.file_id] = await sha256Hex(signatureBlob);
+          formData.append('signatures', signatureBlob, `${registration.file_id}.sig`);
+          signedCount++;
+        } catch (signErr) {
+          console.error('Ошибка подписания:', signErr);
+          itemResults.push({
+            title: `№ ${registration.formatted_number}`,
+            status: 'error',
+            error: signErr.message
+          });
+        }
+      }
+
+      // 4. Загружаем все подписи одним запросом
+      if (signedCount > 0) {
+        setStatus('Отправка подписей на сервер...');
+        formData.append('checksums', JSON.stringify(checksums));
+        const uploadResponse = await outboxApi.batchUploadSignatures(manifest.batch_id, formData);
+
+        for (const result of uploadResponse.data.items) {
+          if (result.status === 'signed') {
+            // Перемещаем карточку в колонку "Отправка" с проставлением исходящего номера и даты
+            try {
+              await kaitenApi.moveCard(
+                result.card_id,
+                'Отправка',
+                'Документ подписан',
+                result.formatted_number,
+                result.outgoing_date.split('.').reverse().join('-')
+              );
+            } catch (moveErr) {
+              console.error('[BatchSigning] Ошибка перемещения карточки:', moveErr);
+            }
+          }
+          const registration = ready.find(item => item.registration.file_id === result.file_id)?.registration;
+          itemResults.push({
+            title: registration ? `№ ${registration.formatted_number}` : result.file_id,
+            status: result.status,
+            error: result.error
+          });
+        }
+      }
+
+      const signed = itemResults.filter(result => result.status === 'signed').length;
+      setResults(itemResults);
+      setStatus(`Подписано документов: ${signed} из ${items.length}`);
+      setLoading(false);
+
+      if (onSuccess && signed > 0) {
+        onSuccess();
+      }
+    } catch (err) {
+      console.error('Ошибка пакетного подписания:', err);
+      setError('Ошибка пакетного подписания: ' + (err.response?.data?.detail || err.message));
+      setLoading(false);
+    }
+  };
+
+  // Подпись по хэшу, посчитанному сервером; если хэша нет - подписывается весь PDF
+  const signDocument = async (signer, hashAlgorithm, registration) => {
+    const signedData = await cadesplugin.CreateObjectAsync("CAdESCOM.CadesSignedData");
+    const digest = hashAlgorithm ? registration.document_digests?.[hashAlgorithm.name] : null;
+
+    if (digest) {
+      const hashedData = await cadesplugin.CreateObjectAsync("CAdESCOM.HashedData");
+      await hashedData.propset_Algorithm(hashAlgorithm.id);
+      await hashedData.SetHashValue(digest);
+      return await signedData.SignHash(hashedData, signer, cadesplugin.CADESCOM_CADES_BES);
+    }
+
+    const token = localStorage.getItem('token');
+    const pdfResponse = await fetch(`${API_BASE_URL}/api/outbox/download/${registration.pdf_file}`, {
+      headers: {
+        'Authorization': `Bearer ${token}`
+      }
+    });
+    if (!pdfResponse.ok) {
+      throw new Error(`Ошибка загрузки PDF: ${pdfResponse.status}`);
+    }
+    const pdfArrayBuffer = await pdfResponse.arrayBuffer();
+
+    await signedData.propset_ContentEncoding(cadesplugin.CADESCOM_BASE64_TO_BINARY);
+    await signedData.propset_Content(arrayBufferToBase64(pdfArrayBuffer));
+    return await signedData.SignCades(signer, cadesplugin.CADESCOM_CADES_BES, true);
+  };
+
+  // Алгоритм хэширования ГОСТ Р 34.11-2012 по алгоритму ключа сертификата
+  const getHashAlgorithm = async (cert) => {
+    try {
+      const publicKey = await cert.PublicKey();
+      const algorithm = await publicKey.Algorithm;
+      const oid = await algorithm.Value;
+      if (oid === '1.2.643.7.1.1.1.1') {
+        return { name: 'gost3411_2012_256', id: cadesplugin.CADESCOM_HASH_ALGORITHM_CP_GOST_3411_2012_256 };
+      }
+      if (oid === '1.2.643.7.1.1.1.2') {
+        return { name: 'gost3411_2012_512', id: cadesplugin.CADESCOM_HASH_ALGORITHM_CP_GOST_3411_2012_512 };
+      }
+    } catch (err) {
+      console.warn('Не удалось определить алгоритм ключа:', err);
+    }
+    return null;
+  };
+
+  const arrayBufferToBase64 = (buffer) => {
+    let binary = '';
+    const bytes = new Uint8Array(buffer);
+    for (let i = 0; i < bytes.byteLength; i++) {
+      binary += String.fromCharCode(bytes[i]);
+    }
+    return btoa(binary);
+  };
+
+  const base64ToBlob = (base64) => {
+    const binary = atob(base64.replace(/\s/g, ''));
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+      bytes[i] = binary.charCodeAt(i);
+    }
+    return new Blob([bytes], { type: 'application/octet-stream' });
+  };
+
+  // Контрольная сумма подписи - сервер проверяет целостность загрузки
+  const sha256Hex = async (blob) => {
+    if (!window.crypto?.subtle) return '';
+    const hash = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(hash)).map(b => b.toString(16).padStart(2, '0')).join('');
+  };
+
+  if (!isOpen) return null;
+
+  return (
+    <div style={{
+      position: 'fixed',
+      top: 0,
+      left: 0,
+      right: 0,
+      bottom: 0,
+      background: 'rgba(0, 0, 0, 0.5)',
+      display: 'flex',
+      alignItems: 'center',
+      justifyContent: 'center',
+      zIndex: 1000
+    }}>
+      <div style={{
+        background: 'white',
+        borderRadius: '8px',
+        padding: '24px',
+        maxWidth: '560px',
+        width: '90%',
+        maxHeight: '80vh',
+        overflow: 'auto',
+        boxShadow: '0 20px 60px rgba(0,0,0,0.3)',
+        color: '#111827'
+      }}>
+        <h2 style={{ marginBottom: '16px', fontSize: '20px', fontWeight: '600' }}>
+          🔐 Пакетное подписание ({items.length})
+        </h2>
+
+        {/* Статус */}
+        {status && (
+          <div style={{
+            padding: '12px',
+            background: '#f0fdf4',
+            borderRadius: '6px',
+            marginBottom: '16px',
+            fontSize: '14px',
+            color: '#166534'
+          }}>
+            {status}
+          </div>
+        )}
+
+        {/* Ошибка */}
+        {error && (
+          <div style={{
+            padding: '12px',
+            background: '#fef2f2',
+            borderRadius: '6px',
+            marginBottom: '16px',
+            fontSize: '14px',
+            color: '#dc2626'
+          }}>
+            {error}
+          </div>
+        )}
+
+        {/* Результаты по документам */}
+        {results.length > 0 && (
+          <ul style={{ margin: '0 0 16px', padding: 0, listStyle: 'none', fontSize: '13px' }}>
+            {results.map((result, index) => (
+              <li key={index} style={{ padding: '4px 0', color: result.status === 'signed' ? '#166534' : '#dc2626' }}>
+                {result.status === 'signed' ? '✅' : '⚠'} {result.title}
+                {result.error && ` - ${result.error}`}
+              </li>
+            ))}
+          </ul>
+        )}
+
+        {/* Список сертификатов */}
+        {certificates.length > 0 && !loading && results.length === 0 && (
+          <div>
+            <label style={{ display: 'block', marginBottom: '8px', fontWeight: '500', fontSize: '14px' }}>
+              Выберите сертификат КЭП:
+            </label>
+            <select
+              value={selectedCert?.thumbprint || ''}
+              onChange={(e) => {
+                const cert = certificates.find(c => c.thumbprint === e.target.value);
+                setSelectedCert(cert);
+              }}
+              style={{
+                width: '100%',
+                padding: '12px',
+                fontSize: '14px',
+                border: '2px solid #e5e7eb',
+                borderRadius: '6px',
+                marginBottom: '16px'
+              }}
+            >
+              <option value="">-- Выберите сертификат --</option>
+              {certificates.map((cert, index) => (
+                <option key={index} value={cert.thumbprint}>
+                  {cert.cn} (до {cert.validTo.toLocaleDateString()})
+                </option>
+              ))}
+            </select>
+          </div>
+        )}
+
+        {/* Кнопки */}
+        <div style={{ display: 'flex', gap: '12px', marginTop: '20px' }}>
+          {results.length === 0 && (
+            <button
+              onClick={handleSignBatch}
+              disabled={!selectedCert || loading}
+              style={{
+                flex: 1,
+                padding: '12px 24px',
+                background: (!selectedCert || loading) ? '#9ca3af' : '#4b5563',
+                color: 'white',
+                border: 'none',
+                borderRadius: '6px',
+                fontSize: '14px',
+                fontWeight: '600',
+                cursor: (!selectedCert || loading) ? 'not-allowed' : 'pointer'
+              }}
+            >
+              {loading ? 'Подписание...' : `🔏 Подписать все (${items.length})`}
+            </button>
+          )}
+          <button
+            onClick={onClose}
+            disabled={loading}
+            style={{
+              padding: '12px 24px',
+              background: 'white',
+              color: '#6b7280',
+              border: '2px solid #e5e7eb',
+              borderRadius: '6px',
+              fontSize: '14px',
+              fontWeight: '600',
+              cursor: loading ? 'not-allowed' : 'pointer'
+            }}
+          >
+            Закрыть
+          </button>
+        </div>
+      </div>
+    </div>
+  );
+};
+
+export default BatchSigningModal;
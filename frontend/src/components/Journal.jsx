@@ -1,7 +1,22 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { journalApi } from '../services/api';
 
 const PAGE_SIZE = 100;
+// Поиск запускается, когда пользователь перестал печатать на столько мс
+const SEARCH_DEBOUNCE_MS = 300;
+// Интервал опроса фоновой сборки экспорта
+const EXPORT_POLL_MS = 1000;
+
+// Текст с совпадениями поиска: сервер отмечает их [[ ]], здесь они становятся <mark>
+const Highlighted = ({ text }) => (
+  <>
+    {text.split(/(\[\[.*?\]\])/).map((part, i) => (
+      part.startsWith('[[') && part.endsWith(']]')
+        ? <mark key={i}>{part.slice(2, -2)}</mark>
+        : part
+    ))}
+  </>
+);
 
 const Journal = () => {
   const [entries, setEntries] = useState([]);
@@ -9,38 +24,63 @@ const Journal = () => {
   const [error, setError] = useState(null);
   const [yearFilter, setYearFilter] = useState(new Date().getFullYear());
   const [monthFilter, setMonthFilter] = useState(null);
+  const [searchInput, setSearchInput] = useState('');
+  const [searchQuery, setSearchQuery] = useState('');
   const [editingEntry, setEditingEntry] = useState(null);
   const [showCreateForm, setShowCreateForm] = useState(false);
   const [formData, setFormData] = useState({});
-  const [currentPage, setCurrentPage] = useState(0);
   const [totalEntries, setTotalEntries] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [exporting, setExporting] = useState(false);
+  const loadMoreRef = useRef(null);
 
   useEffect(() => {
-    setCurrentPage(0);
-    loadEntries(0);
-  }, [yearFilter, monthFilter]);
+    loadEntries();
+  }, [yearFilter, monthFilter, searchQuery]);
 
   useEffect(() => {
-    loadEntries(currentPage);
-  }, [currentPage]);
+    const timer = setTimeout(() => setSearchQuery(searchInput.trim()), SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [searchInput]);
 
-  const loadEntries = async (page) => {
+  // Бесконечная прокрутка: следующая страница грузится, когда низ таблицы виден
+  useEffect(() => {
+    const sentinel = loadMoreRef.current;
+    if (!sentinel || !nextCursor) return;
+    const observer = new IntersectionObserver((items) => {
+      if (items[0].isIntersecting) {
+        loadMore();
+      }
+    });
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [nextCursor, loadingMore]);
+
+  const buildParams = () => {
+    const params = {
+      year: yearFilter,
+      limit: PAGE_SIZE
+    };
+    if (monthFilter) {
+      params.month = monthFilter;
+    }
+    if (searchQuery) {
+      params.q = searchQuery;
+    }
+    return params;
+  };
+
+  // Первая страница (с общим числом записей); курсор следующей - в nextCursor
+  const loadEntries = async () => {
     try {
       setLoading(true);
       setError(null);
 
-      const params = {
-        year: yearFilter,
-        skip: (page ?? currentPage) * PAGE_SIZE,
-        limit: PAGE_SIZE
-      };
-      if (monthFilter) {
-        params.month = monthFilter;
-      }
-
-      const response = await journalApi.getEntries(params);
+      const response = await journalApi.getEntries(buildParams());
       setEntries(response.data.entries || []);
       setTotalEntries(response.data.total || 0);
+      setNextCursor(response.data.next_cursor || null);
     } catch (err) {
       setError('Ошибка загрузки журнала: ' + err.message);
       console.error(err);
@@ -49,14 +89,45 @@ const Journal = () => {
     }
   };
 
+  // Следующая страница по курсору (без повторного подсчёта записей)
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    try {
+      setLoadingMore(true);
+      const response = await journalApi.getEntries({
+        ...buildParams(),
+        cursor: nextCursor,
+        include_total: false
+      });
+      setEntries(prev => [...prev, ...(response.data.entries || [])]);
+      setNextCursor(response.data.next_cursor || null);
+    } catch (err) {
+      setError('Ошибка загрузки журнала: ' + err.message);
+      console.error(err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // Экспорт собирается в фоне (или сразу берётся из кэша, если журнал не менялся)
   const handleExport = async () => {
     try {
+      setExporting(true);
       const params = { year: yearFilter };
       if (monthFilter) {
         params.month = monthFilter;
       }
 
-      const response = await journalApi.exportToXlsx(params);
+      let job = (await journalApi.startExport(params)).data;
+      while (job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, EXPORT_POLL_MS));
+        job = (await journalApi.getExport(job.job_id)).data;
+      }
+      if (job.status !== 'done') {
+        throw new Error(job.error || 'экспорт не собран');
+      }
+
+      const response = await journalApi.downloadExport(job.download_url);
 
       // Создаем ссылку для скачивания
       const url = window.URL.createObjectURL(new Blob([response.data]));
@@ -77,6 +148,26 @@ const Journal = () => {
     } catch (err) {
       alert('Ошибка экспорта: ' + err.message);
       console.error(err);
+    } finally {
+      setExporting(false);
+    }
+  };
+
+  // Файлы записи (PDF, подпись, приложения) скачиваются по запросу - список их не содержит
+  const handleDownloadFile = async (entry, kind, suffix) => {
+    try {
+      const response = await journalApi.downloadFile(entry.id, kind);
+      const url = window.URL.createObjectURL(new Blob([response.data]));
+      const link = document.createElement('a');
+      link.href = url;
+      link.setAttribute('download', `${entry.formatted_number}${suffix}`);
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      window.URL.revokeObjectURL(url);
+    } catch (err) {
+      alert('Ошибка скачивания файла: ' + err.message);
+      console.error(err);
     }
   };
 
@@ -195,6 +286,20 @@ const Journal = () => {
         <h2 style={{ margin: 0 }}>Журнал исходящей корреспонденции</h2>
 
         <div style={{ display: 'flex', gap: '10px', alignItems: 'center', flexWrap: 'wrap' }}>
+          {/* Поиск */}
+          <input
+            type="search"
+            value={searchInput}
+            onChange={(e) => setSearchInput(e.target.value)}
+            placeholder="Поиск: номер, адресат, содержание"
+            style={{
+              padding: '8px 12px',
+              borderRadius: '4px',
+              border: '1px solid #ddd',
+              minWidth: '260px'
+            }}
+          />
+
           {/* Год */}
           <select
             value={yearFilter}
@@ -246,18 +351,18 @@ const Journal = () => {
           {/* Кнопка экспорта */}
           <button
             onClick={handleExport}
-            disabled={loading || entries.length === 0}
+            disabled={loading || exporting || entries.length === 0}
             style={{
               padding: '8px 16px',
               background: entries.length > 0 ? '#4b5563' : '#d1d5db',
               color: 'white',
               border: 'none',
               borderRadius: '4px',
-              cursor: entries.length > 0 ? 'pointer' : 'not-allowed',
+              cursor: entries.length > 0 && !exporting ? 'pointer' : 'not-allowed',
               fontWeight: '500'
             }}
           >
-            Экспорт в Excel
+            {exporting ? 'Экспорт...' : 'Экспорт в Excel'}
           </button>
         </div>
       </div>
@@ -277,7 +382,7 @@ const Journal = () => {
           background: '#f9f9f9',
           borderRadius: '8px'
         }}>
-          Нет записей за выбранный период
+          {searchQuery ? `Ничего не найдено по запросу «${searchQuery}»` : 'Нет записей за выбранный период'}
         </div>
       ) : (
         <div style={{ overflowX: 'auto', overflowY: 'auto', maxHeight: 'calc(100vh - 220px)' }}>
@@ -313,11 +418,28 @@ const Journal = () => {
                   <td style={cellStyle}>{entry.outgoing_no}</td>
                   <td style={{...cellStyle, fontWeight: '500'}}>{entry.formatted_number}</td>
                   <td style={cellStyle}>{formatDate(entry.outgoing_date)}</td>
-                  <td style={cellStyle}>{entry.to_whom || '-'}</td>
-                  <td style={{...cellStyle, maxWidth: '300px', overflow: 'hidden', textOverflow: 'ellipsis'}} title={entry.content || ''}>{entry.content || '-'}</td>
+                  <td style={cellStyle}>
+                    {entry.highlight?.to_whom ? <Highlighted text={entry.highlight.to_whom} /> : (entry.to_whom || '-')}
+                  </td>
+                  <td style={{...cellStyle, maxWidth: '300px', overflow: 'hidden', textOverflow: 'ellipsis'}} title={entry.content || ''}>
+                    {entry.highlight?.content ? <Highlighted text={entry.highlight.content} /> : (entry.content || '-')}
+                  </td>
                   <td style={cellStyle}>{entry.executor || '-'}</td>
                   <td style={{...cellStyle, fontSize: '12px', color: '#666'}}>
                     {entry.folder_path || '-'}
+                    {(entry.has_file || entry.has_sig || entry.has_attachments) && (
+                      <div style={{ marginTop: '4px', display: 'flex', gap: '8px' }}>
+                        {entry.has_file && (
+                          <a href="#" onClick={(e) => { e.preventDefault(); handleDownloadFile(entry, 'pdf', '.pdf'); }}>PDF</a>
+                        )}
+                        {entry.has_sig && (
+                          <a href="#" onClick={(e) => { e.preventDefault(); handleDownloadFile(entry, 'sig', '.pdf.sig'); }}>Подпись</a>
+                        )}
+                        {entry.has_attachments && (
+                          <a href="#" onClick={(e) => { e.preventDefault(); handleDownloadFile(entry, 'attachments', '_attachments.zip'); }}>Приложения</a>
+                        )}
+                      </div>
+                    )}
                   </td>
                   <td style={{...cellStyle, whiteSpace: 'nowrap'}}>
                     <button
@@ -355,59 +477,31 @@ const Journal = () => {
             </tbody>
           </table>
 
-          {/* Пагинация */}
-          {(() => {
-            const totalPages = Math.ceil(totalEntries / PAGE_SIZE);
-            return (
-              <div style={{
-                marginTop: '15px',
-                display: 'flex',
-                justifyContent: 'space-between',
-                alignItems: 'center',
-                color: '#666',
-                fontSize: '14px'
-              }}>
-                <span>
-                  Показано {currentPage * PAGE_SIZE + 1}–{Math.min((currentPage + 1) * PAGE_SIZE, totalEntries)} из {totalEntries}
-                </span>
-                {totalPages > 1 && (
-                  <div style={{ display: 'flex', gap: '6px', alignItems: 'center' }}>
-                    <button
-                      onClick={() => setCurrentPage(0)}
-                      disabled={currentPage === 0}
-                      style={paginationBtnStyle(currentPage === 0)}
-                    >
-                      &laquo;
-                    </button>
-                    <button
-                      onClick={() => setCurrentPage(p => p - 1)}
-                      disabled={currentPage === 0}
-                      style={paginationBtnStyle(currentPage === 0)}
-                    >
-                      &lsaquo;
-                    </button>
-                    <span style={{ padding: '0 8px' }}>
-                      Стр. {currentPage + 1} из {totalPages}
-                    </span>
-                    <button
-                      onClick={() => setCurrentPage(p => p + 1)}
-                      disabled={currentPage >= totalPages - 1}
-                      style={paginationBtnStyle(currentPage >= totalPages - 1)}
-                    >
-                      &rsaquo;
-                    </button>
-                    <button
-                      onClick={() => setCurrentPage(totalPages - 1)}
-                      disabled={currentPage >= totalPages - 1}
-                      style={paginationBtnStyle(currentPage >= totalPages - 1)}
-                    >
-                      &raquo;
-                    </button>
-                  </div>
-                )}
-              </div>
-            );
-          })()}
+          {/* Подгрузка следующих страниц */}
+          <div
+            ref={loadMoreRef}
+            style={{
+              marginTop: '15px',
+              display: 'flex',
+              justifyContent: 'space-between',
+              alignItems: 'center',
+              color: '#666',
+              fontSize: '14px'
+            }}
+          >
+            <span>
+              Показано {entries.length} из {Math.max(totalEntries, entries.length)}
+            </span>
+            {nextCursor && (
+              <button
+                onClick={loadMore}
+                disabled={loadingMore}
+                style={paginationBtnStyle(loadingMore)}
+              >
+                {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+              </button>
+            )}
+          </div>
         </div>
       )}
 
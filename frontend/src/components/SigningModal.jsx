@@ -2,7 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { outboxApi } from '../services/api';
 
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
-const SigningModal = ({ isOpen, onClose, fileId, pdfFile, cardId, outgoingNo, formattedNumber, outgoingDate, toWhom, executor, onSuccess }) => {
+const SigningModal = ({ isOpen, onClose, fileId, pdfFile, onSuccess }) => {
   const [certificates, setCertificates] = useState([]);
   const [selectedCert, setSelectedCert] = useState(null);
   const [loading, setLoading] = useState(false);
@@ -131,31 +131,10 @@ const SigningModal = ({ isOpen, onClose, fileId, pdfFile, cardId, outgoingNo, fo
     }
 
     setLoading(true);
-    setStatus('Загрузка PDF...');
+    setStatus('Получение сертификата...');
 
     try {
-      // 1. Получаем PDF
-      const token = localStorage.getItem('token');
-      const pdfResponse = await fetch(`${API_BASE_URL}/api/outbox/download/${pdfFile}`, {
-        headers: {
-          'Authorization': `Bearer ${token}`
-        }
-      });
-
-      if (!pdfResponse.ok) {
-        throw new Error(`Ошибка загрузки PDF: ${pdfResponse.status}`);
-      }
-
-      const pdfBlob = await pdfResponse.blob();
-      const pdfArrayBuffer = await pdfBlob.arrayBuffer();
-      setStatus(`PDF загружен (${pdfArrayBuffer.byteLength} байт)`);
-
-      // 2. Конвертируем в Base64
-      setStatus('Подготовка данных...');
-      const pdfBase64 = arrayBufferToBase64(pdfArrayBuffer);
-
-      // 3. Получаем сертификат
-      setStatus('Получение сертификата...');
+      // 1. Получаем сертификат
       const store = await cadesplugin.CreateObjectAsync("CAdESCOM.Store");
       await store.Open(
         cadesplugin.CAPICOM_CURRENT_USER_STORE,
@@ -177,41 +156,85 @@ const SigningModal = ({ isOpen, onClose, fileId, pdfFile, cardId, outgoingNo, fo
       const cert = await foundCerts.Item(1);
       await store.Close();
 
-      // 4. Создаём подпись
-      setStatus('Создание подписи (может появиться окно PIN)...');
-
       const signer = await cadesplugin.CreateObjectAsync("CAdESCOM.CPSigner");
       await signer.propset_Certificate(cert);
       await signer.propset_CheckCertificate(true);
 
       const signedData = await cadesplugin.CreateObjectAsync("CAdESCOM.CadesSignedData");
-      await signedData.propset_ContentEncoding(cadesplugin.CADESCOM_BASE64_TO_BINARY);
-      await signedData.propset_Content(pdfBase64);
 
-      const signature = await signedData.SignCades(
-        signer,
-        cadesplugin.CADESCOM_CADES_BES,
-        true  // detached = true
-      );
+      // 2. Подписываем хэш, посчитанный сервером (PDF не скачивается),
+      // если сервер умеет считать хэш ГОСТ и алгоритм ключа известен
+      const hashAlgorithm = await getHashAlgorithm(cert);
+      let digest = null;
+      if (hashAlgorithm) {
+        try {
+          const hashResponse = await outboxApi.getDocumentHash(fileId);
+          digest = hashResponse.data.digests?.[hashAlgorithm.name] || null;
+        } catch (hashErr) {
+          console.warn('Хэш документа недоступен, подписываем весь PDF:', hashErr);
+        }
+      }
+
+      let signature;
+      if (digest) {
+        setStatus('Создание подписи по хэшу (может появиться окно PIN)...');
+
+        const hashedData = await cadesplugin.CreateObjectAsync("CAdESCOM.HashedData");
+        await hashedData.propset_Algorithm(hashAlgorithm.id);
+        await hashedData.SetHashValue(digest);
+
+        signature = await signedData.SignHash(
+          hashedData,
+          signer,
+          cadesplugin.CADESCOM_CADES_BES
+        );
+      } else {
+        // 3. Хэш недоступен - скачиваем и подписываем весь PDF
+        setStatus('Загрузка PDF...');
+        const token = localStorage.getItem('token');
+        const pdfResponse = await fetch(`${API_BASE_URL}/api/outbox/download/${pdfFile}`, {
+          headers: {
+            'Authorization': `Bearer ${token}`
+          }
+        });
+
+        if (!pdfResponse.ok) {
+          throw new Error(`Ошибка загрузки PDF: ${pdfResponse.status}`);
+        }
+
+        const pdfBlob = await pdfResponse.blob();
+        const pdfArrayBuffer = await pdfBlob.arrayBuffer();
+        setStatus(`PDF загружен (${pdfArrayBuffer.byteLength} байт)`);
+
+        setStatus('Подготовка данных...');
+        const pdfBase64 = arrayBufferToBase64(pdfArrayBuffer);
+
+        setStatus('Создание подписи (может появиться окно PIN)...');
+        await signedData.propset_ContentEncoding(cadesplugin.CADESCOM_BASE64_TO_BINARY);
+        await signedData.propset_Content(pdfBase64);
+
+        signature = await signedData.SignCades(
+          signer,
+          cadesplugin.CADESCOM_CADES_BES,
+          true  // detached = true
+        );
+      }
 
       setStatus('Отправка подписи на сервер...');
 
-      // 5. Отправляем на сервер с данными для журнала
-      await outboxApi.uploadClientSignature({
-        file_id: fileId,
-        signature: signature,
-        thumbprint: selectedCert.thumbprint,
-        cn: selectedCert.cn,
-        // Данные для записи в журнал
-        card_id: cardId,
-        outgoing_no: outgoingNo,
-        formatted_number: formattedNumber,
-        outgoing_date: outgoingDate,
-        to_whom: toWhom,
-        executor: executor
-      });
-
-      setStatus('✅ Подпись успешно создана!');
+      // 4. Отправляем подпись файлом (DER, без Base64); данные для журнала сервер берёт из сессии регистрации
+      const signatureBlob = base64ToBlob(signature);
+      const formData = new FormData();
+      formData.append('signature', signatureBlob, `${fileId}.sig`);
+      formData.append('sha256', await sha256Hex(signatureBlob));
+      formData.append('file_id', fileId);
+      formData.append('thumbprint', selectedCert.thumbprint);
+      formData.append('cn', selectedCert.cn);
+      await outboxApi.uploadClientSignatureFile(formData);
+
+      // Подпись принята; папка исходящих и журнал заполняются на сервере в фоне
+      setStatus('✅ Подпись принята. Документ записывается в журнал...');
+      setStatus(await waitForFinalization(fileId));
       setLoading(false);
 
       // Уведомляем родительский компонент
@@ -228,6 +251,43 @@ const SigningModal = ({ isOpen, onClose, fileId, pdfFile, cardId, outgoingNo, fo
     }
   };
 
+  // Недолго ждём фоновую запись в журнал - если сервер не успел, она завершится без нас
+  const waitForFinalization = async (id, attempts = 5) => {
+    for (let i = 0; i < attempts; i++) {
+      await new Promise(resolve => setTimeout(resolve, 1000));
+      try {
+        const { data } = await outboxApi.getStatus(id);
+        if (data.status === 'finalized') {
+          return '✅ Подпись принята, документ записан в журнал';
+        }
+        if (data.status === 'failed') {
+          return `⚠ Подпись принята, но запись в журнал не удалась: ${data.finalization?.error || 'неизвестная ошибка'}`;
+        }
+      } catch (err) {
+        console.warn('Не удалось получить статус документа:', err);
+      }
+    }
+    return '✅ Подпись принята. Запись в журнал завершится на сервере';
+  };
+
+  // Алгоритм хэширования ГОСТ Р 34.11-2012 по алгоритму ключа сертификата
+  const getHashAlgorithm = async (cert) => {
+    try {
+      const publicKey = await cert.PublicKey();
+      const algorithm = await publicKey.Algorithm;
+      const oid = await algorithm.Value;
+      if (oid === '1.2.643.7.1.1.1.1') {
+        return { name: 'gost3411_2012_256', id: cadesplugin.CADESCOM_HASH_ALGORITHM_CP_GOST_3411_2012_256 };
+      }
+      if (oid === '1.2.643.7.1.1.1.2') {
+        return { name: 'gost3411_2012_512', id: cadesplugin.CADESCOM_HASH_ALGORITHM_CP_GOST_3411_2012_512 };
+      }
+    } catch (err) {
+      console.warn('Не удалось определить алгоритм ключа:', err);
+    }
+    return null;
+  };
+
   const arrayBufferToBase64 = (buffer) => {
     let binary = '';
     const bytes = new Uint8Array(buffer);
@@ -237,6 +297,22 @@ const SigningModal = ({ isOpen, onClose, fileId, pdfFile, cardId, outgoingNo, fo
     return btoa(binary);
   };
 
+  const base64ToBlob = (base64) => {
+    const binary = atob(base64.replace(/\s/g, ''));
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+      bytes[i] = binary.charCodeAt(i);
+    }
+    return new Blob([bytes], { type: 'application/octet-stream' });
+  };
+
+  // Контрольная сумма подписи - сервер проверяет целостность загрузки
+  const sha256Hex = async (blob) => {
+    if (!window.crypto?.subtle) return '';
+    const hash = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(hash)).map(b => b.toString(16).padStart(2, '0')).join('');
+  };
+
   if (!isOpen) return null;
 
   return (
@@ -37,6 +37,28 @@ api.interceptors.response.use(
   }
 );
 
+// POST с заголовком Idempotency-Key. Если ответ не получен (обрыв сети, таймаут),
+// запрос повторяется с тем же ключом - сервер вернёт сохранённый результат, а не выполнит его заново
+const newIdempotencyKey = () =>
+  (window.crypto?.randomUUID ? window.crypto.randomUUID() : `${Date.now()}-${Math.random().toString(16).slice(2)}`);
+
+const postIdempotent = async (url, data, config = {}, retries = 2) => {
+  const requestConfig = {
+    ...config,
+    headers: { ...(config.headers || {}), 'Idempotency-Key': newIdempotencyKey() },
+  };
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await api.post(url, data, requestConfig);
+    } catch (error) {
+      if (error.response || attempt >= retries) {
+        throw error;
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+    }
+  }
+};
+
 // API методы для авторизации
 export const authApi = {
   login: (username, password) =>
@@ -74,6 +96,10 @@ export const filesApi = {
 export const journalApi = {
   getEntries: (params) => api.get('/api/journal/entries', { params }),
   exportToXlsx: (params) => api.get('/api/journal/export/xlsx', { params, responseType: 'blob' }),
+  startExport: (params) => api.post('/api/journal/export/jobs', null, { params }),
+  getExport: (jobId) => api.get(`/api/journal/export/jobs/${jobId}`),
+  downloadExport: (url) => api.get(url, { responseType: 'blob' }),
+  downloadFile: (id, kind) => api.get(`/api/journal/entries/${id}/files/${kind}`, { responseType: 'blob' }),
   createEntry: (data) => api.post('/api/journal/entries', data),
   updateEntry: (id, data) => api.put(`/api/journal/entries/${id}`, data),
   deleteEntry: (id) => api.delete(`/api/journal/entries/${id}`),
@@ -83,12 +109,24 @@ export const journalApi = {
 // API методы для outbox (регистрация и подписание)
 export const outboxApi = {
   prepareRegistration: (cardId, selectedFileName) =>
-    api.post('/api/outbox/prepare-registration', {
+    postIdempotent('/api/outbox/prepare-registration', {
       card_id: cardId,
       selected_file_name: selectedFileName
     }),
   uploadClientSignature: (data) =>
-    api.post('/api/outbox/upload-client-signature', data),
+    postIdempotent('/api/outbox/upload-client-signature', data),
+  uploadClientSignatureFile: (formData) =>
+    postIdempotent('/api/outbox/upload-client-signature/binary', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' }
+    }),
+  getDocumentHash: (fileId) => api.get(`/api/outbox/hash/${fileId}`),
+  getStatus: (fileId) => api.get(`/api/outbox/status/${fileId}`),
+  batchPrepare: (items) =>
+    api.post('/api/outbox/batch/prepare', { items }),
+  batchUploadSignatures: (batchId, formData) =>
+    api.post(`/api/outbox/batch/${batchId}/signatures`, formData, {
+      headers: { 'Content-Type': 'multipart/form-data' }
+    }),
 };
 
 export default api;